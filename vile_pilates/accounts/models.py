@@ -1,4 +1,6 @@
 # accounts/models.py
+import unicodedata
+
 from django.utils import timezone
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
@@ -40,7 +42,19 @@ class CustomUser(AbstractUser):
         return self.username
 
 
+def normalize_search_text(text):
+    """Minúsculas y sin acentos (mismo criterio que strip_accents de los importadores)."""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", str(text))
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return " ".join(text.lower().split())
+
+
 class Client(models.Model):
+    # Campos que se copian, normalizados, a search_text
+    SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'dpi')
+
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     email = models.EmailField(null=True, blank=True)
@@ -87,6 +101,29 @@ class Client(models.Model):
     )
     trial_used = models.BooleanField(default=False)
 
+    # Snapshot del último pago (por date_paid). Lo mantiene
+    # studio.utils.refresh_payment_snapshots cada vez que se crea, edita o
+    # elimina un Payment; no se edita a mano.
+    latest_payment = models.ForeignKey(
+        'studio.Payment',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    latest_payment_membership = models.ForeignKey(
+        'studio.Membership',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+    )
+    latest_valid_until = models.DateField(null=True, blank=True)
+    # Inasistencias seguidas en sus últimas clases pasadas (ver studio.alerts)
+    no_show_streak = models.PositiveIntegerField(default=0, db_index=True)
+    # "nombre apellido email teléfono dpi" normalizado para búsqueda (ver save)
+    search_text = models.CharField(max_length=512, blank=True, default='', db_index=True, editable=False)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -99,18 +136,57 @@ class Client(models.Model):
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-    @property
-    def active_membership(self):
+    def build_search_text(self):
+        return normalize_search_text(" ".join(str(getattr(self, f) or "") for f in self.SEARCH_FIELDS))
 
-        from studio.models import Payment
+    def save(self, *args, **kwargs):
+        from .search import sync_search_tokens
+
+        self.search_text = self.build_search_text()
+        update_fields = kwargs.get('update_fields')
+        search_changed = update_fields is None or bool(set(update_fields) & set(self.SEARCH_FIELDS))
+        if update_fields is not None and search_changed:
+            kwargs['update_fields'] = {*update_fields, 'search_text'}
+        super().save(*args, **kwargs)
+        if search_changed:
+            sync_search_tokens([self])
 
-        latest_payment = (
-            Payment.objects.filter(client=self).order_by("-date_paid").first()
+    @property
+    def has_active_membership(self):
+        return bool(
+            self.latest_valid_until
+            and self.latest_valid_until >= timezone.localdate()
         )
-        if latest_payment and latest_payment.valid_until >= timezone.now().date():
-            return latest_payment.membership
+
+    @property
+    def active_membership(self):
+        if self.has_active_membership:
+            return self.latest_payment_membership
         return None
     
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
+
+
+class ClientSearchToken(models.Model):
+    """
+    Cada palabra de Client.search_text en su propia fila. Buscar por prefijo
+    de palabra sobre ``token`` usa el índice; un LIKE '%x%' sobre search_text
+    recorre la tabla completa (ver accounts.search).
+    """
+    TOKEN_LENGTH = 100
+
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=TOKEN_LENGTH)
+
+    class Meta:
+        unique_together = ('client', 'token')
+        indexes = [
+            # varchar_pattern_ops: en PostgreSQL el índice sirve LIKE 'x%' con
+            # cualquier collation. SQLite ignora la opción (índice normal).
+            models.Index(fields=['token'], name='client_search_token_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return f"{self.client_id}: {self.token}"
@@ -0,0 +1,79 @@
+# accounts/search.py
+from django.db import connections, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Client, ClientSearchToken, normalize_search_text
+
+# Clientes por DELETE/INSERT al reescribir sus palabras
+TOKEN_SYNC_BATCH = 500
+
+
+def search_tokens(text):
+    """Palabras distintas del texto normalizado, recortadas al largo de la columna."""
+    return {word[:ClientSearchToken.TOKEN_LENGTH] for word in normalize_search_text(text).split()}
+
+
+def sync_search_tokens(clients):
+    """
+    Reescribe las ClientSearchToken de los clientes dados desde sus campos de
+    búsqueda. Client.save lo llama solo; después de bulk_create/bulk_update
+    hay que llamarlo a mano (importador, generate_studio_data,
+    rebuild_client_search).
+    """
+    clients = [c for c in clients if c.pk is not None]
+    total = 0
+    for start in range(0, len(clients), TOKEN_SYNC_BATCH):
+        batch = clients[start:start + TOKEN_SYNC_BATCH]
+        rows = [
+            ClientSearchToken(client_id=client.pk, token=token)
+            for client in batch
+            for token in sorted(search_tokens(client.build_search_text()))
+        ]
+        with transaction.atomic():
+            ClientSearchToken.objects.filter(client_id__in=[c.pk for c in batch]).delete()
+            ClientSearchToken.objects.bulk_create(rows)
+        total += len(rows)
+    return total
+
+
+def _token_prefix(token, using):
+    """
+    Palabras que empiezan con ``token``, de forma que las sirva el índice de
+    ClientSearchToken.token: LIKE 'x%' en PostgreSQL (varchar_pattern_ops) y
+    un rango en SQLite, cuyo LIKE no distingue mayúsculas y no usa índices.
+    """
+    if connections[using].vendor == 'sqlite':
+        return Q(token__gte=token, token__lt=token[:-1] + chr(ord(token[-1]) + 1))
+    return Q(token__startswith=token)
+
+
+def search_clients(query, queryset=None):
+    """
+    Búsqueda de clientes sin acentos ni mayúsculas.
+
+    Cada palabra de la búsqueda debe ser el inicio de alguna palabra del
+    cliente (nombre, apellido, email, teléfono o DPI). El orden es:
+    coincidencia exacta de DPI/teléfono/email, luego nombre que empieza con
+    la búsqueda, luego alguna palabra que empieza con ella, y el resto.
+    """
+    if queryset is None:
+        queryset = Client.objects.all()
+
+    raw = query.strip()
+    normalized = normalize_search_text(raw)
+    if not normalized:
+        return queryset.none()
+
+    for token in search_tokens(normalized):
+        matches = ClientSearchToken.objects.filter(_token_prefix(token, queryset.db))
+        queryset = queryset.filter(pk__in=matches.values('client_id'))
+
+    return queryset.annotate(
+        search_rank=Case(
+            When(Q(dpi=raw) | Q(phone=raw) | Q(email__iexact=raw), then=Value(0)),
+            When(search_text__startswith=normalized, then=Value(1)),
+            When(search_text__contains=f" {normalized}", then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank', 'first_name', 'last_name', 'id')
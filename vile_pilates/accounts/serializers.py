@@ -29,6 +29,7 @@ class ClientSerializer(serializers.ModelSerializer):
             'status': {'required': False},
             'age': {'required': False, 'allow_null': True},
         }
+        read_only_fields = ['latest_payment', 'latest_payment_membership', 'latest_valid_until', 'no_show_streak']
 
     def get_active_membership(self, obj):
         if obj.active_membership:
@@ -42,6 +43,14 @@ class ClientSerializer(serializers.ModelSerializer):
         return None
     
 
+class ClientCompactSerializer(serializers.ModelSerializer):
+    """Datos básicos del cliente para listados; no hace consultas adicionales."""
+
+    class Meta:
+        model = Client
+        fields = ['id', 'first_name', 'last_name', 'email', 'phone', 'dpi', 'status']
+
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
@@ -0,0 +1,74 @@
+# accounts/status.py
+
+MENSAJES_POR_ESTADO = {
+    'nuevo': "Bienvenido, agenda tu clase de prueba gratuita.",
+    'conClaseGratisPendienteYPlanSeleccionado': "Puedes usar tu clase gratuita o activar el plan que seleccionaste.",
+    'conClaseGratisUsada': "Ya usaste tu clase gratuita. Suscríbete para seguir entrenando con nosotros.",
+    'conClaseGratisUsadaYPlanSeleccionado': "Ya usaste tu clase gratuita. Tienes un plan pendiente, actívalo para continuar entrenando con nosotros.",
+    'conPlanActivo': "Tu plan está activo. Puedes agendar tus clases.",
+    'desconocido': "No pudimos determinar tu estado, por favor contáctanos."
+}
+
+
+def _estado(trial_used, plan_activo, plan_intent):
+    if not trial_used and not plan_intent:
+        return 'nuevo'
+    elif not trial_used and plan_intent:
+        return 'conClaseGratisPendienteYPlanSeleccionado'
+    elif trial_used and not plan_activo and plan_intent:
+        return 'conClaseGratisUsadaYPlanSeleccionado'
+    elif trial_used and not plan_activo and not plan_intent:
+        return 'conClaseGratisUsada'
+    elif plan_activo:
+        return 'conPlanActivo'
+    return 'desconocido'
+
+
+def pending_plan_intents(client_ids):
+    """{client_id: último PlanIntent sin confirmar} con una sola consulta."""
+    from studio.models import PlanIntent
+
+    intents = {}
+    rows = PlanIntent.objects.filter(
+        client_id__in=set(client_ids), is_confirmed=False
+    ).select_related('membership').order_by('client_id', '-selected_at', '-id')
+    for intent in rows:
+        intents.setdefault(intent.client_id, intent)
+    return intents
+
+
+def client_statuses(clients):
+    """
+    Estado de varios clientes: {client_id: {...}}.
+
+    El plan activo sale del snapshot del último pago guardado en Client
+    (latest_valid_until) y los planes pendientes de una sola consulta, así que
+    el número de consultas no depende de cuántos clientes se pidan.
+    """
+    clients = list(clients)
+    intents = pending_plan_intents(c.id for c in clients)
+
+    statuses = {}
+    for client in clients:
+        plan_activo = client.has_active_membership
+        plan_intent = intents.get(client.id)
+        estado = _estado(client.trial_used, plan_activo, plan_intent)
+
+        statuses[client.id] = {
+            "estado": estado,
+            "puede_agendar": not client.trial_used or plan_activo,
+            "trial_used": client.trial_used,
+            "plan_activo": plan_activo,
+            "plan_seleccionado": bool(plan_intent),
+            "mensaje": MENSAJES_POR_ESTADO.get(estado, ''),
+            "plan_intent": {
+                "membership_id": plan_intent.membership.id,
+                "membership_name": plan_intent.membership.name,
+                "price": plan_intent.membership.price
+            } if plan_intent else None
+        }
+    return statuses
+
+
+def client_status(client):
+    return client_statuses([client])[client.id]
@@ -1,3 +1,180 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Client, ClientSearchToken, CustomUser
+from accounts.search import search_clients
+from accounts.views import MAX_STATUS_BATCH
+from studio.models import Membership, PlanIntent
+from studio.tests import EndpointQueryBudgetMixin
+
+
+class AccountsEndpointQueryBudgetTests(EndpointQueryBudgetMixin, TestCase):
+    endpoints = [
+        ('users-list', 'get', '/api/accounts/users/', {}, 2),
+        ('users-detail', 'get', '/api/accounts/users/{user}/', {}, 2),
+        ('users-coaches', 'get', '/api/accounts/users/coaches/', {}, 3),
+        ('clients-list', 'get', '/api/accounts/clients/', {}, 1),
+        ('clients-search', 'get', '/api/accounts/clients/', {'q': 'cliente1'}, 1),
+        ('clients-detail', 'get', '/api/accounts/clients/{client}/', {}, 1),
+        ('clients-autocomplete', 'get', '/api/accounts/clients/autocomplete/', {'q': 'clie'}, 1),
+        ('clients-estado', 'get', '/api/accounts/clients/{client}/estado/', {}, 2),
+        ('clients-dpi', 'get', '/api/accounts/clients/dpi/', {'dpi': '{dpi}'}, 2),
+        ('clients-estados', 'get', '/api/accounts/clients/estados/', {'ids': '{client_ids}'}, 2),
+        ('clients-count', 'get', '/api/accounts/clients/count/', {}, 1),
+        ('me', 'get', '/api/accounts/me/', {}, 1),
+    ]
+
+
+class ClientSearchTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+
+    def make_client(self, first_name, last_name, **kwargs):
+        kwargs.setdefault('dpi', f'97{Client.objects.count():04d}')
+        return Client.objects.create(first_name=first_name, last_name=last_name, **kwargs)
+
+    def names(self, query):
+        return [f'{c.first_name} {c.last_name}' for c in search_clients(query)]
+
+    def test_search_text_is_rebuilt_on_save(self):
+        client = self.make_client('José', 'ÁLVAREZ', email='Jose@Example.com', phone='5555 0001', dpi='2999')
+        self.assertEqual(client.search_text, 'jose alvarez jose@example.com 5555 0001 2999')
+
+        client.last_name = 'Muñoz'
+        client.save(update_fields=['last_name'])
+        client.refresh_from_db()
+        self.assertEqual(client.search_text, 'jose munoz jose@example.com 5555 0001 2999')
+        self.assertEqual(self.names('munoz'), ['José Muñoz'])
+
+    def test_tokens_follow_saves_and_deletes(self):
+        client = self.make_client('Ana', 'Pérez', email='ana@example.com')
+        self.assertEqual(sorted(client.search_tokens.values_list('token', flat=True)),
+                         ['970000', 'ana', 'ana@example.com', 'perez'])
+        self.assertEqual(self.names('ana@exa'), ['Ana Pérez'])
+
+        client.email = None
+        client.save(update_fields=['email'])
+        self.assertEqual(self.names('ana@exa'), [])
+        client.notes = 'sin cambios de búsqueda'
+        client.save(update_fields=['notes'])
+        self.assertEqual(self.names('pere'), ['Ana Pérez'])
+
+        client.delete()
+        self.assertFalse(ClientSearchToken.objects.exists())
+
+    def test_search_text_is_rebuilt_after_bulk_update(self):
+        client = self.make_client('Ana', 'Pérez')
+        Client.objects.filter(pk=client.pk).update(last_name='Gómez')
+        self.assertEqual(self.names('gomez'), [])  # update() no pasa por save()
+
+        call_command('rebuild_client_search', stdout=StringIO())
+        self.assertEqual(self.names('gomez'), ['Ana Gómez'])
+
+    def test_every_token_must_match_in_any_order(self):
+        self.make_client('Ana María', 'López')
+        self.make_client('Ana', 'Pérez')
+        self.make_client('Luis', 'López')
+
+        self.assertEqual(self.names('ana lopez'), ['Ana María López'])
+        self.assertEqual(self.names('  lopez   ANA '), ['Ana María López'])
+        self.assertEqual(set(self.names('ana')), {'Ana María López', 'Ana Pérez'})
+        self.assertEqual(self.names('ana gomez'), [])
+
+    def test_accents_and_case_are_ignored(self):
+        self.make_client('José', 'Núñez')
+        self.make_client('JOSE', 'nunez')
+        for query in ('jose nunez', 'JOSÉ NÚÑEZ', 'José', 'NUÑEZ'):
+            with self.subTest(query=query):
+                self.assertEqual(set(self.names(query)), {'José Núñez', 'JOSE nunez'})
+
+    def test_rank_order(self):
+        self.make_client('Omar', 'Díaz')  # "mar" no empieza ninguna palabra
+        word = self.make_client('Ana', 'Marroquín')
+        prefix = self.make_client('Marta', 'Ruiz')
+        self.assertEqual(list(search_clients('mar')), [prefix, word])
+
+        exact = self.make_client('Zoe', 'Zamora', dpi='1234567')
+        self.make_client('Abel', 'Arias', phone='1234567890')
+        self.assertEqual(search_clients('1234567').first(), exact)
+        self.assertEqual(search_clients('ZOE@example.com').count(), 0)
+
+        exact.email = 'zoe@example.com'
+        exact.save()
+        self.make_client('Zoe', 'Zoe@example.com.gt')
+        self.assertEqual(search_clients('ZOE@example.com').first(), exact)
+
+    def test_list_endpoint_uses_search(self):
+        self.make_client('Marta', 'Ruiz')
+        self.make_client('Ana', 'Marroquín')
+        self.make_client('Luis', 'Pérez')
+
+        response = self.api.get('/api/accounts/clients/', {'q': 'MÁR'})
+        self.assertEqual([c['first_name'] for c in response.data['results']], ['Marta', 'Ana'])
+        response = self.api.get('/api/accounts/clients/autocomplete/', {'q': 'ruiz mar'})
+        self.assertEqual([c['name'] for c in response.data], ['Marta Ruiz'])
+
+
+class ClientStatusBatchTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.today = timezone.localdate()
+
+    def make_client(self, dpi, valid_until=None, **kwargs):
+        client = Client.objects.create(first_name='Cliente', last_name=dpi, dpi=dpi, **kwargs)
+        Client.objects.filter(pk=client.pk).update(latest_valid_until=valid_until)
+        return client
+
+    def estados(self, method='get', **data):
+        if method == 'get':
+            data = {k: ','.join(map(str, v)) for k, v in data.items()}
+            return self.api.get('/api/accounts/clients/estados/', data)
+        return self.api.post('/api/accounts/clients/estados/', data, format='json')
+
+    def test_batch_statuses(self):
+        nuevo = self.make_client('1001')
+        activo = self.make_client('1002', valid_until=self.today, trial_used=True)
+        vencido = self.make_client('1003', valid_until=self.today - timedelta(days=1), trial_used=True)
+        PlanIntent.objects.create(client=vencido, membership=self.plan)
+        pendiente = self.make_client('1004')
+        PlanIntent.objects.create(client=pendiente, membership=self.plan)
+
+        for method in ('get', 'post'):
+            with self.subTest(method=method):
+                response = self.estados(method, ids=[nuevo.id, activo.id, 999999], dpis=['1003', '1004', '0000'])
+                self.assertEqual(response.status_code, 200)
+                estados = {row['client_id']: (row['estado'], row['puede_agendar'], row['plan_activo'])
+                           for row in response.data['results']}
+                self.assertEqual(estados, {
+                    nuevo.id: ('nuevo', True, False),
+                    activo.id: ('conPlanActivo', True, True),
+                    vencido.id: ('conClaseGratisUsadaYPlanSeleccionado', False, False),
+                    pendiente.id: ('conClaseGratisPendienteYPlanSeleccionado', True, False),
+                })
+                self.assertEqual(response.data['not_found'], {'ids': ['999999'], 'dpis': ['0000']})
+
+    def test_active_plan_uses_local_date(self):
+        client = self.make_client('2001', valid_until=date(2025, 3, 1), trial_used=True)
+        # 03:00 UTC del 2 de marzo sigue siendo 1 de marzo en Guatemala
+        with mock.patch('django.utils.timezone.now', return_value=datetime(2025, 3, 2, 3, tzinfo=dt_timezone.utc)):
+            response = self.estados(ids=[client.id])
+        self.assertTrue(response.data['results'][0]['plan_activo'])
+
+    def test_batch_size_is_capped(self):
+        self.assertEqual(self.estados(ids=range(1, MAX_STATUS_BATCH + 1)).status_code, 200)
+        half = MAX_STATUS_BATCH // 2
+        response = self.estados('post', ids=list(range(1, half + 1)), dpis=[str(i) for i in range(half + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(MAX_STATUS_BATCH), response.data['detail'])
 
-# Create your tests here.
+    def test_invalid_requests(self):
+        self.assertEqual(self.estados().status_code, 400)
+        self.assertEqual(self.estados(ids=['1', 'abc']).status_code, 400)
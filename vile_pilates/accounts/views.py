@@ -1,9 +1,12 @@
 # accounts/views.py
 from rest_framework import viewsets, permissions
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from .models import CustomUser, Client
 from rest_framework.response import Response
 from .serializers import CustomUserSerializer, ClientSerializer
+from .search import search_clients
+from .status import client_status, client_statuses
+from django.db.models import Count, Q
 from rest_framework import filters
 from rest_framework.decorators import action
 from datetime import date
@@ -20,7 +23,7 @@ def get_current_user(request):
     return Response(serializer.data)
 
 class CustomUserViewSet(viewsets.ModelViewSet):
-    queryset = CustomUser.objects.all()
+    queryset = CustomUser.objects.prefetch_related('groups')
     serializer_class = CustomUserSerializer
     # Solo administradores podrán acceder a estos endpoints
     permission_classes = [permissions.IsAdminUser]
@@ -31,127 +34,133 @@ class CustomUserViewSet(viewsets.ModelViewSet):
         if not coach_group:
             return Response([], status=200)
 
-        coaches = CustomUser.objects.filter(groups=coach_group)
+        coaches = self.get_queryset().filter(groups=coach_group)
         serializer = self.get_serializer(coaches, many=True)
         return Response(serializer.data)
 
 
-# class ClientPagination(PageNumberPagination):
-#     page_size = 10
-#     page_size_query_param = 'page_size'
-#     max_page_size = 100
+class ClientPagination(CursorPagination):
+    # Cursor por id: cada página es un rango indexado, sin OFFSET ni COUNT(*)
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+# Máximo de clientes por solicitud en /clients/estados/
+MAX_STATUS_BATCH = 500
 
 
 class ClientViewSet(viewsets.ModelViewSet):
-    queryset = Client.objects.all().order_by('id')  # ← orden opcional
+    # El último pago vigente viene del snapshot en Client (latest_payment_membership /
+    # latest_valid_until), así ClientSerializer no hace consultas por fila.
+    queryset = Client.objects.select_related('current_membership', 'latest_payment_membership').order_by('id')
     serializer_class = ClientSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['email', 'first_name', 'last_name', 'phone', 'dpi']  # ← puedes buscar por más campos
-    # pagination_class = ClientPagination
+    pagination_class = ClientPagination
+
+    # Resultados máximos de ?q= y del autocompletado
+    SEARCH_LIMIT = 20
+    MAX_SEARCH_LIMIT = 100
+
+    def _search_limit(self, request, param):
+        try:
+            return min(max(1, int(request.query_params.get(param, self.SEARCH_LIMIT))), self.MAX_SEARCH_LIMIT)
+        except ValueError:
+            return self.SEARCH_LIMIT
+
+    def list(self, request, *args, **kwargs):
+        # ?q= búsqueda ordenada por relevancia (sin acentos); sin q, listado paginado por cursor
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            return super().list(request, *args, **kwargs)
+
+        clients = search_clients(q, self.get_queryset())[:self._search_limit(request, 'page_size')]
+        serializer = self.get_serializer(clients, many=True)
+        return Response({"next": None, "previous": None, "results": serializer.data})
+
+    @action(detail=False, methods=['get'], url_path='autocomplete')
+    def autocomplete(self, request):
+        q = request.query_params.get('q', '').strip()
+        if len(q) < 2:
+            return Response([])
+
+        clients = search_clients(q).values('id', 'first_name', 'last_name')[:self._search_limit(request, 'limit')]
+        return Response([
+            {"id": c['id'], "name": f"{c['first_name']} {c['last_name']}"}
+            for c in clients
+        ])
 
     @action(detail=True, methods=['get'], url_path='estado')
     def estado_cliente(self, request, pk=None):
         client = self.get_object()
+        return Response(client_status(client))
 
-        # Verificar membresía activa
-        latest_payment = Payment.objects.filter(client=client).order_by('-date_paid').first()
-        plan_activo = latest_payment and latest_payment.valid_until >= date.today()
-
-        # Verificar si tiene intención de plan pendiente (no confirmada)
-        plan_intent = PlanIntent.objects.filter(client=client, is_confirmed=False).order_by('-selected_at').first()
-
-        if not client.trial_used and not plan_intent:
-            estado = 'nuevo'
-        elif not client.trial_used and plan_intent:
-            estado = 'conClaseGratisPendienteYPlanSeleccionado'
-        elif client.trial_used and not plan_activo and plan_intent:
-            estado = 'conClaseGratisUsadaYPlanSeleccionado'
-        elif client.trial_used and not plan_activo and not plan_intent:
-            estado = 'conClaseGratisUsada'
-        elif plan_activo:
-            estado = 'conPlanActivo'
-        else:
-            estado = 'desconocido'
-
-        puede_agendar = not client.trial_used or plan_activo
-
-        return Response({
-            "estado": estado,
-            "puede_agendar": puede_agendar,
-            "trial_used": client.trial_used,
-            "plan_activo": bool(plan_activo),
-            "plan_seleccionado": bool(plan_intent),
-            "mensaje": self._mensaje_por_estado(estado),
-            "plan_intent": {
-                "membership_id": plan_intent.membership.id,
-                "membership_name": plan_intent.membership.name,
-                "price": plan_intent.membership.price
-            } if plan_intent else None
-        })
-
-    def _mensaje_por_estado(self, estado):
-        mensajes = {
-            'nuevo': "Bienvenido, agenda tu clase de prueba gratuita.",
-            'conClaseGratisPendienteYPlanSeleccionado': "Puedes usar tu clase gratuita o activar el plan que seleccionaste.",
-            'conClaseGratisUsada': "Ya usaste tu clase gratuita. Suscríbete para seguir entrenando con nosotros.",
-            'conClaseGratisUsadaYPlanSeleccionado': "Ya usaste tu clase gratuita. Tienes un plan pendiente, actívalo para continuar entrenando con nosotros.",
-            'conPlanActivo': "Tu plan está activo. Puedes agendar tus clases.",
-            'desconocido': "No pudimos determinar tu estado, por favor contáctanos."
-        }
-        return mensajes.get(estado, '')
-    
     @action(detail=False, methods=['get'], url_path='dpi')
     def client_por_dpi(self, request):
         dpi = request.query_params.get('dpi')
         if not dpi:
             return Response({"detail": "Se requiere el parámetro 'dpi'."}, status=400)
         
-        client = Client.objects.filter(dpi=dpi).first()
+        client = self.get_queryset().filter(dpi=dpi).first()
         if client:
-            # Reutilizamos la función de estado para obtener el estado del cliente
-            latest_payment = Payment.objects.filter(client=client).order_by('-date_paid').first()
-            plan_activo = latest_payment and latest_payment.valid_until >= date.today()
-            plan_intent = PlanIntent.objects.filter(client=client, is_confirmed=False).order_by('-selected_at').first()
-            if not client.trial_used and not plan_intent:
-                estado = 'nuevo'
-            elif not client.trial_used and plan_intent:
-                estado = 'conClaseGratisPendienteYPlanSeleccionado'
-            elif client.trial_used and not plan_activo and plan_intent:
-                estado = 'conClaseGratisUsadaYPlanSeleccionado'
-            elif client.trial_used and not plan_activo and not plan_intent:
-                estado = 'conClaseGratisUsada'
-            elif plan_activo:
-                estado = 'conPlanActivo'
-            else:
-                estado = 'desconocido'
-
-            puede_agendar = not client.trial_used or plan_activo
-            mensaje = {
-                'nuevo': "Bienvenido, agenda tu clase de prueba gratuita.",
-                'conClaseGratisPendienteYPlanSeleccionado': "Puedes usar tu clase gratuita o activar el plan que seleccionaste.",
-                'conClaseGratisUsada': "Ya usaste tu clase gratuita. Suscríbete para seguir entrenando con nosotros.",
-                'conClaseGratisUsadaYPlanSeleccionado': "Ya usaste tu clase gratuita. Tienes un plan pendiente, actívalo para continuar entrenando con nosotros.",
-                'conPlanActivo': "Tu plan está activo. Puedes agendar tus clases.",
-                'desconocido': "No pudimos determinar tu estado, por favor contáctanos."
-            }.get(estado, '')
-
             return Response({
                 "client": ClientSerializer(client).data,
-                "estado": estado,
-                "puede_agendar": puede_agendar,
-                "trial_used": client.trial_used,
-                "plan_activo": bool(plan_activo),
-                "plan_seleccionado": bool(plan_intent),
-                "mensaje": mensaje,
-                "plan_intent": {
-                    "membership_id": plan_intent.membership.id,
-                    "membership_name": plan_intent.membership.name,
-                    "price": plan_intent.membership.price
-                } if plan_intent else None
+                **client_status(client),
             })
         else:
             return Response({"detail": "No se encontró un cliente con ese DPI."}, status=404)
+
+    @action(detail=False, methods=['get', 'post'], url_path='estados')
+    def estados_clientes(self, request):
+        """
+        Estado de varios clientes a la vez, por id y/o DPI.
+        GET ?ids=1,2,3&dpis=123,456  o  POST {"ids": [...], "dpis": [...]}
+        Siempre usa dos consultas (clientes y planes pendientes).
+        """
+        def _values(name):
+            if request.method == 'POST':
+                values = request.data.get(name) or []
+                if not isinstance(values, list):
+                    values = [values]
+            else:
+                values = request.query_params.get(name, '').split(',')
+            return [str(v).strip() for v in values if str(v).strip()]
+
+        ids, dpis = _values('ids'), _values('dpis')
+        if not ids and not dpis:
+            return Response({"detail": "Se requiere 'ids' o 'dpis'."}, status=400)
+        if len(ids) + len(dpis) > MAX_STATUS_BATCH:
+            return Response({"detail": f"Máximo {MAX_STATUS_BATCH} clientes por solicitud."}, status=400)
+        if not all(i.isdigit() for i in ids):
+            return Response({"detail": "Los ids deben ser numéricos."}, status=400)
+
+        clients = list(
+            Client.objects.filter(Q(id__in=ids) | Q(dpi__in=dpis))
+            .only('id', 'dpi', 'first_name', 'last_name', 'trial_used', 'latest_valid_until')
+            .order_by('id')
+        )
+        statuses = client_statuses(clients)
+
+        found_ids = {str(c.id) for c in clients}
+        found_dpis = {c.dpi for c in clients}
+        return Response({
+            "results": [
+                {
+                    "client_id": c.id,
+                    "dpi": c.dpi,
+                    "name": f"{c.first_name} {c.last_name}",
+                    **statuses[c.id],
+                }
+                for c in clients
+            ],
+            "not_found": {
+                "ids": [i for i in ids if i not in found_ids],
+                "dpis": [d for d in dpis if d not in found_dpis],
+            },
+        })
         
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -169,8 +178,8 @@ class ClientViewSet(viewsets.ModelViewSet):
             (original_membership and not updated_membership)
         ):
             try:
-                from studio.management.mails.mails import send_membership_cancellation_email
-                send_membership_cancellation_email(updated_instance)
+                from studio.management.mails.mails import queue_email, membership_cancellation_message
+                queue_email('membership_cancellation', membership_cancellation_message(updated_instance))
             except Exception as e:
                 print(f"[ERROR] Falló envío de correo de cancelación: {str(e)}")
 
@@ -179,19 +188,12 @@ class ClientViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='count')
     def count_clients(self, request):
         today = timezone.now().date()
-        total = Client.objects.count()
-        active = Client.objects.filter(status='A').count()
-        inactive = Client.objects.filter(status='I').count()
-        new_this_month = Client.objects.filter(
-            created_at__year=today.year,
-            created_at__month=today.month
-        ).count()
-
-        return Response({
-            "total": total,
-            "active": active,
-            "inactive": inactive,
-            "new_this_month": new_this_month
-    })
+        counts = Client.objects.aggregate(
+            total=Count('id'),
+            active=Count('id', filter=Q(status='A')),
+            inactive=Count('id', filter=Q(status='I')),
+            new_this_month=Count('id', filter=Q(created_at__year=today.year, created_at__month=today.month)),
+        )
+        return Response(counts)
 
 
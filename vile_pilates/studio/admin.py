@@ -1,6 +1,6 @@
 # studio/admin.py
 from django.contrib import admin
-from .models import ClassType, PromotionInstance, Schedule, Membership, Payment, Booking, PlanIntent, MonthlyRevenue, Promotion, Venta
+from .models import ClassType, PromotionInstance, Schedule, Membership, Payment, Booking, PlanIntent, MonthlyRevenue, Promotion, Venta, ClassSeatLedger, MonthlyClassUsage, EmailOutbox, DailyClosing, RevenueEvent
 
 @admin.register(ClassType)
 class ClassTypeAdmin(admin.ModelAdmin):
@@ -23,6 +23,29 @@ class PaymentAdmin(admin.ModelAdmin):
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('id', 'client', 'schedule', 'date_booked')
 
+@admin.register(ClassSeatLedger)
+class ClassSeatLedgerAdmin(admin.ModelAdmin):
+    list_display = ('schedule', 'class_date', 'booked', 'updated_at')
+    list_filter = ('class_date',)
+
+@admin.register(MonthlyClassUsage)
+class MonthlyClassUsageAdmin(admin.ModelAdmin):
+    list_display = ('client', 'year', 'month', 'used', 'updated_at')
+    list_filter = ('year', 'month')
+    search_fields = ('client__first_name', 'client__last_name')
+
+@admin.register(DailyClosing)
+class DailyClosingAdmin(admin.ModelAdmin):
+    list_display = ('date', 'payment_total', 'venta_total', 'payment_count', 'attendance', 'updated_at')
+    date_hierarchy = 'date'
+    ordering = ('-date',)
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'sent_at')
+
 @admin.register(PlanIntent)
 class PlanIntentAdmin(admin.ModelAdmin):
     list_display = ('id', 'client', 'membership', 'selected_at', 'is_confirmed')
@@ -36,6 +59,18 @@ class MonthlyRevenueAdmin(admin.ModelAdmin):
     list_filter = ('year', 'month')
     ordering = ('-year', '-month')
     
+@admin.register(RevenueEvent)
+class RevenueEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'source', 'source_id', 'year', 'month', 'total_delta', 'created_at')
+    list_filter = ('source', 'year', 'month')
+
+    # Solo se agregan eventos; no se editan ni se borran desde el admin.
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Promotion)
 class PromotionAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'membership', 'price', 'start_date', 'end_date')
@@ -1,27 +1,59 @@
 from accounts.models import Client
 from studio.models import Booking
+from django.db import transaction
+from django.db.models import Case, IntegerField, Sum, Value, When, Window
 from django.utils import timezone
-from collections import defaultdict
+from collections import Counter
 
-def get_clients_with_consecutive_no_shows(limit=3):
+
+def compute_no_show_streaks(client_ids=None):
     """
-    Devuelve clientes que tienen al menos 'limit' inasistencias seguidas.
+    Devuelve {client_id: racha} con las inasistencias seguidas de cada cliente,
+    contando desde su última reserva activa anterior a hoy hacia atrás.
+
+    Una sola consulta: una suma acumulada (window) de las reservas que no son
+    no_show marca dónde se corta la racha; las filas con suma 0 son la racha.
     """
     today = timezone.now().date()
-    result = []
+    bookings = Booking.objects.filter(class_date__lt=today, status='active')
+    if client_ids is not None:
+        bookings = bookings.filter(client_id__in=set(client_ids))
+
+    rows = bookings.annotate(
+        breaks=Window(
+            Sum(Case(
+                When(attendance_status='no_show', then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )),
+            partition_by='client_id',
+            order_by=['-class_date', '-id'],
+        )
+    ).filter(breaks=0).values_list('client_id', flat=True)
+
+    return Counter(rows)
 
-    for client in Client.objects.all():
-        recent_bookings = Booking.objects.filter(
-            client=client,
-            class_date__lt=today,
-            status='active'
-        ).order_by('-class_date')[:limit]
 
-        if recent_bookings.count() < limit:
-            continue
+def rebuild_no_show_streaks(client_ids=None):
+    """Recalcula Client.no_show_streak (de los clientes dados o de todos)."""
+    streaks = compute_no_show_streaks(client_ids)
 
-        # Verificamos si las últimas N reservas son no_show
-        if all(b.attendance_status == 'no_show' for b in recent_bookings):
-            result.append(client)
+    clients = Client.objects.all()
+    if client_ids is not None:
+        clients = clients.filter(pk__in=set(client_ids))
 
-    return result
+    with transaction.atomic():
+        clients.filter(no_show_streak__gt=0).exclude(pk__in=list(streaks)).update(no_show_streak=0)
+        Client.objects.bulk_update(
+            [Client(pk=client_id, no_show_streak=streak) for client_id, streak in streaks.items()],
+            ['no_show_streak'],
+            batch_size=500,
+        )
+    return len(streaks)
+
+
+def get_clients_with_consecutive_no_shows(limit=3):
+    """
+    Devuelve clientes que tienen al menos 'limit' inasistencias seguidas.
+    """
+    return Client.objects.filter(no_show_streak__gte=limit).order_by('-no_show_streak', 'id')
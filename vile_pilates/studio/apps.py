@@ -4,6 +4,8 @@ class StudioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'studio'
 
-    # def ready(self):
-    #     from studio.tasks import scheduler
-    #     scheduler.start()
\ No newline at end of file
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # from studio.tasks import scheduler
+        # scheduler.start()
\ No newline at end of file
@@ -0,0 +1,196 @@
+# studio/availability.py
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import SEAT_HOLDING_STATUSES, Booking, Schedule
+
+# Mapear weekday (0=Monday) a código de día definido en Schedule.DAY_CHOICES
+DAY_CODE_MAP = {0: 'MON', 1: 'TUE', 2: 'WED', 3: 'THU', 4: 'FRI', 5: 'SAT', 6: 'SUN'}
+
+# Máximo de días que se pueden pedir en modo rango.
+MAX_RANGE_DAYS = 31
+
+# Las entradas se invalidan por eventos; el TTL es solo una red de seguridad
+# (p. ej. si cambia el nombre de un coach o de un tipo de clase).
+CACHE_TIMEOUT = 60 * 60
+CACHE_PREFIX = 'availability'
+
+# Backends que viven dentro de cada proceso: con ellos no se cachea.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _date_range(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def _build_slot(schedule, class_date, booking_count):
+    # Convertir el campo time_slot (e.g. '05:00') en un datetime combinando con la fecha
+    start_time = datetime.combine(class_date, datetime.strptime(schedule.time_slot, "%H:%M").time())
+    end_time = start_time + timedelta(hours=1)  # Cada slot dura 1 hora
+    coach = schedule.coach
+
+    return {
+        "schedule_id": schedule.id,
+        "class_type": schedule.class_type.name if schedule.class_type else None,
+        "is_individual": schedule.is_individual,
+        "capacity": schedule.capacity,
+        "booked": booking_count,
+        "coach": f"{coach.first_name} {coach.last_name}" if coach else None,
+        "available": booking_count < schedule.capacity,
+        "start": start_time.isoformat(),
+        "end": end_time.isoformat(),
+    }
+
+
+def build_availability(start, end):
+    """
+    Devuelve {fecha: [slots]} para cada día entre start y end (inclusive).
+
+    Usa siempre dos consultas: los horarios con coach y tipo de clase, y un
+    conteo agrupado por (schedule, class_date) de las reservas que ocupan cupo,
+    con el mismo criterio que el ledger de cupos (reserve_seat).
+    """
+    days = list(_date_range(start, end))
+    day_codes = {DAY_CODE_MAP[d.weekday()] for d in days}
+
+    schedules_by_day = defaultdict(list)
+    for schedule in Schedule.objects.filter(day__in=day_codes).select_related('coach', 'class_type'):
+        schedules_by_day[schedule.day].append(schedule)
+
+    counts = (
+        Booking.objects.filter(class_date__range=[start, end], status__in=SEAT_HOLDING_STATUSES)
+        .values('schedule_id', 'class_date')
+        .annotate(n=Count('id'))
+    )
+    booked = {(row['schedule_id'], row['class_date']): row['n'] for row in counts}
+
+    availability = {}
+    for day in days:
+        slots = [
+            _build_slot(schedule, day, booked.get((schedule.id, day), 0))
+            for schedule in schedules_by_day[DAY_CODE_MAP[day.weekday()]]
+        ]
+        availability[day] = sorted(slots, key=lambda x: x["start"])
+    return availability
+
+
+# -----------------------------------------------------------------------------
+# Cache por fecha con invalidación por eventos
+#
+# Cada fecha tiene un contador de versión y existe además una generación global
+# que se incrementa al editar un Schedule. La llave del payload incluye ambas,
+# así que invalidar es solo incrementar un contador: una respuesta calculada
+# con datos viejos queda guardada bajo una llave que ya nadie lee.
+
+def shared_cache_enabled():
+    """True si el cache por defecto es compartido entre procesos (Redis, base de datos, archivos)."""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+
+
+def _counter_key(name):
+    return f"{CACHE_PREFIX}:{name}"
+
+
+def _bump(key, delta=1):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # La llave expiró o fue desalojada entre add() e incr().
+        cache.set(key, delta, None)
+
+
+def _payload_keys(days):
+    generation_key = _counter_key('generation')
+    version_keys = {day: _counter_key(f"version:{day.isoformat()}") for day in days}
+    counters = cache.get_many([generation_key, *version_keys.values()])
+    generation = counters.get(generation_key, 0)
+    return {
+        day: f"{CACHE_PREFIX}:{generation}:{day.isoformat()}:{counters.get(version_keys[day], 0)}"
+        for day in days
+    }
+
+
+def get_availability(start, end):
+    """
+    Igual que build_availability, pero sirviendo desde cache las fechas ya
+    calculadas. Sin cache compartido siempre calcula.
+    """
+    if not shared_cache_enabled():
+        return build_availability(start, end)
+
+    days = list(_date_range(start, end))
+    keys = _payload_keys(days)
+    cached = cache.get_many(list(keys.values()))
+
+    missing = [day for day in days if keys[day] not in cached]
+    if len(days) > len(missing):
+        _bump(_counter_key('hits'), len(days) - len(missing))
+    if missing:
+        _bump(_counter_key('misses'), len(missing))
+
+    availability = {day: cached.get(keys[day]) for day in days}
+    if missing:
+        fresh = build_availability(min(missing), max(missing))
+        cache.set_many({keys[day]: slots for day, slots in fresh.items()}, CACHE_TIMEOUT)
+        availability.update({day: fresh[day] for day in missing})
+    return availability
+
+
+def invalidate_availability(*dates):
+    """Invalida las fechas dadas cuando la transacción actual se confirma."""
+    dates = {d for d in dates if d}
+    if not shared_cache_enabled():
+        return
+
+    def _invalidate():
+        cache.delete_many(list(_payload_keys(dates).values()))
+        for day in dates:
+            _bump(_counter_key(f"version:{day.isoformat()}"))
+        _bump(_counter_key('bookings'))
+
+    if dates:
+        transaction.on_commit(_invalidate)
+
+
+def invalidate_all_availability():
+    """Invalida todas las fechas (p. ej. al editar un Schedule)."""
+    if shared_cache_enabled():
+        transaction.on_commit(lambda: _bump(_counter_key('generation')))
+
+
+def bookings_cache_version():
+    """
+    Versión global de reservas y horarios: cambia con cualquier invalidación.
+    Sirve para las llaves de otros caches calculados a partir de las reservas.
+    """
+    keys = [_counter_key('generation'), _counter_key('bookings')]
+    counters = cache.get_many(keys)
+    return f"{counters.get(keys[0], 0)}:{counters.get(keys[1], 0)}"
+
+
+def availability_cache_stats():
+    if not shared_cache_enabled():
+        return {"enabled": False, "hits": 0, "misses": 0, "hit_ratio": None}
+
+    counters = cache.get_many([_counter_key('hits'), _counter_key('misses')])
+    hits = counters.get(_counter_key('hits'), 0)
+    misses = counters.get(_counter_key('misses'), 0)
+    total = hits + misses
+    return {
+        "enabled": True,
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None,
+    }
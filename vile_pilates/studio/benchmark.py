@@ -0,0 +1,399 @@
+# studio/benchmark.py
+"""
+Benchmark de endpoints contra una base de datos local (ver el comando
+benchmark_endpoints y, para generar datos, generate_studio_data).
+
+Cada escenario se llama ``requests`` veces con ``concurrency`` hilos, ya sea
+con el cliente de pruebas de Django (se cuentan las consultas SQL de cada
+request) o contra un servidor ya levantado (``base_url``). El reporte es un
+dict serializable a JSON que se puede comparar contra un reporte base.
+
+Se niega a correr si la base de datos no es local (ver is_local_database),
+salvo con ``force``. Con el cliente de pruebas queue_email se reemplaza
+durante la corrida: los escenarios no encolan correos (ver _skip_email).
+"""
+import itertools
+import re
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Max
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import Client, CustomUser
+from .datagen import is_local_database
+from .models import Booking, Schedule
+
+BENCHMARK_USERNAME = "benchmark"
+# Número de consultas en el header Server-Timing (ver studio.middleware)
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) ')
+REPORT_VERSION = 1
+# Cambio relativo (%) a partir del cual una métrica de latencia o throughput es regresión
+DEFAULT_THRESHOLD = 20.0
+# Métricas que se comparan contra el reporte base; True = más alto es peor
+COMPARED_METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "throughput_rps": False,
+    "queries_max": True,
+}
+
+
+class Scenario:
+    """Un endpoint a medir. ``params(i, ctx)`` arma los parámetros del request i."""
+
+    def __init__(self, name, method, path, params=None, writes=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.params = params or (lambda i, ctx: {})
+        self.writes = writes
+
+
+def _booking_payload(i, ctx):
+    # Un cliente con plan vigente distinto en cada request y fechas futuras
+    # (después de las reservas ya generadas) para no repetir (cliente, horario, fecha).
+    clients = ctx["active_clients"]
+    client_id = clients[i % len(clients)]
+    class_date, schedule_ids = ctx["class_days"][(i // len(clients)) % len(ctx["class_days"])]
+    return {
+        "client_id": client_id,
+        "schedule_id": schedule_ids[i % len(schedule_ids)],
+        "class_date": class_date.isoformat(),
+    }
+
+
+def default_scenarios():
+    return [
+        Scenario("availability-day", "get", "/api/studio/availability/",
+                 lambda i, ctx: {"date": (ctx["today"] + timedelta(days=i % 14)).isoformat()}),
+        Scenario("availability-range", "get", "/api/studio/availability/",
+                 lambda i, ctx: {"start": ctx["today"].isoformat(),
+                                 "end": (ctx["today"] + timedelta(days=13)).isoformat()}),
+        Scenario("bookings-create", "post", "/api/studio/bookings/", _booking_payload, writes=True),
+        Scenario("clases-por-mes", "get", "/api/studio/clases-por-mes/",
+                 lambda i, ctx: {"year": ctx["today"].year, "month": ctx["today"].month}),
+        Scenario("cierres-semanales", "get", "/api/studio/cierres-semanales/"),
+        Scenario("clients-list", "get", "/api/accounts/clients/"),
+        Scenario("clients-search", "get", "/api/accounts/clients/",
+                 lambda i, ctx: {"q": ctx["search_terms"][i % len(ctx["search_terms"])]}),
+    ]
+
+
+def build_context(today=None):
+    """Datos que usan los escenarios para armar sus parámetros."""
+    today = today or timezone.localdate()
+    active_clients = list(
+        Client.objects.filter(latest_valid_until__gte=today + timedelta(days=30), trial_used=True)
+        .order_by("id").values_list("id", flat=True)[:2000]
+    ) or list(Client.objects.order_by("id").values_list("id", flat=True)[:2000])
+
+    schedules_by_day = {}
+    for schedule_id, day in Schedule.objects.filter(is_individual=False).values_list("id", "day"):
+        schedules_by_day.setdefault(day, []).append(schedule_id)
+    day_codes = ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]
+    last_booked = Booking.objects.aggregate(last=Max("class_date"))["last"] or today
+    first_day = max(today, last_booked) + timedelta(days=1)
+    class_days = [
+        (day, schedules_by_day[day_codes[day.weekday()]])
+        for day in (first_day + timedelta(days=n) for n in range(28))
+        if schedules_by_day.get(day_codes[day.weekday()])
+    ]
+
+    names = Client.objects.order_by("id").values_list("last_name", flat=True)[:20]
+    return {
+        "today": today,
+        "active_clients": active_clients,
+        "class_days": class_days,
+        "search_terms": sorted({name.split()[0][:4].lower() for name in names if name}) or ["a"],
+    }
+
+
+@contextmanager
+def benchmark_user():
+    """Superusuario de la corrida, sin contraseña; se borra al terminar."""
+    user = CustomUser.objects.create_user(
+        username=f"{BENCHMARK_USERNAME}-{uuid.uuid4().hex[:8]}", is_staff=True, is_superuser=True
+    )
+    try:
+        yield user
+    finally:
+        user.delete()
+
+
+def _skip_email(kind, message):
+    """
+    Reemplazo de queue_email durante el benchmark: el mensaje ya se armó, pero
+    no se guarda en EmailOutbox, así ningún worker lo envía.
+    """
+    return None
+
+
+@contextmanager
+def _emails_disabled():
+    # studio.views lo importa por nombre; el resto lo importa del módulo al llamarlo
+    with ExitStack() as stack:
+        for target in ("studio.views.queue_email", "studio.management.mails.mails.queue_email"):
+            stack.enter_context(mock.patch(target, _skip_email))
+        yield
+
+
+def _access_token(user):
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    return str(RefreshToken.for_user(user).access_token)
+
+
+class TestClientDriver:
+    """Llama la vista en el mismo proceso y cuenta las consultas del request."""
+
+    counts_queries = True
+
+    def __init__(self, token):
+        # Un error 500 cuenta como muestra fallida en lugar de cortar el benchmark
+        self.client = TestClient(raise_request_exception=False, HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def request(self, method, path, params):
+        kwargs = {"content_type": "application/json"} if method != "get" else {}
+        with CaptureQueriesContext(connections[DEFAULT_DB_ALIAS]) as queries:
+            response = getattr(self.client, method)(path, params, **kwargs)
+        return response.status_code, len(queries)
+
+    def close(self):
+        pass
+
+
+class HttpDriver:
+    """
+    Llama un servidor ya levantado (runserver, gunicorn...). Las consultas se
+    leen del header Server-Timing de PerformanceMiddleware, si viene.
+    """
+
+    counts_queries = False
+
+    def __init__(self, token, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method, path, params):
+        url = self.base_url + path
+        if method == "get":
+            response = self.session.get(url, params=params, timeout=60)
+        else:
+            response = self.session.request(method.upper(), url, json=params, timeout=60)
+        match = SERVER_TIMING_QUERIES.search(response.headers.get("Server-Timing", ""))
+        return response.status_code, int(match.group(1)) if match else None
+
+    def close(self):
+        self.session.close()
+
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+
+def summarize(samples, elapsed):
+    """Agrega las muestras (latencia en segundos, consultas, status) de un escenario."""
+    latencies = [s[0] * 1000 for s in samples]
+    queries = [s[1] for s in samples if s[1] is not None]
+    statuses = {}
+    for _, _, code in samples:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, _, code in samples if code == "exception" or code >= 500),
+        "status_codes": dict(sorted(statuses.items())),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "mean_ms": round(float(np.mean(latencies)), 2) if latencies else None,
+        "max_ms": round(max(latencies), 2) if latencies else None,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "queries_mean": round(float(np.mean(queries)), 2) if queries else None,
+        "queries_max": max(queries) if queries else None,
+    }
+
+
+def run_scenario(scenario, make_driver, ctx, requests=100, concurrency=4, warmup=5):
+    """Corre un escenario y devuelve su resumen (ver summarize)."""
+    indices = itertools.count()
+    lock = threading.Lock()
+    samples = []
+
+    def next_index():
+        with lock:
+            return next(indices)
+
+    def worker(limit):
+        driver = make_driver()
+        try:
+            while (i := next_index()) < limit:
+                params = scenario.params(i, ctx)
+                started = time.perf_counter()
+                try:
+                    code, queries = driver.request(scenario.method, scenario.path, params)
+                except Exception:
+                    code, queries = "exception", None
+                sample = (time.perf_counter() - started, queries, code)
+                if i >= warmup:
+                    with lock:
+                        samples.append(sample)
+        finally:
+            driver.close()
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+
+    total = warmup + requests
+    started = time.perf_counter()
+    if concurrency <= 1:
+        worker(total)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker, total) for _ in range(concurrency)]:
+                future.result()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _cleanup_writes(last_booking_id):
+    """
+    Deshace las reservas que crearon los escenarios de escritura y recalcula
+    solo los cupos, usos mensuales y rachas que tocaron.
+    """
+    from .alerts import rebuild_no_show_streaks
+    from .availability import invalidate_availability
+    from .utils import sync_monthly_usage, sync_seat_ledger
+
+    created = Booking.objects.filter(id__gt=last_booking_id)
+    rows = list(created.values_list("client_id", "schedule_id", "class_date"))
+    created.delete()
+
+    sync_seat_ledger({(schedule_id, class_date) for _, schedule_id, class_date in rows})
+    sync_monthly_usage({(client_id, class_date.year, class_date.month) for client_id, _, class_date in rows})
+    rebuild_no_show_streaks({client_id for client_id, _, _ in rows})
+    invalidate_availability(*{class_date for _, _, class_date in rows})
+
+
+def run_benchmark(scenarios=None, requests=100, concurrency=4, warmup=5, base_url=None, keep_writes=False,
+                  url_writes=False, force=False, log=None):
+    """
+    Corre los escenarios y arma el reporte.
+
+    Con ``base_url`` los escenarios de escritura se omiten salvo con
+    ``url_writes``: lo que escriba ese servidor no se deshace al terminar.
+    """
+    if not force and not is_local_database():
+        raise RuntimeError(
+            f"La base de datos ({connection.settings_dict.get('HOST')}) no es local; "
+            "el benchmark crea reservas y usuarios. Usa force=True (--force) si de verdad es lo que quieres."
+        )
+
+    log = log or (lambda message: None)
+    scenarios = scenarios or default_scenarios()
+    if base_url and not url_writes:
+        skipped = [s.name for s in scenarios if s.writes]
+        if skipped:
+            log(f"Omitidos contra {base_url} (escriben datos): {', '.join(skipped)}")
+        scenarios = [s for s in scenarios if not s.writes]
+    ctx = build_context()
+    with ExitStack() as stack:
+        token = _access_token(stack.enter_context(benchmark_user()))
+        if base_url:
+            def make_driver():
+                return HttpDriver(token, base_url)
+        else:
+            stack.enter_context(_emails_disabled())
+
+            def make_driver():
+                return TestClientDriver(token)
+
+        last_booking_id = Booking.objects.aggregate(last=Max("id"))["last"] or 0
+        results = {}
+        try:
+            for scenario in scenarios:
+                workers = concurrency
+                if scenario.writes and connection.vendor == "sqlite" and not base_url:
+                    # SQLite bloquea la base completa en cada escritura: con varios
+                    # hilos solo se mediría "database is locked".
+                    workers = 1
+                log(f"{scenario.name}: {requests} request(s), concurrencia {workers}...")
+                results[scenario.name] = run_scenario(scenario, make_driver, ctx, requests, workers, warmup)
+                results[scenario.name]["concurrency"] = workers
+        finally:
+            if any(s.writes for s in scenarios) and not keep_writes and not base_url:
+                _cleanup_writes(last_booking_id)
+
+    return {
+        "version": REPORT_VERSION,
+        "generated_at": timezone.now().isoformat(),
+        "git_commit": _git_commit(),
+        "database": connection.vendor,
+        "driver": "http" if base_url else "test_client",
+        "requests": requests,
+        "concurrency": concurrency,
+        "dataset": {
+            "clients": Client.objects.count(),
+            "bookings": Booking.objects.count(),
+        },
+        "scenarios": results,
+    }
+
+
+def compare_reports(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compara cada métrica de COMPARED_METRICS contra el reporte base.
+
+    Latencia y throughput son regresión si empeoran más de ``threshold`` %;
+    cualquier consulta extra por request es regresión.
+    """
+    comparison = {}
+    for name, metrics in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        rows = {}
+        for metric, higher_is_worse in COMPARED_METRICS.items():
+            now, before = metrics.get(metric), base.get(metric)
+            if now is None or before is None:
+                continue
+            change = round((now - before) / before * 100, 1) if before else None
+            if metric.startswith("queries"):
+                regression = now > before
+            elif change is None:
+                regression = False
+            else:
+                regression = change > threshold if higher_is_worse else change < -threshold
+            rows[metric] = {"baseline": before, "current": now, "change_pct": change, "regression": regression}
+        comparison[name] = rows
+    return comparison
+
+
+def regressions(comparison):
+    return [
+        (name, metric, row)
+        for name, rows in comparison.items()
+        for metric, row in rows.items()
+        if row["regression"]
+    ]
@@ -0,0 +1,396 @@
+# studio/datagen.py
+"""
+Datos de prueba realistas para correr benchmarks y pruebas de carga sin la
+base de datos de producción (ver el comando generate_studio_data).
+
+Todo se inserta con bulk_create y un random.Random(seed): con el mismo seed,
+la misma fecha final y el mismo catálogo se obtiene exactamente el mismo
+conjunto de datos. Como bulk_create no pasa por save(), al final se recalculan
+las tablas derivadas (snapshots, ledger de cupos, uso mensual, cierres,
+ingresos mensuales y rachas de inasistencia).
+"""
+import random
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.auth.models import Group
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from accounts.models import Client, CustomUser
+from accounts.search import sync_search_tokens
+from .models import (
+    Booking, ClassType, Membership, Payment, PlanIntent, Promotion, PromotionInstance, Schedule, Venta,
+)
+
+# Dominio reservado (RFC 2606) de los correos de los clientes generados; así se
+# pueden borrar sin tocar los reales y Client.source conserva un valor realista.
+GENERATED_EMAIL_DOMAIN = "datos-generados.invalid"
+
+FIRST_NAMES = [
+    "María", "José", "Ana", "Luis", "Sofía", "Andrés", "Lucía", "Jorge", "Valeria", "Diego",
+    "Camila", "Óscar", "Gabriela", "Raúl", "Fernanda", "Héctor", "Daniela", "Iván", "Mónica", "Ángel",
+]
+LAST_NAMES = [
+    "García", "López", "Pérez", "Hernández", "Martínez", "Rodríguez", "Gómez", "Díaz", "Castillo", "Morales",
+    "Samayoa", "Velasco", "Rivera", "Juárez", "Méndez", "Ramírez", "Orellana", "Cifuentes", "Barrios", "Muñoz",
+]
+SOURCES = ["Instagram", "Facebook", "Recomendación", "Google", "Caminando"]
+PRODUCTS = [("Calcetas antideslizantes", 60), ("Botella", 85), ("Toalla", 95), ("Agua", 10), ("Barra de proteína", 20)]
+CANCELLATION_REASONS = ["Enfermedad", "Trabajo", "Viaje", "Tráfico", None, None]
+
+# Formas de pago y su peso relativo (las que separa el cierre diario)
+PAYMENT_METHODS = [("Tarjeta", 55), ("Efectivo", 25), ("Visalink", 20)]
+# Planes por defecto si no existe ninguno: (nombre, precio, clases por mes)
+DEFAULT_MEMBERSHIPS = [
+    ("Clase individual", 150, 1), ("4 clases", 300, 4), ("8 clases", 500, 8),
+    ("12 clases", 650, 12), ("Ilimitado", 800, None),
+]
+MEMBERSHIP_WEIGHTS = [3, 20, 40, 25, 12]
+
+# Mezcla de reservas pasadas: 10 % canceladas; del resto, 8 % inasistencias
+CANCELLED_RATE = 0.10
+NO_SHOW_RATE = 0.08
+# Probabilidad de que un cliente no renueve al terminar su vigencia
+CHURN_RATE = 0.12
+# Clientes que solo hicieron (o no) la clase de prueba y nunca pagaron
+LEAD_RATE = 0.15
+
+
+# Hosts que cuentan como base de datos local (vacío = socket local de Postgres)
+LOCAL_DB_HOSTS = {"", "localhost", "127.0.0.1", "::1"}
+
+
+def is_local_database(alias=DEFAULT_DB_ALIAS):
+    """
+    True si la base es SQLite, la base de pruebas o un servidor en esta
+    máquina. DEBUG no sirve para esto: settings.py puede tener DEBUG = True
+    y apuntar a la base de producción.
+    """
+    connection = connections[alias]
+    if connection.vendor == "sqlite":
+        return True
+    db = connection.settings_dict
+    name = str(db.get("NAME") or "")
+    if name.startswith("test_") or name == (db.get("TEST") or {}).get("NAME"):
+        return True
+    host = str(db.get("HOST") or "")
+    return host in LOCAL_DB_HOSTS or host.startswith("/")
+
+
+def _weighted(rng, options, weights):
+    return rng.choices(options, weights=weights, k=1)[0]
+
+
+def _aware(day, hour, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+def _month_start(day, months_back):
+    year, month = day.year, day.month - months_back
+    while month <= 0:
+        month += 12
+        year -= 1
+    return date(year, month, 1)
+
+
+def generated_clients():
+    """Clientes creados por generate_studio_data (ver GENERATED_EMAIL_DOMAIN)."""
+    return Client.objects.filter(email__endswith=f"@{GENERATED_EMAIL_DOMAIN}")
+
+
+def delete_generated_data(rebuild=True, log=None):
+    """
+    Borra los clientes generados con sus reservas, pagos, ventas e intentos.
+
+    Reservas, pagos y ventas se borran con _raw_delete: sus post_delete
+    recalculan cupos, ingresos y cierres fila por fila. Con ``rebuild`` las
+    tablas derivadas se recalculan una sola vez al final.
+    """
+    generated = generated_clients()
+    if not generated.exists():
+        return 0
+
+    deleted = 0
+    with transaction.atomic():
+        for model in (Booking, Payment, Venta):
+            rows = model.objects.filter(client__in=generated)
+            deleted += rows._raw_delete(rows.db)
+        count, _ = generated.delete()
+        deleted += count
+    if rebuild:
+        rebuild_derived_data(log=log)
+    return deleted
+
+
+def _ensure_catalog(capacity):
+    """
+    Tipos de clase, coaches, horarios y planes; reutiliza los existentes.
+    Los horarios nuevos se crean con ``capacity`` cupos (los individuales, con 1).
+    """
+    reformer, _ = ClassType.objects.get_or_create(
+        name="Pilates Reformer", defaults={"description": "Clase de Pilates Reformer"}
+    )
+
+    if not Schedule.objects.exists():
+        coach_group, _ = Group.objects.get_or_create(name="coach")
+        coaches = []
+        for username in ("coach_manana", "coach_mediodia", "coach_tarde"):
+            coach, _ = CustomUser.objects.get_or_create(username=username)
+            coaches.append(coach)
+        coach_group.customuser_set.add(*coaches)
+
+        schedules = []
+        for day, _ in Schedule.DAY_CHOICES:
+            if day == "SUN":
+                continue
+            for slot, _ in Schedule.TIME_SLOTS:
+                hour = int(slot[:2])
+                # Igual que populate_schedules: sábados solo de 07:00 a 10:00
+                if day == "SAT" and not 7 <= hour <= 10:
+                    continue
+                individual = slot == "12:00"
+                schedules.append(Schedule(
+                    day=day, time_slot=slot, class_type=reformer, is_individual=individual,
+                    capacity=1 if individual else capacity,
+                    coach=coaches[0] if hour <= 8 else coaches[1] if hour <= 12 else coaches[2],
+                ))
+        Schedule.objects.bulk_create(schedules)
+
+    if not Membership.objects.exists():
+        Membership.objects.bulk_create([
+            Membership(name=name, price=price, classes_per_month=classes)
+            for name, price, classes in DEFAULT_MEMBERSHIPS
+        ])
+
+    schedules_by_day = {}
+    for schedule in Schedule.objects.order_by("day", "time_slot", "id"):
+        schedules_by_day.setdefault(schedule.day, []).append(schedule)
+    return schedules_by_day, list(Membership.objects.order_by("id"))
+
+
+def _ensure_promotions(memberships, start, end):
+    """Dos promociones dentro del periodo generado, sobre el plan más vendido."""
+    membership = memberships[min(2, len(memberships) - 1)]
+    middle = start + (end - start) / 2
+    specs = [
+        ("Promo aniversario", start + timedelta(days=10), start + timedelta(days=40)),
+        ("Promo temporada", middle, middle + timedelta(days=30)),
+    ]
+    promotions = []
+    for name, promo_start, promo_end in specs:
+        promotion, _ = Promotion.objects.get_or_create(
+            name=name, start_date=promo_start, end_date=promo_end,
+            defaults={"membership": membership, "price": membership.price * 8 / 10,
+                      "description": "Generada para pruebas de carga"},
+        )
+        promotions.append(promotion)
+    return promotions
+
+
+def generate_studio_data(clients=500, months=6, seed=42, end=None, capacity=9, batch_size=5000, rebuild=True,
+                         log=None):
+    """
+    Genera ``clients`` clientes con ``months`` meses de actividad que terminan en
+    ``end`` (por defecto hoy). Antes de generar borra los datos de una corrida
+    anterior (ver delete_generated_data). Devuelve el número de filas por tabla.
+
+    Las reservas respetan el cupo de cada horario: con la capacidad real (9)
+    el estudio llena unas 15 000 reservas por semestre. Para volúmenes mayores
+    hay que generar los horarios con más ``capacity`` (solo aplica si todavía
+    no existen horarios).
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    end = end or timezone.localdate()
+    start = _month_start(end, months - 1)
+
+    # Las tablas derivadas se recalculan al final, junto con los datos nuevos
+    deleted = delete_generated_data(rebuild=False)
+    if deleted:
+        log(f"Datos generados anteriores eliminados: {deleted} fila(s).")
+
+    schedules_by_day, memberships = _ensure_catalog(capacity)
+    promotions = _ensure_promotions(memberships, start, end)
+    weekday_codes = [code for code, _ in Schedule.DAY_CHOICES]
+    payment_methods = [m for m, _ in PAYMENT_METHODS]
+    payment_weights = [w for _, w in PAYMENT_METHODS]
+    membership_weights = (MEMBERSHIP_WEIGHTS + [10] * len(memberships))[:len(memberships)]
+    total_days = (end - start).days + 1
+
+    with transaction.atomic():
+        # ---- Clientes
+        new_clients = []
+        for i in range(clients):
+            first, last = rng.choice(FIRST_NAMES), f"{rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+            client = Client(
+                first_name=first, last_name=last,
+                email=f"cliente{seed}.{i}@{GENERATED_EMAIL_DOMAIN}",
+                phone=f"5{rng.randint(0, 9_999_999):07d}",
+                dpi=f"9{seed % 1000:03d}{i:09d}",
+                age=rng.randint(18, 65),
+                sex=_weighted(rng, ["F", "M", "O"], [75, 23, 2]),
+                source=rng.choice(SOURCES),
+                created_at=_aware(start + timedelta(days=rng.randrange(total_days)), rng.randint(6, 20)),
+            )
+            client.search_text = client.build_search_text()
+            new_clients.append(client)
+        new_clients = Client.objects.bulk_create(new_clients, batch_size=batch_size)
+        sync_search_tokens(new_clients)
+        log(f"Clientes: {len(new_clients)}")
+
+        promo_instances = {
+            promotion.id: PromotionInstance.objects.create(promotion=promotion) for promotion in promotions
+        }
+        promo_members = set()
+
+        payments, bookings, ventas, intents = [], [], [], []
+        taken = set()  # (client, schedule, fecha): restricción única de Booking
+        seats = {}     # (schedule, fecha) -> reservas que ocupan cupo
+
+        def add_booking(client, day, preferred_slots, membership, trial=False):
+            options = schedules_by_day.get(weekday_codes[day.weekday()])
+            if not options:
+                return
+            preferred = [s for s in options if s.time_slot in preferred_slots] or options
+            schedule = rng.choice(preferred)
+            key = (schedule.id, day)
+            if (client.id,) + key in taken or seats.get(key, 0) >= schedule.capacity:
+                return
+
+            cancelled = rng.random() < CANCELLED_RATE
+            if day >= end:
+                attendance = "pending"
+            elif cancelled:
+                attendance = "pending"
+            else:
+                attendance = "no_show" if rng.random() < NO_SHOW_RATE else "attended"
+
+            booking = Booking(
+                client_id=client.id, schedule_id=schedule.id, class_date=day,
+                membership=None if trial else membership,
+                status="cancelled" if cancelled else "active",
+                attendance_status=attendance,
+            )
+            if cancelled:
+                booking.cancellation_type = _weighted(rng, ["client", "instructor", "admin"], [85, 10, 5])
+                booking.cancellation_reason = rng.choice(CANCELLATION_REASONS)
+            elif attendance == "no_show" and rng.random() < 0.3:
+                # Inasistencia justificada
+                booking.cancellation_reason = rng.choice(CANCELLATION_REASONS[:4])
+            else:
+                seats[key] = seats.get(key, 0) + 1
+            taken.add((client.id,) + key)
+            bookings.append(booking)
+
+        for client in new_clients:
+            joined = client.created_at.date()
+            preferred_slots = {rng.choice(Schedule.TIME_SLOTS)[0] for _ in range(2)}
+            trial_day = joined + timedelta(days=rng.randint(0, 5))
+            if trial_day <= end + timedelta(days=7):
+                add_booking(client, trial_day, preferred_slots, None, trial=True)
+
+            if rng.random() < LEAD_RATE:
+                # Prospecto: eligió un plan pero no ha pagado
+                if rng.random() < 0.6:
+                    intents.append(PlanIntent(
+                        client_id=client.id, membership=_weighted(rng, memberships, membership_weights),
+                        selected_at=_aware(joined, rng.randint(6, 20)),
+                    ))
+                continue
+
+            membership = _weighted(rng, memberships, membership_weights)
+            if rng.random() < 0.3:
+                intents.append(PlanIntent(
+                    client_id=client.id, membership=membership, is_confirmed=True,
+                    selected_at=_aware(joined, rng.randint(6, 20)),
+                ))
+            engagement = rng.uniform(0.6, 1.0)
+            paid_on = trial_day + timedelta(days=rng.randint(0, 3))
+
+            while paid_on <= end:
+                date_paid = _aware(paid_on, rng.randint(7, 19), rng.choice((0, 15, 30, 45)))
+                payment = Payment(
+                    client_id=client.id, membership=membership, amount=membership.price,
+                    date_paid=date_paid, valid_until=paid_on + timedelta(days=30),
+                    payment_method=_weighted(rng, payment_methods, payment_weights),
+                )
+                for promotion in promotions:
+                    if (promotion.membership_id == membership.id
+                            and promotion.start_date <= paid_on <= promotion.end_date and rng.random() < 0.4):
+                        instance = promo_instances[promotion.id]
+                        payment.promotion, payment.promotion_instance = promotion, instance
+                        payment.amount = promotion.price
+                        promo_members.add((instance.id, client.id))
+                        break
+                payments.append(payment)
+
+                if rng.random() < 0.25:
+                    product, price = rng.choice(PRODUCTS)
+                    quantity = rng.randint(1, 3)
+                    ventas.append(Venta(
+                        client_id=client.id, product_name=product, quantity=quantity, price_per_unit=price,
+                        total_amount=quantity * price, date_sold=date_paid + timedelta(minutes=5),
+                        payment_method=payment.payment_method,
+                    ))
+
+                classes = membership.classes_per_month or rng.randint(10, 18)
+                for _ in range(round(classes * engagement)):
+                    day = paid_on + timedelta(days=rng.randrange(30))
+                    if day <= end + timedelta(days=14):
+                        add_booking(client, day, preferred_slots, membership)
+
+                if rng.random() < CHURN_RATE:
+                    break
+                paid_on = paid_on + timedelta(days=30 + rng.randint(0, 4))
+
+        Payment.objects.bulk_create(payments, batch_size=batch_size)
+        Booking.objects.bulk_create(bookings, batch_size=batch_size)
+        Venta.objects.bulk_create(ventas, batch_size=batch_size)
+        PlanIntent.objects.bulk_create(intents, batch_size=batch_size)
+        PromotionInstance.clients.through.objects.bulk_create([
+            PromotionInstance.clients.through(promotioninstance_id=instance_id, client_id=client_id)
+            for instance_id, client_id in sorted(promo_members)
+        ], batch_size=batch_size)
+
+        # Clientes que ya tomaron su clase de prueba
+        attended = {b.client_id for b in bookings if b.attendance_status == "attended"}
+        Client.objects.filter(pk__in=attended).update(trial_used=True)
+
+    log(f"Pagos: {len(payments)}, reservas: {len(bookings)}, ventas: {len(ventas)}, intentos: {len(intents)}")
+
+    if rebuild:
+        rebuild_derived_data(end, log)
+
+    return {
+        "clients": len(new_clients),
+        "payments": len(payments),
+        "bookings": len(bookings),
+        "ventas": len(ventas),
+        "plan_intents": len(intents),
+        "promotion_clients": len(promo_members),
+    }
+
+
+def rebuild_derived_data(today=None, log=None):
+    """Recalcula todas las tablas que normalmente mantienen los save() y los jobs."""
+    from .alerts import rebuild_no_show_streaks
+    from .availability import invalidate_all_availability
+    from .utils import (
+        rebuild_daily_closings, rebuild_monthly_usage, rebuild_seat_ledger,
+        reconcile_monthly_revenue, refresh_payment_snapshots,
+    )
+
+    log = log or (lambda message: None)
+    today = today or timezone.localdate()
+
+    refresh_payment_snapshots()
+    generated_clients().update(status="I")
+    generated_clients().filter(latest_valid_until__gte=today).update(status="A")
+    log(f"Ledger de cupos: {rebuild_seat_ledger()} fila(s)")
+    log(f"Uso mensual: {rebuild_monthly_usage()} fila(s)")
+    log(f"Cierres diarios: {rebuild_daily_closings()} día(s)")
+    # Los pagos y ventas insertados con bulk_create o borrados con _raw_delete
+    # no registran RevenueEvent: el ajuste cuadra eventos y MonthlyRevenue.
+    log(f"Ingresos mensuales ajustados: {len(reconcile_monthly_revenue(fix=True))} mes(es)")
+    log(f"Rachas de inasistencia: {rebuild_no_show_streaks()} cliente(s)")
+    invalidate_all_availability()
@@ -0,0 +1,108 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from studio.benchmark import DEFAULT_THRESHOLD, compare_reports, default_scenarios, regressions, run_benchmark
+from studio.datagen import is_local_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide latencia (p50/p95/p99), throughput y consultas por request de los endpoints principales "
+        "contra la base de datos local y guarda un reporte JSON comparable contra un reporte base."
+    )
+
+    def add_arguments(self, parser):
+        names = ", ".join(s.name for s in default_scenarios())
+        parser.add_argument("--scenarios", help=f"Escenarios separados por coma ({names}). Por defecto, todos.")
+        parser.add_argument("--requests", type=int, default=100, help="Requests medidos por escenario (por defecto 100).")
+        parser.add_argument("--concurrency", type=int, default=4, help="Hilos en paralelo (por defecto 4).")
+        parser.add_argument("--warmup", type=int, default=5, help="Requests iniciales que no se miden (por defecto 5).")
+        parser.add_argument("--url", help="Medir un servidor ya levantado (p. ej. http://127.0.0.1:8000) en lugar "
+                                          "del cliente de pruebas. Las consultas salen del header Server-Timing; "
+                                          "omite los escenarios que escriben salvo con --url-writes.")
+        parser.add_argument("--url-writes", action="store_true",
+                            help="Con --url, correr también los escenarios que escriben. Esas reservas no se "
+                                 "deshacen y el servidor encola sus correos normalmente.")
+        parser.add_argument("--force", action="store_true",
+                            help="Permitir correrlo contra una base de datos que no es local.")
+        parser.add_argument("--output", default="benchmark-report.json", help="Archivo del reporte.")
+        parser.add_argument("--baseline", help="Reporte base contra el cual comparar.")
+        parser.add_argument("--update-baseline", action="store_true",
+                            help="Guardar también este reporte como el nuevo reporte base.")
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f"Cambio en %% que cuenta como regresión (por defecto {DEFAULT_THRESHOLD:g}).")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="Terminar con error si hay regresiones contra el reporte base.")
+        parser.add_argument("--keep-writes", action="store_true",
+                            help="No borrar las reservas creadas por el escenario bookings-create "
+                                 "(sin --url no encolan correos).")
+
+    def handle(self, *args, **opts):
+        scenarios = default_scenarios()
+        if opts["scenarios"]:
+            wanted = [name.strip() for name in opts["scenarios"].split(",") if name.strip()]
+            unknown = set(wanted) - {s.name for s in scenarios}
+            if unknown:
+                raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+            scenarios = [s for s in scenarios if s.name in wanted]
+
+        baseline = None
+        baseline_path = Path(opts["baseline"]) if opts["baseline"] else None
+        if baseline_path and baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        elif baseline_path and not opts["update_baseline"]:
+            raise CommandError(f"No existe el reporte base: {baseline_path}")
+
+        if opts["url_writes"] and not opts["url"]:
+            raise CommandError("--url-writes solo aplica con --url.")
+        if not opts["force"] and not is_local_database():
+            raise CommandError(
+                f"La base de datos ({connection.settings_dict.get('HOST')}) no es local. "
+                "Usa --force si de verdad quieres correr el benchmark ahí."
+            )
+
+        # El cliente de pruebas usa el host "testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            report = run_benchmark(
+                scenarios,
+                requests=opts["requests"],
+                concurrency=opts["concurrency"],
+                warmup=opts["warmup"],
+                base_url=opts["url"],
+                keep_writes=opts["keep_writes"],
+                url_writes=opts["url_writes"],
+                force=True,
+                log=self.stdout.write,
+            )
+
+        if baseline:
+            report["baseline"] = {"git_commit": baseline.get("git_commit"), "generated_at": baseline.get("generated_at")}
+            report["comparison"] = compare_reports(report, baseline, opts["threshold"])
+
+        Path(opts["output"]).write_text(json.dumps(report, indent=2))
+        if opts["update_baseline"] and baseline_path:
+            baseline_path.write_text(json.dumps(report, indent=2))
+
+        self.stdout.write("")
+        self.stdout.write(f"{'escenario':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'consultas':>9}  status")
+        for name, row in report["scenarios"].items():
+            self.stdout.write(
+                f"{name:<20} {row['p50_ms'] or 0:>9.1f} {row['p95_ms'] or 0:>9.1f} {row['p99_ms'] or 0:>9.1f} "
+                f"{row['throughput_rps'] or 0:>8.1f} {row['queries_max'] if row['queries_max'] is not None else '-':>9}"
+                f"  {row['status_codes']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Reporte guardado en {opts['output']}"))
+
+        found = regressions(report.get("comparison", {}))
+        for name, metric, row in found:
+            self.stdout.write(self.style.WARNING(
+                f"Regresión en {name} {metric}: {row['baseline']} -> {row['current']}"
+                + (f" ({row['change_pct']:+.1f} %)" if row["change_pct"] is not None else "")
+            ))
+        if found and opts["fail_on_regression"]:
+            raise CommandError(f"{len(found)} regresión(es) contra {baseline_path}")
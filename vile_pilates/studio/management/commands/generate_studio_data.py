@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.dateparse import parse_date
+
+from studio.datagen import delete_generated_data, generate_studio_data, is_local_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera clientes, pagos, reservas, ventas, promociones e intentos de plan de prueba "
+        "con un seed fijo, para benchmarks y pruebas de carga en SQLite o un Postgres local."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=500, help="Clientes a generar (por defecto 500).")
+        parser.add_argument("--months", type=int, default=6, help="Meses de historial (por defecto 6).")
+        parser.add_argument("--seed", type=int, default=42, help="Seed del generador (por defecto 42).")
+        parser.add_argument("--end", help="Último día del historial (YYYY-MM-DD). Por defecto, hoy.")
+        parser.add_argument("--capacity", type=int, default=9,
+                            help="Cupo de los horarios que se creen si no existe ninguno (por defecto 9). "
+                                 "Súbelo para generar más de ~15 000 reservas por semestre.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Filas por INSERT de bulk_create.")
+        parser.add_argument("--skip-rebuild", action="store_true",
+                            help="No recalcular snapshots, ledger, uso mensual, cierres, ingresos y rachas.")
+        parser.add_argument("--delete", action="store_true", help="Solo borrar los datos generados antes.")
+        parser.add_argument("--force", action="store_true",
+                            help="Permitir correrlo contra una base de datos que no es local.")
+
+    def handle(self, *args, **opts):
+        if not is_local_database() and not opts["force"]:
+            self.stderr.write(self.style.ERROR(
+                f"La base de datos ({connection.settings_dict.get('HOST')}) no es local. "
+                "Usa --force si de verdad quieres generar datos ahí."
+            ))
+            return
+
+        if opts["delete"]:
+            deleted = delete_generated_data(log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS(f"Datos generados eliminados: {deleted} fila(s)."))
+            return
+
+        end = None
+        if opts["end"]:
+            end = parse_date(opts["end"])
+            if not end:
+                self.stderr.write(self.style.ERROR("Formato de fecha inválido. Usa YYYY-MM-DD."))
+                return
+
+        counts = generate_studio_data(
+            clients=opts["clients"],
+            months=opts["months"],
+            seed=opts["seed"],
+            end=end,
+            capacity=opts["capacity"],
+            batch_size=opts["batch_size"],
+            rebuild=not opts["skip_rebuild"],
+            log=self.stdout.write,
+        )
+        summary = ", ".join(f"{name}: {total}" for name, total in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Datos generados (seed {opts['seed']}). {summary}"))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from studio.management.mails.mails import process_outbox, OUTBOX_MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = "Envía los correos pendientes del outbox (EmailOutbox) con reintentos y backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Mensajes por lote.")
+        parser.add_argument("--max-attempts", type=int, default=OUTBOX_MAX_ATTEMPTS,
+                            help="Intentos antes de marcar un mensaje como fallido.")
+        parser.add_argument("--loop", action="store_true",
+                            help="Seguir procesando indefinidamente.")
+        parser.add_argument("--sleep", type=float, default=5.0,
+                            help="Segundos de espera cuando no hay mensajes (con --loop).")
+
+    def handle(self, *args, **opts):
+        while True:
+            summary = process_outbox(opts["batch_size"], opts["max_attempts"])
+            if any(summary.values()):
+                self.stdout.write(self.style.SUCCESS(
+                    f"Enviados: {summary['sent']}, reintentos: {summary['retry']}, fallidos: {summary['dead']}."
+                ))
+            if not opts["loop"]:
+                break
+            if not any(summary.values()):
+                time.sleep(opts["sleep"])
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from accounts.models import Client
+from accounts.search import sync_search_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula el texto de búsqueda normalizado (Client.search_text) y sus palabras "
+        "(ClientSearchToken) de todos los clientes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        batch, total = [], 0
+        for client in Client.objects.only("id", *Client.SEARCH_FIELDS).iterator(chunk_size=opts["batch_size"]):
+            client.search_text = client.build_search_text()
+            batch.append(client)
+            if len(batch) >= opts["batch_size"]:
+                total += Client.objects.bulk_update(batch, ["search_text"])
+                sync_search_tokens(batch)
+                batch = []
+        if batch:
+            total += Client.objects.bulk_update(batch, ["search_text"])
+            sync_search_tokens(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Texto de búsqueda actualizado: {total} cliente(s)."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from studio.utils import rebuild_daily_closings
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye los cierres diarios (DailyClosing) a partir de pagos, ventas y reservas. "
+        "Úsalo para llenar la tabla tras desplegarla; el resumen semanal también la llena "
+        "si la encuentra vacía."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Fecha inicial (YYYY-MM-DD). Por defecto, todo el historial.")
+        parser.add_argument("--end", help="Fecha final (YYYY-MM-DD).")
+
+    def handle(self, *args, **opts):
+        bounds = {}
+        for name in ("start", "end"):
+            if opts[name]:
+                bounds[name] = parse_date(opts[name])
+                if not bounds[name]:
+                    self.stderr.write(self.style.ERROR("Formato de fecha inválido. Usa YYYY-MM-DD."))
+                    return
+
+        total = rebuild_daily_closings(**bounds)
+        self.stdout.write(self.style.SUCCESS(f"Cierres reconstruidos: {total} día(s)."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from studio.utils import rebuild_monthly_usage
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los contadores mensuales de clases por cliente (MonthlyClassUsage) desde las reservas."
+
+    def handle(self, *args, **opts):
+        total = rebuild_monthly_usage()
+        self.stdout.write(self.style.SUCCESS(f"Contadores reconstruidos: {total} (cliente, mes)."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from studio.alerts import rebuild_no_show_streaks
+
+
+class Command(BaseCommand):
+    help = "Recalcula la racha de inasistencias seguidas (Client.no_show_streak) de todos los clientes."
+
+    def handle(self, *args, **opts):
+        total = rebuild_no_show_streaks()
+        self.stdout.write(self.style.SUCCESS(f"Rachas recalculadas: {total} cliente(s) con inasistencias seguidas."))
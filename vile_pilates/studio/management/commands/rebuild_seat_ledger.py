@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from studio.utils import rebuild_seat_ledger
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el ledger de cupos (ClassSeatLedger) a partir de las reservas existentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            help="Solo reconstruye desde esta fecha (YYYY-MM-DD). Por defecto, todo el historial.",
+        )
+
+    def handle(self, *args, **opts):
+        since = None
+        if opts["since"]:
+            since = parse_date(opts["since"])
+            if not since:
+                self.stderr.write(self.style.ERROR("Formato de fecha inválido. Usa YYYY-MM-DD."))
+                return
+
+        total = rebuild_seat_ledger(since)
+        self.stdout.write(self.style.SUCCESS(f"Ledger reconstruido: {total} horarios con reservas."))
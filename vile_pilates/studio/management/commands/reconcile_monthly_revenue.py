@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from studio.utils import reconcile_monthly_revenue
+
+
+class Command(BaseCommand):
+    help = "Compara MonthlyRevenue y los eventos de ingresos contra Payment/Venta y, con --fix, corrige las diferencias."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true",
+                            help="Agrega eventos de ajuste y reescribe los meses con diferencias.")
+
+    def handle(self, *args, **opts):
+        drift = reconcile_monthly_revenue(fix=opts["fix"])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Sin diferencias."))
+            return
+
+        for row in drift:
+            self.stdout.write(
+                f"{row['month']:02d}/{row['year']}: "
+                f"esperado Q{row['expected']['total_amount']} ({row['expected']['payment_count']} pagos, "
+                f"{row['expected']['venta_count']} ventas) | "
+                f"eventos Q{row['events']['total_amount']} | "
+                f"MonthlyRevenue Q{row['projection']['total_amount']}"
+            )
+
+        if opts["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Meses corregidos: {len(drift)}."))
+        else:
+            self.stdout.write(self.style.WARNING(f"Meses con diferencias: {len(drift)}. Usa --fix para corregir."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from studio.utils import refresh_payment_snapshots
+
+
+class Command(BaseCommand):
+    help = "Recalcula en Client el snapshot del último pago (membresía y vigencia)."
+
+    def handle(self, *args, **opts):
+        total = refresh_payment_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"Snapshots actualizados: {total} clientes."))
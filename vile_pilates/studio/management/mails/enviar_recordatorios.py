@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
-from studio.models import Payment
-from studio.management.mails.mails import send_renewal_reminder_email
+from studio.management.mails.mails import renewal_reminder_message, send_messages
+from studio.utils import payments_not_renewed
 from django.utils import timezone
 from datetime import timedelta
 
@@ -12,25 +12,21 @@ class Command(BaseCommand):
         hoy = timezone.now().date()
         target_date = hoy + timedelta(days=7)
 
-        pagos = Payment.objects.filter(valid_until=target_date).select_related('client', 'membership')
+        # Solo pagos sin un pago más reciente con vigencia mayor (los que ya renovaron se omiten)
+        pagos = payments_not_renewed(target_date)
 
-        enviados = 0
+        messages = []
         for pago in pagos:
-            # Validar que no haya un pago más reciente con vigencia mayor
-            tiene_renovacion = Payment.objects.filter(
-                client=pago.client,
-                date_paid__gt=pago.date_paid,
-                valid_until__gt=pago.valid_until
-            ).exists()
-
-            if tiene_renovacion:
-                continue  # ya renovó
-
             try:
-                response = send_renewal_reminder_email(pago.client, pago)
-                if response.status_code == 200:
-                    enviados += 1
+                messages.append(renewal_reminder_message(pago.client, pago))
             except Exception as e:
-                self.stderr.write(f"Error enviando a {pago.client.email}: {str(e)}")
+                self.stderr.write(f"Error preparando correo para {pago.client.email}: {str(e)}")
+
+        enviados = 0
+        for result in send_messages(messages):
+            if result["ok"]:
+                enviados += 1
+            else:
+                self.stderr.write(f"Error enviando a {result['email']}: {result['error']}")
 
         self.stdout.write(self.style.SUCCESS(f"Correos enviados: {enviados}"))
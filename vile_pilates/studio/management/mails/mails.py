@@ -1,6 +1,7 @@
 from datetime import timedelta
-from mailjet_rest import Client
+import requests
 from django.conf import settings
+from django.db import models
 from django.utils import timezone
 from babel.dates import format_date
 from ...models import Booking
@@ -12,7 +13,92 @@ EXTRA_RECIPIENTS = (
     # puedes añadir más dicts aquí si quieres varios correos
 )
 
-def send_booking_confirmation_email(booking):
+# Reintentos del outbox: espera base * 2^(intentos-1), con tope, hasta MAX_ATTEMPTS.
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_SECONDS = 60
+OUTBOX_MAX_BACKOFF_SECONDS = 60 * 60
+# Tiempo que un worker retiene un mensaje mientras lo envía.
+OUTBOX_LEASE_SECONDS = 5 * 60
+
+
+# Máximo de mensajes que acepta Mailjet v3.1 en una sola llamada a /send.
+MAILJET_BATCH_SIZE = 50
+MAILJET_DEFAULT_API_URL = "https://api.mailjet.com/v3.1/send"
+
+
+class MailjetBatchSender:
+    """
+    Envía mensajes de Mailjet v3.1 agrupados en lotes de hasta MAILJET_BATCH_SIZE
+    por llamada, reutilizando una sola sesión HTTP (keep-alive).
+
+    send() devuelve un resultado por mensaje, en el mismo orden:
+    {"email", "ok", "message_id", "error"}.
+    """
+
+    def __init__(self, api_url=None, auth=None, batch_size=MAILJET_BATCH_SIZE, timeout=30):
+        self.api_url = api_url or getattr(settings, "MAILJET_API_URL", MAILJET_DEFAULT_API_URL)
+        self.batch_size = min(batch_size, MAILJET_BATCH_SIZE)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = auth or (settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY)
+
+    def send(self, messages):
+        messages = list(messages)
+        results = []
+        for i in range(0, len(messages), self.batch_size):
+            results.extend(self._send_batch(messages[i:i + self.batch_size]))
+        return results
+
+    def _send_batch(self, batch):
+        try:
+            response = self.session.post(self.api_url, json={"Messages": batch}, timeout=self.timeout)
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            return [self._result(message, False, error=str(e)[:500]) for message in batch]
+
+        # Mailjet responde 400 si algún mensaje falla, pero igual incluye el estado
+        # de cada mensaje en el mismo orden en que se enviaron.
+        statuses = data.get("Messages") if isinstance(data, dict) else None
+        if not statuses or len(statuses) != len(batch):
+            error = f"HTTP {response.status_code}: {response.text[:500]}"
+            return [self._result(message, False, error=error) for message in batch]
+
+        results = []
+        for message, status in zip(batch, statuses):
+            if status.get("Status") == "success":
+                to = status.get("To") or [{}]
+                results.append(self._result(message, True, message_id=to[0].get("MessageID")))
+            else:
+                errors = status.get("Errors") or []
+                error = "; ".join(e.get("ErrorMessage", "") for e in errors) or f"HTTP {response.status_code}"
+                results.append(self._result(message, False, error=error))
+        return results
+
+    @staticmethod
+    def _result(message, ok, message_id=None, error=""):
+        to = message.get("To") or [{}]
+        return {"email": to[0].get("Email"), "ok": ok, "message_id": message_id, "error": error}
+
+    def close(self):
+        self.session.close()
+
+
+_batch_sender = None
+
+
+def get_mailjet_sender():
+    """Sender compartido por el proceso (scheduler, worker del outbox)."""
+    global _batch_sender
+    if _batch_sender is None:
+        _batch_sender = MailjetBatchSender()
+    return _batch_sender
+
+
+def send_messages(messages):
+    """Envía varios mensajes de Mailjet en lotes. Ver MailjetBatchSender.send."""
+    return get_mailjet_sender().send(messages)
+
+def booking_confirmation_message(booking):
     client_obj = booking.client
     schedule = booking.schedule
     client_email = client_obj.email
@@ -29,15 +115,22 @@ def send_booking_confirmation_email(booking):
 
     if client_obj.active_membership:
         plan = client_obj.active_membership
-        from studio.utils import count_valid_monthly_bookings
-
-        bookings_this_month = count_valid_monthly_bookings(client_obj)
-
-        remaining = plan.classes_per_month - bookings_this_month
-        extra_info = (
-            f"<p>Actualmente tienes el plan <strong>{plan.name}</strong>.<br>"
-            f"Te quedan <strong>{remaining}</strong> clase(s) disponibles este mes.</p>"
-        )
+        if plan.classes_per_month:
+            from studio.utils import count_valid_monthly_bookings
+
+            bookings_this_month = count_valid_monthly_bookings(client_obj)
+
+            remaining = plan.classes_per_month - bookings_this_month
+            extra_info = (
+                f"<p>Actualmente tienes el plan <strong>{plan.name}</strong>.<br>"
+                f"Te quedan <strong>{remaining}</strong> clase(s) disponibles este mes.</p>"
+            )
+        else:
+            # classes_per_month nulo o 0: plan sin límite de clases
+            extra_info = (
+                f"<p>Actualmente tienes el plan <strong>{plan.name}</strong>, "
+                f"sin límite de clases este mes.</p>"
+            )
 
     elif not client_obj.trial_used:
         extra_info = "<p><strong>Esta es tu clase gratuita de prueba.</strong></p>"
@@ -71,30 +164,63 @@ def send_booking_confirmation_email(booking):
     </div>
     """
 
-    mailjet = Client(
-        auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1"
-    )
-    data = {
-        "Messages": [
-            {
-                "From": {
-                    "Email": "no-reply@vilepilates.com",
-                    "Name": "Vilé Pilates Studio",
-                },
-                "To": [{"Email": client_email, "Name": client_name}],
-                "Bcc": EXTRA_RECIPIENTS,
-                "Subject": "✨ Confirmación de tu clase en Vilé Pilates Studio ✨",
-                "HTMLPart": html_content,
-            }
-        ]
+    return {
+        "From": {
+            "Email": "no-reply@vilepilates.com",
+            "Name": "Vilé Pilates Studio",
+        },
+        "To": [{"Email": client_email, "Name": client_name}],
+        "Bcc": EXTRA_RECIPIENTS,
+        "Subject": "✨ Confirmación de tu clase en Vilé Pilates Studio ✨",
+        "HTMLPart": html_content,
     }
 
-    result = mailjet.send.create(data=data)
-    return result.status_code, result.json()
 
+def bulk_booking_confirmation_message(client_obj, schedule, bookings):
+    """Un solo correo con todas las clases reservadas en una reserva recurrente."""
+    client_email = client_obj.email
+    client_name = f"{client_obj.first_name} {client_obj.last_name}"
+    schedule_str = schedule.get_time_slot_display()
+    class_type = schedule.class_type.name if schedule.class_type else "Pilates"
+    logo_url = "https://vile-pilates.s3.us-east-2.amazonaws.com/imgs/vile.png"
 
+    dates_html = "".join(
+        f"<li><strong>{format_date(b.class_date, format='full', locale='es')}</strong></li>"
+        for b in sorted(bookings, key=lambda b: b.class_date)
+    )
 
-def send_subscription_confirmation_email(payment):
+    html_content = f"""
+    <div style="font-family: Arial, sans-serif; background-color: #f8f6f4; padding: 20px;">
+        <div style="max-width: 600px; margin: auto; background-color: white; padding: 30px; border-radius: 10px;">
+            <div style="text-align: center;">
+                <img src="{logo_url}" alt="Vilé Pilates" style="width: 150px; margin-bottom: 20px;">
+            </div>
+            <h2 style="text-align: center; color: #4c5840;">¡Clases Confirmadas! 💪</h2>
+            <p>Hola <strong>{client_name}</strong>,</p>
+            <p>Reservamos tus clases de <strong>{class_type}</strong> a las <strong>{schedule_str}</strong> para las siguientes fechas:</p>
+            <ul style="font-size: 16px; color: #4c5840;">{dates_html}</ul>
+            <p style="text-align: center;">📍 C.C. Plaza San Lucas, San Lucas Sacatepéquez</p>
+            <p>Recuerda llegar con al menos 5-10 minutos de anticipación para prepararte con calma.</p>
+            <hr />
+            <p style="font-size: 13px; color: gray;">Este es un mensaje automático. No respondas a este correo.</p>
+            <p style="font-size: 13px; color: gray;">© {timezone.now().year} Vilé Pilates Studio</p>
+        </div>
+    </div>
+    """
+
+    return {
+        "From": {
+            "Email": "no-reply@vilepilates.com",
+            "Name": "Vilé Pilates Studio",
+        },
+        "To": [{"Email": client_email, "Name": client_name}],
+        "Bcc": EXTRA_RECIPIENTS,
+        "Subject": f"✨ Confirmación de tus {len(bookings)} clases en Vilé Pilates Studio ✨",
+        "HTMLPart": html_content,
+    }
+
+
+def subscription_confirmation_message(payment):
     client = payment.client
     membership = payment.membership
     valid_until = format_date(payment.valid_until, format="long", locale="es")
@@ -124,55 +250,33 @@ def send_subscription_confirmation_email(payment):
         """
     )
 
-    mailjet = Client(
-        auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1"
-    )
-    data = {
-        "Messages": [
-            {
-                "From": {
-                    "Email": "no-reply@vilepilates.com",
-                    "Name": "Vilé Pilates Studio",
-                },
-                "To": [{"Email": email, "Name": client_name}],
-                "Subject": asunto,
-                "HTMLPart": f"""
-                <div style="font-family: Arial, sans-serif; background-color: #f8f6f4; padding: 20px;">
-                    <div style="max-width: 600px; margin: auto; background-color: white; padding: 30px; border-radius: 10px;">
-                        <div style="text-align: center;">
-                            <img src="{logo_url}" alt="Vilé Pilates" style="width: 150px; margin-bottom: 20px;">
-                        </div>
-                        <h2 style="text-align: center; color: #4c5840;">{asunto}</h2>
-                        {mensaje_principal}
-                        <p style="text-align: center;">📍 C.C. Plaza San Lucas, San Lucas Sacatepéquez</p>
-                        <p>Recuerda llegar con al menos 5-10 minutos de anticipación para prepararte con calma.</p>
-                        <hr />
-                        <p style="font-size: 13px; color: gray;">Este es un mensaje automático. No respondas a este correo.</p>
-                        <p style="font-size: 13px; color: gray;">© {timezone.now().year} Vilé Pilates Studio</p>
-                    </div>
+    return {
+        "From": {
+            "Email": "no-reply@vilepilates.com",
+            "Name": "Vilé Pilates Studio",
+        },
+        "To": [{"Email": email, "Name": client_name}],
+        "Subject": asunto,
+        "HTMLPart": f"""
+        <div style="font-family: Arial, sans-serif; background-color: #f8f6f4; padding: 20px;">
+            <div style="max-width: 600px; margin: auto; background-color: white; padding: 30px; border-radius: 10px;">
+                <div style="text-align: center;">
+                    <img src="{logo_url}" alt="Vilé Pilates" style="width: 150px; margin-bottom: 20px;">
                 </div>
-                """,
-            }
-        ]
+                <h2 style="text-align: center; color: #4c5840;">{asunto}</h2>
+                {mensaje_principal}
+                <p style="text-align: center;">📍 C.C. Plaza San Lucas, San Lucas Sacatepéquez</p>
+                <p>Recuerda llegar con al menos 5-10 minutos de anticipación para prepararte con calma.</p>
+                <hr />
+                <p style="font-size: 13px; color: gray;">Este es un mensaje automático. No respondas a este correo.</p>
+                <p style="font-size: 13px; color: gray;">© {timezone.now().year} Vilé Pilates Studio</p>
+            </div>
+        </div>
+        """,
     }
 
-    return mailjet.send.create(data=data)
-
-
-from mailjet_rest import Client
-from django.conf import settings
-from django.utils import timezone
-from babel.dates import format_date
-from datetime import timedelta, datetime
 
-from decimal import Decimal
-from mailjet_rest import Client
-from django.conf import settings
-from django.utils import timezone
-from babel.dates import format_date
-from datetime import timedelta
-
-def send_individual_booking_pending_email(booking):
+def individual_booking_pending_message(booking):
     client = booking.client
     schedule = booking.schedule
     price = booking.membership.price if booking.membership else Decimal("90")
@@ -239,22 +343,15 @@ def send_individual_booking_pending_email(booking):
     </div>
     """
 
-    mailjet = Client(auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1")
-    data = {
-        "Messages": [
-            {
-                "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
-                "To": [{"Email": client_email, "Name": client_name}],
-                "Subject": "Tu reserva está pendiente de pago – Realiza el depósito del 40%",
-                "HTMLPart": html_content,
-            }
-        ]
+    return {
+        "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
+        "To": [{"Email": client_email, "Name": client_name}],
+        "Subject": "Tu reserva está pendiente de pago – Realiza el depósito del 40%",
+        "HTMLPart": html_content,
     }
 
-    result = mailjet.send.create(data=data)
-    return result.status_code, result.json()
 
-def send_membership_cancellation_email(client):
+def membership_cancellation_message(client):
     client_name = f"{client.first_name} {client.last_name}"
     email = client.email
     logo_url = "https://vile-pilates.s3.us-east-2.amazonaws.com/imgs/vile.png"
@@ -282,21 +379,15 @@ def send_membership_cancellation_email(client):
     </div>
     """
 
-    mailjet = Client(auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1")
-    data = {
-        "Messages": [
-            {
-                "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
-                "To": [{"Email": email, "Name": client_name}],
-                "Subject": "🚫 Cancelación de tu membresía en Vilé Pilates",
-                "HTMLPart": html_content,
-            }
-        ]
+    return {
+        "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
+        "To": [{"Email": email, "Name": client_name}],
+        "Subject": "🚫 Cancelación de tu membresía en Vilé Pilates",
+        "HTMLPart": html_content,
     }
 
-    return mailjet.send.create(data=data)
 
-def send_renewal_reminder_email(client, payment):
+def renewal_reminder_message(client, payment):
     client_name = f"{client.first_name} {client.last_name}"
     email = client.email
     plan_name = payment.membership.name
@@ -322,21 +413,15 @@ def send_renewal_reminder_email(client, payment):
     </div>
     """
 
-    mailjet = Client(auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1")
-    data = {
-        "Messages": [
-            {
-                "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
-                "To": [{"Email": email, "Name": client_name}],
-                "Subject": "⏰ Tu membresía está por vencer – puedes renovar con el mismo precio",
-                "HTMLPart": html_content,
-            }
-        ]
+    return {
+        "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
+        "To": [{"Email": email, "Name": client_name}],
+        "Subject": "⏰ Tu membresía está por vencer – puedes renovar con el mismo precio",
+        "HTMLPart": html_content,
     }
 
-    return mailjet.send.create(data=data)
 
-def send_subscription_expired_email(client, payment):
+def subscription_expired_message(client, payment):
     client_name = f"{client.first_name} {client.last_name}"
     email = client.email
     plan_name = payment.membership.name
@@ -361,17 +446,85 @@ def send_subscription_expired_email(client, payment):
     </div>
     """
 
-    mailjet = Client(auth=(settings.MAILJET_API_KEY, settings.MAILJET_SECRET_KEY), version="v3.1")
-    data = {
-        "Messages": [
-            {
-                "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
-                "To": [{"Email": email, "Name": client_name}],
-                "Subject": "📢 Tu membresía ha vencido – ¡Te esperamos de vuelta!",
-                "HTMLPart": html_content,
-            }
-        ]
+    return {
+        "From": {"Email": "no-reply@vilepilates.com", "Name": "Vilé Pilates Studio"},
+        "To": [{"Email": email, "Name": client_name}],
+        "Subject": "📢 Tu membresía ha vencido – ¡Te esperamos de vuelta!",
+        "HTMLPart": html_content,
     }
 
-    return mailjet.send.create(data=data)
 
+
+# -----------------------------------------------------------------------------
+# Outbox: los request handlers encolan, el worker (process_email_outbox) envía.
+
+def queue_email(kind, message):
+    """
+    Encola un mensaje de Mailjet (el dict que devuelven los *_message).
+
+    Se guarda en la transacción actual, así que si la transacción se revierte
+    el correo tampoco se envía.
+    """
+    from studio.models import EmailOutbox
+
+    return EmailOutbox.objects.create(kind=kind, message=message)
+
+
+def _claim_outbox_batch(batch_size):
+    from django.db import transaction
+    from studio.models import EmailOutbox
+
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=["pending", "sending"], next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        # Un mensaje que quedó en "sending" vuelve a estar disponible cuando vence el lease
+        # (p. ej. si el worker murió a mitad del envío).
+        EmailOutbox.objects.filter(id__in=ids).update(
+            status="sending",
+            attempts=models.F("attempts") + 1,
+            next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+        )
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by("id"))
+
+
+def _mark_outbox_result(item, ok, error="", max_attempts=OUTBOX_MAX_ATTEMPTS):
+    now = timezone.now()
+    if ok:
+        item.status = "sent"
+        item.sent_at = now
+        item.last_error = ""
+    elif item.attempts >= max_attempts:
+        item.status = "dead"
+        item.last_error = error
+    else:
+        delay = min(OUTBOX_BACKOFF_SECONDS * 2 ** (item.attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+        item.status = "pending"
+        item.next_attempt_at = now + timedelta(seconds=delay)
+        item.last_error = error
+    item.save(update_fields=["status", "sent_at", "last_error", "next_attempt_at"])
+
+
+def process_outbox(batch_size=MAILJET_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """Envía un lote de mensajes pendientes. Devuelve {"sent", "retry", "dead"}."""
+    summary = {"sent": 0, "retry": 0, "dead": 0}
+    batch = _claim_outbox_batch(batch_size)
+    if not batch:
+        return summary
+
+    results = send_messages([item.message for item in batch])
+    for item, result in zip(batch, results):
+        ok = result["ok"]
+        _mark_outbox_result(item, ok, result["error"], max_attempts)
+        if ok:
+            summary["sent"] += 1
+        elif item.status == "dead":
+            summary["dead"] += 1
+        else:
+            summary["retry"] += 1
+
+    return summary
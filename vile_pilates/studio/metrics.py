@@ -0,0 +1,118 @@
+# studio/metrics.py
+"""
+Agregados de rendimiento por endpoint que llena PerformanceMiddleware
+(studio/middleware.py) y que expone la vista performance_metrics en formato
+de texto de Prometheus.
+
+Los histogramas viven en memoria de cada proceso: con varios workers de
+gunicorn, cada uno reporta los suyos (Prometheus los suma por instancia).
+"""
+import threading
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRIC_PREFIX = "vile"
+
+# Límites superiores (le) de cada histograma
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    "request_duration_seconds": ("Tiempo total del request.", SECONDS_BUCKETS),
+    "request_db_duration_seconds": ("Tiempo en consultas SQL por request.", SECONDS_BUCKETS),
+    "request_render_duration_seconds": ("Tiempo de render de la respuesta (JSON de DRF, plantillas).", SECONDS_BUCKETS),
+    "request_queries": ("Consultas SQL por request.", QUERY_BUCKETS),
+}
+LABELS = ("url_name", "method", "handler")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Histogramas y contador de respuestas por (url_name, method, handler)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = {}
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._responses = {}
+
+    def observe(self, labels, status_code, total, db, render, queries):
+        values = {
+            "request_duration_seconds": total,
+            "request_db_duration_seconds": db,
+            "request_render_duration_seconds": render,
+            "request_queries": queries,
+        }
+        with self._lock:
+            for name, value in values.items():
+                key = (name, labels)
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            response_key = labels + (str(status_code),)
+            self._responses[response_key] = self._responses.get(response_key, 0) + 1
+
+    def render(self):
+        """Todos los agregados en formato de texto de Prometheus."""
+        with self._lock:
+            histograms = {
+                key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()
+            }
+            responses = dict(self._responses)
+
+        lines = []
+        name = f"{METRIC_PREFIX}_responses_total"
+        lines += [f"# HELP {name} Respuestas por endpoint y código HTTP.", f"# TYPE {name} counter"]
+        for labels, value in sorted(responses.items()):
+            lines.append(f"{name}{_labels(zip(LABELS + ('status',), labels))} {value}")
+
+        for metric, (help_text, buckets) in HISTOGRAMS.items():
+            name = f"{METRIC_PREFIX}_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (key_metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if key_metric != metric:
+                    continue
+                pairs = list(zip(LABELS, labels))
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(pairs + [('le', '+Inf')])} {count}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(pairs)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,99 @@
+# studio/middleware.py
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import registry
+
+
+class _QueryTimer:
+    """execute_wrapper que cuenta y cronometra las consultas del request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def _handler_name(request):
+    """BookingViewSet.create, clases_por_mes... según la vista que atendió el request."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    func = match.func
+    cls = getattr(func, "cls", None)
+    if cls is None:
+        return getattr(func, "__name__", "unknown")
+    actions = getattr(func, "actions", None)
+    if actions:
+        return f"{cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}"
+    # @api_view envuelve la función en una clase WrappedAPIView
+    view_func = getattr(cls, request.method.lower(), None)
+    if cls.__name__ == "WrappedAPIView" and view_func is not None:
+        return getattr(view_func, "__name__", cls.__name__)
+    return cls.__name__
+
+
+class PerformanceMiddleware:
+    """
+    Mide por request el tiempo total, el tiempo y número de consultas SQL y el
+    tiempo de render de la respuesta; el resto ("view") es el código de la
+    vista, incluidos los serializers de DRF.
+
+    Los agrega por nombre de URL en studio.metrics (ver performance_metrics) y,
+    si el usuario es staff, los devuelve en el header Server-Timing.
+    Se desactiva con PERFORMANCE_METRICS_ENABLED = False.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, "PERFORMANCE_METRICS_ENABLED", True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        timer = _QueryTimer()
+        request._perf_render = 0.0
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        render = request._perf_render
+
+        match = getattr(request, "resolver_match", None)
+        labels = (match.view_name if match else "unresolved", request.method, _handler_name(request))
+        registry.observe(labels, response.status_code, total, timer.duration, render, timer.count)
+
+        # DRF copia el usuario autenticado por JWT al request de Django
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated and user.is_staff:
+            view = max(total - timer.duration - render, 0.0)
+            response["Server-Timing"] = ", ".join([
+                f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} consultas"',
+                f"view;dur={view * 1000:.1f}",
+                f"render;dur={render * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ])
+        return response
+
+    def process_template_response(self, request, response):
+        # Se llama justo antes de response.render(); el callback, justo después.
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._perf_render = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
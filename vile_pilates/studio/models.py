@@ -1,5 +1,5 @@
 # studio/models.py
-from django.db import models
+from django.db import models, transaction
 from accounts.models import Client, CustomUser
 from django.utils import timezone
 from datetime import timedelta
@@ -62,6 +62,14 @@ class Schedule(models.Model):
             self.capacity = 1
         super().save(*args, **kwargs)
 
+        from .availability import invalidate_all_availability
+        invalidate_all_availability()
+
+    def delete(self, *args, **kwargs):
+        from .availability import invalidate_all_availability
+        invalidate_all_availability()
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         tipo = "Individual" if self.is_individual else "Grupal"
         return f"{self.get_day_display()} {self.get_time_slot_display()} ({tipo})"
@@ -114,12 +122,32 @@ class Payment(models.Model):
     date_paid = models.DateTimeField(default=timezone.now)
     valid_until = models.DateField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # "Último pago" de un cliente
+            models.Index(fields=['client', '-date_paid'], name='payment_client_latest_idx'),
+            # Recordatorios, vencidos y periodo de gracia
+            models.Index(fields=['valid_until'], name='payment_valid_until_idx'),
+            # Ingresos mensuales y cierre diario
+            models.Index(fields=['date_paid'], name='payment_date_paid_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.valid_until:
             self.valid_until = (self.date_paid + timedelta(days=30)).date()
         if self.promotion:
             self.amount = self.promotion.price
-        super().save(*args, **kwargs)
+        previous = None
+        if self.pk:
+            previous = Payment.objects.filter(pk=self.pk).values_list('date_paid', 'amount').first()
+
+        from .utils import refresh_payment_snapshots, schedule_daily_closing_refresh, track_revenue_change
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            track_revenue_change('payment', self.pk, previous, (self.date_paid, self.amount))
+
+        refresh_payment_snapshots([self.client_id])
+        schedule_daily_closing_refresh(previous and previous[0], self.date_paid)
 
     def __str__(self):
         return f"Pago de {self.client} - {self.membership.name} - {self.date_paid.strftime('%Y-%m-%d')}"
@@ -134,13 +162,31 @@ class Venta(models.Model):
     date_sold = models.DateTimeField()
     notes = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_sold'], name='venta_date_sold_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         self.total_amount = self.quantity * self.price_per_unit
-        super().save(*args, **kwargs)
+        previous = None
+        if self.pk:
+            previous = Venta.objects.filter(pk=self.pk).values_list('date_sold', 'total_amount').first()
+
+        from .utils import schedule_daily_closing_refresh, track_revenue_change
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            track_revenue_change('venta', self.pk, previous, (self.date_sold, self.total_amount))
+
+        schedule_daily_closing_refresh(previous and previous[0], self.date_sold)
 
     def __str__(self):
         return f"{self.product_name} x{self.quantity} - {self.client}"
 
+# Estados de reserva que ocupan un cupo (las pendientes de pago también lo apartan).
+# Lo usan el ledger de cupos, la disponibilidad y el mapa de ocupación.
+SEAT_HOLDING_STATUSES = ('active', 'pending')
+
 class Booking(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pendiente de pago'),
@@ -195,6 +241,17 @@ class Booking(models.Model):
 
     class Meta:
         unique_together = ('client', 'schedule', 'class_date')
+        indexes = [
+            # Cupos de un horario en una fecha (reservas, ledger, cancelaciones)
+            models.Index(fields=['schedule', 'class_date', 'status'], name='booking_slot_status_idx'),
+            # Disponibilidad: solo reservas que ocupan cupo, por rango de fechas
+            models.Index(fields=['class_date', 'schedule'], condition=models.Q(status__in=SEAT_HOLDING_STATUSES),
+                         name='booking_active_date_idx'),
+            # Clases del mes por cliente (clases_por_mes, uso mensual, alertas)
+            models.Index(fields=['client', 'class_date'], name='booking_client_date_idx'),
+            # Rangos sin filtro de estado (mapa de ocupación, cierre diario)
+            models.Index(fields=['class_date'], name='booking_class_date_idx'),
+        ]
 
     def __str__(self):
         if self.status == 'cancelled':
@@ -213,15 +270,91 @@ class PlanIntent(models.Model):
 
     class Meta:
         unique_together = ['client', 'membership']
+        indexes = [
+            # Último intento pendiente de cada cliente
+            models.Index(fields=['client', 'is_confirmed', '-selected_at'], name='planintent_client_state_idx'),
+        ]
 
     def __str__(self):
         return f"Intento de {self.membership.name} por {self.client}"
 
+class ClassSeatLedger(models.Model):
+    """Cupos ocupados por (horario, fecha). Se actualiza en una sola sentencia al reservar/cancelar."""
+    schedule = models.ForeignKey(Schedule, on_delete=models.CASCADE, related_name='seat_ledger')
+    class_date = models.DateField()
+    booked = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('schedule', 'class_date')
+
+    def __str__(self):
+        return f"{self.schedule} {self.class_date}: {self.booked}/{self.schedule.capacity}"
+
+class MonthlyClassUsage(models.Model):
+    """Clases válidas (activas y sin no-show) por cliente y mes de la clase."""
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, related_name='monthly_usage')
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    used = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('client', 'year', 'month')
+
+    def __str__(self):
+        return f"{self.client} {self.month}/{self.year}: {self.used}"
+
+class DailyClosing(models.Model):
+    """
+    Cierre del día (fecha local del estudio). Solo existen filas para días con
+    pagos, igual que el resumen de cierres semanal.
+    """
+    date = models.DateField(unique=True)
+    payment_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    venta_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    card_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    visalink_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    attendance = models.PositiveIntegerField(default=0)
+    individual_classes = models.PositiveIntegerField(default=0)
+    trials = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Cierre {self.date}: {self.payment_total + self.venta_total}"
+
+class EmailOutbox(models.Model):
+    """Correos pendientes de envío; los procesa el comando process_email_outbox."""
+    STATUS_CHOICES = [
+        ('pending', 'Pendiente'),
+        ('sending', 'Enviando'),
+        ('sent', 'Enviado'),
+        ('dead', 'Fallido'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    message = models.JSONField()  # mensaje en formato Mailjet v3.1
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
 class MonthlyRevenue(models.Model):
     year = models.PositiveIntegerField()
     month = models.PositiveIntegerField()
     total_amount = models.DecimalField(max_digits=25, decimal_places=2, default=0)
-    payment_count = models.PositiveIntegerField(default=0)
+    # Enteros con signo: la proyección es la suma exacta de RevenueEvent.
+    payment_count = models.IntegerField(default=0)
     venta_count = models.IntegerField(default=0)
     venta_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # nuevo
     last_updated = models.DateTimeField(auto_now=True)
@@ -233,3 +366,30 @@ class MonthlyRevenue(models.Model):
     def __str__(self):
         return f"{self.month}/{self.year} - Q{self.total_amount}"
 
+class RevenueEvent(models.Model):
+    """
+    Movimiento de ingresos (solo se agregan filas, nunca se editan).
+    MonthlyRevenue es la suma de estos eventos por mes.
+    """
+    SOURCE_CHOICES = [
+        ('payment', 'Pago'),
+        ('venta', 'Venta'),
+        ('adjustment', 'Ajuste de conciliación'),
+    ]
+
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    source_id = models.PositiveIntegerField(null=True, blank=True)
+    year = models.PositiveIntegerField()
+    month = models.PositiveIntegerField()
+    total_delta = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    payment_count_delta = models.IntegerField(default=0)
+    venta_total_delta = models.DecimalField(max_digits=25, decimal_places=2, default=0)
+    venta_count_delta = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['year', 'month'])]
+
+    def __str__(self):
+        return f"{self.source} #{self.source_id} {self.month}/{self.year}: {self.total_delta}"
+
@@ -0,0 +1,92 @@
+# studio/occupancy.py
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncWeek
+
+from .models import SEAT_HOLDING_STATUSES, Booking, Schedule
+
+# Máximo de semanas que se pueden pedir en el mapa de ocupación.
+MAX_HEATMAP_WEEKS = 26
+
+DAYS = [code for code, _ in Schedule.DAY_CHOICES]
+TIME_SLOTS = [code for code, _ in Schedule.TIME_SLOTS]
+
+
+def week_bounds(start, end):
+    """Extiende start al lunes y end al domingo de sus semanas."""
+    start = start - timedelta(days=start.weekday())
+    end = end + timedelta(days=6 - end.weekday())
+    return start, end
+
+
+def _ratio(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(denominator > 0, numerator / denominator, np.nan)
+    return np.round(ratio, 4)
+
+
+def _records(df):
+    # NaN (celdas sin capacidad) se devuelve como null
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict('records')
+
+
+def build_occupancy_heatmap(start, end):
+    """
+    Ocupación por día × bloque horario × semana entre start y end (semanas completas).
+
+    Las reservas se cuentan con una sola consulta agrupada por
+    (día, bloque, semana) y se pivotan con pandas sobre la grilla completa,
+    así las celdas sin reservas aparecen con 0. La capacidad de cada celda es
+    la suma de capacidades de los horarios actuales en ese día y bloque.
+    """
+    start, end = week_bounds(start, end)
+    weeks = [start + timedelta(weeks=i) for i in range((end - start).days // 7 + 1)]
+
+    rows = (
+        Booking.objects.filter(class_date__range=[start, end])
+        .annotate(week=TruncWeek('class_date'))
+        .values('schedule__day', 'schedule__time_slot', 'week')
+        .annotate(
+            booked=Count('id', filter=Q(status__in=SEAT_HOLDING_STATUSES)),
+            attended=Count('id', filter=Q(attendance_status='attended')),
+        )
+    )
+    capacity_rows = Schedule.objects.values('day', 'time_slot').annotate(capacity=Sum('capacity'))
+
+    grid = pd.MultiIndex.from_product([DAYS, TIME_SLOTS, weeks], names=['day', 'time_slot', 'week'])
+
+    counts = pd.DataFrame.from_records(
+        list(rows), columns=['schedule__day', 'schedule__time_slot', 'week', 'booked', 'attended'],
+    ).rename(columns={'schedule__day': 'day', 'schedule__time_slot': 'time_slot'})
+    # TruncWeek puede devolver datetime según el motor; la grilla usa fechas.
+    counts['week'] = pd.to_datetime(counts['week']).dt.date
+    counts = counts.set_index(['day', 'time_slot', 'week']).reindex(grid, fill_value=0).astype(int)
+
+    capacity = pd.DataFrame.from_records(
+        list(capacity_rows), columns=['day', 'time_slot', 'capacity'],
+    ).set_index(['day', 'time_slot'])['capacity']
+    counts['capacity'] = capacity.reindex(grid.droplevel('week'), fill_value=0).to_numpy()
+
+    counts['fill_ratio'] = _ratio(counts['booked'], counts['capacity'])
+    counts['attendance_ratio'] = _ratio(counts['attended'], counts['capacity'])
+
+    totals = counts[['booked', 'attended', 'capacity']].groupby(level=['day', 'time_slot'], sort=False).sum()
+    totals['fill_ratio'] = _ratio(totals['booked'], totals['capacity'])
+    totals['attendance_ratio'] = _ratio(totals['attended'], totals['capacity'])
+
+    cells = counts.reset_index()
+    cells['week'] = cells['week'].map(lambda d: d.isoformat())
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "weeks": [w.isoformat() for w in weeks],
+        "cells": _records(cells),
+        "totals": _records(totals.reset_index()),
+    }
@@ -77,10 +77,13 @@ class ScheduleWithBookingsSerializer(serializers.ModelSerializer):
         ]
 
     def get_bookings(self, obj):
-        today = self.context.get("today")
-        bookings = Booking.objects.filter(
-            schedule=obj, class_date=today, status="active"
-        )
+        # ScheduleViewSet.get_today_classes las precarga en today_bookings
+        bookings = getattr(obj, "today_bookings", None)
+        if bookings is None:
+            today = self.context.get("today")
+            bookings = Booking.objects.filter(
+                schedule=obj, class_date=today, status="active"
+            ).select_related("client")
         return BookingAttendanceInlineSerializer(bookings, many=True).data
 
 
@@ -142,9 +145,12 @@ class PaymentSerializer(serializers.ModelSerializer):
 
 class BookingSerializer(serializers.ModelSerializer):
     client = serializers.StringRelatedField(read_only=True)
+    # Se traen los datos del snapshot de pago que usa BookingViewSet.create.
     client_id = serializers.PrimaryKeyRelatedField(
         source="client",
-        queryset=__import__("accounts.models").models.Client.objects.all(),
+        queryset=__import__("accounts.models").models.Client.objects.select_related(
+            "latest_payment__promotion", "latest_payment_membership"
+        ),
         write_only=True,
     )
     schedule = serializers.StringRelatedField(read_only=True)
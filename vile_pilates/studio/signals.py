@@ -0,0 +1,38 @@
+# studio/signals.py
+"""
+Las bajas de reservas, pagos y ventas se registran con post_delete y no en
+Model.delete(): así también cuentan las eliminaciones en cascada (p. ej. al
+borrar un cliente) y las de QuerySet.delete(). Django envía la señal dentro
+de la transacción del borrado.
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .availability import invalidate_availability
+from .models import SEAT_HOLDING_STATUSES, Booking, Payment, Venta
+from .utils import (
+    refresh_payment_snapshots, release_seat, schedule_daily_closing_refresh, track_revenue_change,
+    track_usage_change, usage_key,
+)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    if instance.status in SEAT_HOLDING_STATUSES:
+        release_seat(instance.schedule_id, instance.class_date)
+    track_usage_change(usage_key(instance), None)
+    invalidate_availability(instance.class_date)
+    schedule_daily_closing_refresh(instance.class_date)
+
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    track_revenue_change('payment', instance.pk, (instance.date_paid, instance.amount), None)
+    refresh_payment_snapshots([instance.client_id])
+    schedule_daily_closing_refresh(instance.date_paid)
+
+
+@receiver(post_delete, sender=Venta)
+def venta_deleted(sender, instance, **kwargs):
+    track_revenue_change('venta', instance.pk, (instance.date_sold, instance.total_amount), None)
+    schedule_daily_closing_refresh(instance.date_sold)
@@ -2,46 +2,53 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from django_apscheduler.jobstores import DjangoJobStore
 from django_apscheduler.models import DjangoJobExecution
 from studio.models import Payment
-from studio.management.mails.mails import send_renewal_reminder_email, send_subscription_expired_email
+from studio.management.mails.mails import renewal_reminder_message, subscription_expired_message, send_messages
+from studio.utils import payments_not_renewed, refresh_recent_daily_closings
+from studio.alerts import rebuild_no_show_streaks
 from django.utils import timezone
 from datetime import timedelta
 
 
+def _build_messages(payments, build):
+    messages = []
+    for payment in payments:
+        try:
+            messages.append(build(payment.client, payment))
+        except Exception as e:
+            print(f"Error preparando correo para {payment.client.email}: {e}")
+    return messages
+
+
 def run_reminder_task():
     hoy = timezone.now().date()
     target_date = hoy + timedelta(days=2)
 
-    pagos = Payment.objects.filter(valid_until=target_date).select_related('client', 'membership')
-
-    for pago in pagos:
-        # Validar que no haya una renovación más reciente
-        if Payment.objects.filter(client=pago.client, date_paid__gt=pago.date_paid, valid_until__gt=pago.valid_until).exists():
-            continue
-        try:
-            send_renewal_reminder_email(pago.client, pago)
-        except Exception as e:
-            print(f"Error al enviar recordatorio a {pago.client.email}: {e}")
+    messages = _build_messages(payments_not_renewed(target_date), renewal_reminder_message)
+    for result in send_messages(messages):
+        if not result["ok"]:
+            print(f"Error al enviar recordatorio a {result['email']}: {result['error']}")
 
 def run_expired_subscription_task():
     today = timezone.now().date()
     yesterday = today - timedelta(days=1)
 
-    expired_payments = Payment.objects.filter(valid_until=yesterday)
+    messages = _build_messages(payments_not_renewed(yesterday), subscription_expired_message)
+    for result in send_messages(messages):
+        if result["ok"]:
+            print(f"✔️ Correo de vencimiento enviado a {result['email']}")
+        else:
+            print(f"❌ Error enviando correo de vencimiento a {result['email']}: {result['error']}")
+
 
-    for payment in expired_payments:
-        # Confirmar que no haya renovado después de ese pago
-        has_renewed = Payment.objects.filter(
-            client=payment.client,
-            date_paid__gt=payment.date_paid,
-            valid_until__gt=payment.valid_until
-        ).exists()
+def run_daily_closing_task():
+    dias = refresh_recent_daily_closings()
+    print(f"📊 Cierres diarios actualizados: {dias} día(s)")
 
-        if not has_renewed:
-            try:
-                send_subscription_expired_email(payment.client, payment)
-                print(f"✔️ Correo de vencimiento enviado a {payment.client.email}")
-            except Exception as e:
-                print(f"❌ Error enviando correo de vencimiento: {e}")
+
+def run_no_show_streak_task():
+    # Al cambiar el día, las reservas de ayer pasan a contar para la racha
+    clientes = rebuild_no_show_streaks()
+    print(f"🚩 Rachas de inasistencia recalculadas: {clientes} cliente(s) con racha")
 
 
 def start():
@@ -66,5 +73,22 @@ def start():
         replace_existing=True,
     )
 
-    print("🔁 Tareas programadas: recordatorio_renovacion, aviso_vencimiento")
+    scheduler.add_job(
+        run_daily_closing_task,
+        trigger="cron",
+        minute=15,
+        id="cierre_diario",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        run_no_show_streak_task,
+        trigger="cron",
+        hour=0,
+        minute=30,
+        id="racha_inasistencias",
+        replace_existing=True,
+    )
+
+    print("🔁 Tareas programadas: recordatorio_renovacion, aviso_vencimiento, cierre_diario, racha_inasistencias")
     scheduler.start()
@@ -1,3 +1,1790 @@
-from django.test import TestCase
+import json
+import re
+import tempfile
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Count, F, Q, Sum
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Client, CustomUser
+from accounts.search import search_clients, sync_search_tokens
+from studio.management.mails import mails
+from studio.management.mails.mails import MailjetBatchSender, process_outbox, queue_email
+from studio.alerts import compute_no_show_streaks, get_clients_with_consecutive_no_shows, rebuild_no_show_streaks
+from studio.availability import availability_cache_stats, build_availability, get_availability
+from studio.models import (
+    SEAT_HOLDING_STATUSES, Booking, ClassType, ClassSeatLedger, DailyClosing, EmailOutbox, Membership,
+    MonthlyClassUsage, MonthlyRevenue, Payment, PlanIntent, PromotionInstance, RevenueEvent, Schedule, Venta,
+)
+from studio.benchmark import compare_reports, regressions, run_benchmark
+from studio.datagen import SOURCES, delete_generated_data, generate_studio_data, generated_clients, is_local_database
+from studio.metrics import registry as metrics_registry
+from studio.occupancy import DAYS, MAX_HEATMAP_WEEKS, TIME_SLOTS
+from studio.utils import monthly_revenue_drift, recalculate_all_monthly_revenue, recalculate_monthly_revenue, rebuild_daily_closings, reconcile_monthly_revenue, rebuild_monthly_usage, rebuild_seat_ledger, reserve_seat, sync_seat_ledger
+from studio.tasks.scheduler import run_reminder_task
+
+
+class FakeMailjetServer:
+    """
+    Servidor HTTP local que imita POST /v3.1/send de Mailjet.
+
+    Rechaza (Status "error") los destinatarios cuyo correo contiene "rechazado"
+    y guarda cada llamada recibida en ``calls``.
+    """
+
+    def __init__(self):
+        self.calls = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, para verificar el reuso de la sesión
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.calls.append({"port": self.client_address[1], "messages": body["Messages"]})
+
+                statuses = []
+                for message in body["Messages"]:
+                    email = message["To"][0]["Email"]
+                    if "rechazado" in email:
+                        statuses.append({
+                            "Status": "error",
+                            "Errors": [{"ErrorMessage": f"Destinatario inválido: {email}"}],
+                        })
+                    else:
+                        statuses.append({
+                            "Status": "success",
+                            "To": [{"Email": email, "MessageID": len(statuses) + 1}],
+                        })
+                failed = any(s["Status"] == "error" for s in statuses)
+
+                payload = json.dumps({"Messages": statuses}).encode()
+                self.send_response(400 if failed else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v3.1/send"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _message(email):
+    return {
+        "From": {"Email": "info@vilepilates.com", "Name": "Vilé Pilates"},
+        "To": [{"Email": email, "Name": email}],
+        "Subject": "Prueba",
+        "HTMLPart": "<p>Prueba</p>",
+    }
+
+
+class MailjetBatchSenderTests(TestCase):
+    def setUp(self):
+        self.server = FakeMailjetServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        # Cada prueba usa su propio sender apuntando al servidor falso.
+        self.settings_override = override_settings(MAILJET_API_URL=self.server.url)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        mails._batch_sender = None
+        self.addCleanup(setattr, mails, "_batch_sender", None)
+
+    def test_send_groups_messages_and_reuses_connection(self):
+        sender = MailjetBatchSender()
+        results = sender.send([_message(f"cliente{i}@example.com") for i in range(120)])
+        sender.close()
+
+        self.assertEqual([len(c["messages"]) for c in self.server.calls], [50, 50, 20])
+        self.assertEqual(len({c["port"] for c in self.server.calls}), 1)
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual(results[119]["email"], "cliente119@example.com")
+
+    def test_send_reports_per_recipient_failures(self):
+        sender = MailjetBatchSender()
+        results = sender.send([
+            _message("ana@example.com"),
+            _message("rechazado@example.com"),
+            _message("luis@example.com"),
+        ])
+        sender.close()
+
+        self.assertEqual([r["ok"] for r in results], [True, False, True])
+        self.assertIn("rechazado@example.com", results[1]["error"])
+
+    def test_send_marks_batch_failed_when_server_is_down(self):
+        sender = MailjetBatchSender(api_url="http://127.0.0.1:9/v3.1/send", timeout=2)
+        results = sender.send([_message("ana@example.com"), _message("luis@example.com")])
+        sender.close()
+
+        self.assertEqual([r["ok"] for r in results], [False, False])
+        self.assertTrue(results[0]["error"])
+
+    def test_reminder_task_batches_and_skips_renewed_clients(self):
+        membership = Membership.objects.create(name="8 clases", price=300, classes_per_month=8)
+        clients = Client.objects.bulk_create([
+            Client(first_name=f"Cliente{i}", last_name="Prueba", email=f"cliente{i}@example.com", dpi=str(10_000 + i))
+            for i in range(230)
+        ])
+        target = timezone.now().date() + timedelta(days=2)
+        paid = timezone.now() - timedelta(days=28)
+        Payment.objects.bulk_create([
+            Payment(client=c, membership=membership, amount=300, date_paid=paid, valid_until=target)
+            for c in clients
+        ])
+        # Los primeros 30 ya renovaron.
+        Payment.objects.bulk_create([
+            Payment(client=c, membership=membership, amount=300, date_paid=timezone.now(),
+                    valid_until=target + timedelta(days=30))
+            for c in clients[:30]
+        ])
+
+        with self.assertNumQueries(1):
+            run_reminder_task()
+
+        sent = [m["To"][0]["Email"] for c in self.server.calls for m in c["messages"]]
+        self.assertEqual(len(self.server.calls), 4)
+        self.assertEqual(len(sent), 200)
+        self.assertNotIn("cliente0@example.com", sent)
+
+    def test_outbox_retries_only_failed_messages(self):
+        queue_email("prueba", _message("ana@example.com"))
+        queue_email("prueba", _message("rechazado@example.com"))
+
+        self.assertEqual(process_outbox(), {"sent": 1, "retry": 1, "dead": 0})
+        self.assertEqual(len(self.server.calls), 1)
+
+        failed = EmailOutbox.objects.get(status="pending")
+        self.assertEqual(failed.message["To"][0]["Email"], "rechazado@example.com")
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+
+
+def next_weekday(weekday, weeks=1):
+    """Fecha futura con el día de la semana dado (0 = lunes)."""
+    today = timezone.localdate()
+    return today + timedelta(days=(weekday - today.weekday()) % 7 + 7 * weeks)
+
+
+class SeatLedgerTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.individual = Membership.objects.create(pk=1, name='Clase individual', price=90, classes_per_month=0)
+        class_type = ClassType.objects.create(name='Reformer')
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=1, class_type=class_type)
+        self.other = Schedule.objects.create(day='MON', time_slot='08:00', capacity=1, class_type=class_type)
+        self.monday = next_weekday(0)
+        self.clients = [
+            Client.objects.create(first_name=f'Cliente{i}', last_name='Cupo', email=f'c{i}@example.com', dpi=str(40_000 + i))
+            for i in range(3)
+        ]
+
+    def book(self, client, schedule=None, **data):
+        return self.api.post('/api/studio/bookings/', {
+            'client_id': client.id, 'schedule_id': (schedule or self.schedule).id,
+            'class_date': self.monday.isoformat(), **data,
+        })
+
+    def booked(self, schedule=None):
+        return ClassSeatLedger.objects.get(schedule=schedule or self.schedule, class_date=self.monday).booked
+
+    def slot(self, schedule=None):
+        slots = build_availability(self.monday, self.monday)[self.monday]
+        return next(s for s in slots if s['schedule_id'] == (schedule or self.schedule).id)
+
+    def test_booking_at_capacity_is_rejected(self):
+        self.assertEqual(self.book(self.clients[0]).status_code, 201)
+        response = self.book(self.clients[1])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'No hay cupo disponible para este horario.')
+        self.assertEqual(self.booked(), 1)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_concurrent_reservation_sees_the_seat_taken(self):
+        # Otra transacción ya ocupó el cupo pero su reserva todavía no es visible
+        self.assertTrue(reserve_seat(self.schedule, self.monday))
+        self.assertFalse(reserve_seat(self.schedule, self.monday))
+        self.assertEqual(self.book(self.clients[0]).status_code, 400)
+
+    def test_pending_booking_holds_the_seat_in_availability_too(self):
+        self.assertEqual(self.book(self.clients[0], membership_id=self.individual.id).status_code, 201)
+        self.assertEqual(Booking.objects.get().status, 'pending')
+        self.assertEqual(self.slot()['booked'], self.booked())
+        self.assertFalse(self.slot()['available'])
+        self.assertEqual(self.book(self.clients[1]).status_code, 400)
+
+    def test_cancel_reschedule_and_destroy_release_the_seat(self):
+        self.book(self.clients[0])
+        first = Booking.objects.get(client=self.clients[0])
+        self.assertEqual(self.api.put(f'/api/studio/bookings/{first.id}/cancel/', {'reason': 'viaje'}).status_code, 200)
+        self.assertEqual(self.booked(), 0)
+        self.assertTrue(self.slot()['available'])
+
+        self.assertEqual(self.book(self.clients[1]).status_code, 201)
+        second = Booking.objects.get(client=self.clients[1])
+        response = self.api.put(f'/api/studio/bookings/{second.id}/reschedule/',
+                                {'schedule_id': self.other.id, 'class_date': self.monday.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.booked(), self.booked(self.other)), (0, 1))
+        # El horario nuevo ya está lleno
+        self.assertEqual(self.book(self.clients[2], self.other).status_code, 400)
+
+        self.assertEqual(self.book(self.clients[2]).status_code, 201)
+        third = Booking.objects.get(client=self.clients[2])
+        self.assertEqual(self.api.delete(f'/api/studio/bookings/{third.id}/').status_code, 204)
+        self.assertEqual(self.booked(), 0)
+
+    def test_update_cannot_move_a_booking_into_a_full_class(self):
+        self.book(self.clients[0])
+        self.book(self.clients[1], self.other)
+        moved = Booking.objects.get(client=self.clients[1])
+
+        response = self.api.patch(f'/api/studio/bookings/{moved.id}/', {'schedule_id': self.schedule.id})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Booking.objects.get(pk=moved.pk).schedule, self.other)
+        self.assertEqual((self.booked(), self.booked(self.other)), (1, 1))
+
+        self.api.put(f'/api/studio/bookings/{Booking.objects.get(client=self.clients[0]).id}/cancel/')
+        response = self.api.patch(f'/api/studio/bookings/{moved.id}/', {'schedule_id': self.schedule.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.booked(), self.booked(self.other)), (1, 0))
+
+    def test_deleting_a_client_releases_its_seats(self):
+        self.book(self.clients[0])
+        self.assertFalse(self.slot()['available'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.api.delete(f'/api/accounts/clients/{self.clients[0].id}/').status_code, 204)
+        self.assertEqual(self.booked(), 0)
+        self.assertTrue(self.slot()['available'])
+        self.assertEqual(self.book(self.clients[1]).status_code, 201)
+
+    def test_rebuild_recounts_and_zeroes_empty_slots(self):
+        self.book(self.clients[0])
+        self.book(self.clients[1], self.other)
+        Booking.objects.filter(schedule=self.other).delete()
+        ClassSeatLedger.objects.filter(schedule=self.schedule).update(booked=5)
+
+        self.assertEqual(rebuild_seat_ledger(), 1)
+        self.assertEqual((self.booked(), self.booked(self.other)), (1, 0))
+
+
+class BulkBookingTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        plan = Membership.objects.create(name='Ilimitado', price=600)
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=2)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Lote', email='ana@example.com',
+                                                dpi='80000', trial_used=True)
+        Payment.objects.create(client=self.client_obj, membership=plan, amount=600, date_paid=timezone.now())
+        self.mondays = [next_weekday(0, weeks) for weeks in (1, 2, 3)]
+
+    def bulk(self, **data):
+        return self.api.post('/api/studio/bookings/bulk/',
+                             {'client_id': self.client_obj.id, 'schedule_id': self.schedule.id, **data}, format='json')
+
+    def statuses(self, response):
+        return {row['date']: row['status'] for row in response.data['results']}
+
+    def test_range_books_the_schedule_weekday_only(self):
+        response = self.bulk(start=self.mondays[0].isoformat(), end=(self.mondays[2] + timedelta(days=3)).isoformat())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.statuses(response), {d.isoformat(): 'created' for d in self.mondays})
+        self.assertEqual(set(Booking.objects.values_list('class_date', flat=True)), set(self.mondays))
+        self.assertEqual(EmailOutbox.objects.filter(kind='bulk_booking_confirmation').count(), 1)
+
+    def test_dates_list_reports_each_rejected_date(self):
+        tuesday = self.mondays[0] + timedelta(days=1)
+        past = self.mondays[0] - timedelta(weeks=3)
+        response = self.bulk(dates=[d.isoformat() for d in (self.mondays[0], tuesday, past)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        details = {row['date']: row.get('detail') for row in response.data['results']}
+        self.assertEqual(details[tuesday.isoformat()], 'El horario no corresponde a ese día.')
+        self.assertEqual(details[past.isoformat()], 'La fecha ya pasó.')
+
+    def test_full_dates_are_rejected_and_the_rest_booked(self):
+        for i in range(2):
+            other = Client.objects.create(first_name=f'Otra{i}', last_name='Lote', dpi=str(80_001 + i))
+            Booking.objects.create(client=other, schedule=self.schedule, class_date=self.mondays[1])
+        sync_seat_ledger({(self.schedule.id, self.mondays[1])})
+
+        response = self.bulk(dates=[d.isoformat() for d in self.mondays])
+        self.assertEqual(self.statuses(response), {
+            self.mondays[0].isoformat(): 'created', self.mondays[1].isoformat(): 'failed',
+            self.mondays[2].isoformat(): 'created',
+        })
+        ledger = dict(ClassSeatLedger.objects.values_list('class_date', 'booked'))
+        self.assertEqual([ledger[d] for d in self.mondays], [1, 2, 1])
+
+    def test_concurrent_duplicate_request_returns_409_and_rolls_back(self):
+        from studio import utils
+
+        Membership.objects.update(classes_per_month=8)
+        real_count = utils.count_valid_monthly_bookings
+
+        def count_after_other_request(client, reference_date=None):
+            # La otra solicitud confirma su reserva entre la validación y el insert
+            if not Booking.objects.exists():
+                Booking.objects.create(client=self.client_obj, schedule=self.schedule, class_date=self.mondays[1])
+                sync_seat_ledger({(self.schedule.id, self.mondays[1])})
+            return real_count(client, reference_date)
+
+        with mock.patch.object(utils, 'count_valid_monthly_bookings', side_effect=count_after_other_request):
+            response = self.bulk(dates=[d.isoformat() for d in self.mondays])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['conflicts'], [self.mondays[1].isoformat()])
+        self.assertEqual(list(Booking.objects.values_list('class_date', flat=True)), [self.mondays[1]])
+        ledger = dict(ClassSeatLedger.objects.values_list('class_date', 'booked'))
+        self.assertEqual([ledger.get(d, 0) for d in self.mondays], [0, 1, 0])
+        self.assertFalse(EmailOutbox.objects.exists())
+
+
+class MonthlyUsageTests(TestCase):
+    january, february = date(2030, 1, 7), date(2030, 2, 4)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=5)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Uso', email='ana@example.com', dpi='60000')
+
+    def used(self, day):
+        return MonthlyClassUsage.objects.filter(
+            client=self.client_obj, year=day.year, month=day.month,
+        ).values_list('used', flat=True).first()
+
+    def book(self, day):
+        response = self.api.post('/api/studio/bookings/', {
+            'client_id': self.client_obj.id, 'schedule_id': self.schedule.id, 'class_date': day.isoformat(),
+        })
+        self.assertEqual(response.status_code, 201)
+        return Booking.objects.get(client=self.client_obj, class_date=day)
+
+    def test_counters_follow_every_booking_transition(self):
+        booking = self.book(self.january)
+        self.assertEqual(self.used(self.january), 1)
+
+        self.api.put(f'/api/studio/bookings/{booking.id}/attendance/', {'attendance_status': 'no_show'})
+        self.assertEqual(self.used(self.january), 0)
+        self.api.put(f'/api/studio/bookings/{booking.id}/attendance/', {'attendance_status': 'attended'})
+        self.assertEqual(self.used(self.january), 1)
+
+        self.api.put(f'/api/studio/bookings/{booking.id}/reschedule/',
+                     {'schedule_id': self.schedule.id, 'class_date': self.february.isoformat()})
+        self.assertEqual((self.used(self.january), self.used(self.february)), (0, 1))
+
+        self.api.put(f'/api/studio/bookings/{booking.id}/cancel/', {'reason': 'viaje'})
+        self.assertEqual(self.used(self.february), 0)
+
+        other = self.book(self.january)
+        self.assertEqual(self.used(self.january), 1)
+        self.api.delete(f'/api/studio/bookings/{other.id}/')
+        self.assertEqual(self.used(self.january), 0)
+
+    def test_rebuild_recounts_and_keeps_empty_counters(self):
+        self.book(self.january)
+        february = self.book(self.february)
+        Booking.objects.filter(pk=february.pk).update(status='cancelled')
+        MonthlyClassUsage.objects.filter(client=self.client_obj).update(used=7)
+
+        self.assertEqual(rebuild_monthly_usage(), 1)
+        self.assertEqual((self.used(self.january), self.used(self.february)), (1, 0))
+
+
+class PaymentSnapshotTests(TestCase):
+    def setUp(self):
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.other_plan = Membership.objects.create(name='Ilimitado', price=600)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Pago', dpi='70000')
+
+    def snapshot(self):
+        self.client_obj.refresh_from_db()
+        return (self.client_obj.latest_payment_id, self.client_obj.latest_payment_membership_id,
+                self.client_obj.latest_valid_until, self.client_obj.has_active_membership)
+
+    def test_snapshot_follows_payment_writes(self):
+        today = timezone.localdate()
+        old = Payment.objects.create(client=self.client_obj, membership=self.plan, amount=300,
+                                     date_paid=timezone.now() - timedelta(days=40))
+        self.assertEqual(self.snapshot(), (old.id, self.plan.id, old.valid_until, False))
+
+        new = Payment.objects.create(client=self.client_obj, membership=self.other_plan, amount=600,
+                                     date_paid=timezone.now() - timedelta(days=5))
+        self.assertEqual(self.snapshot(), (new.id, self.other_plan.id, new.valid_until, True))
+
+        new.valid_until = today - timedelta(days=1)
+        new.save()
+        self.assertEqual(self.snapshot(), (new.id, self.other_plan.id, today - timedelta(days=1), False))
+
+        # Al mover el pago viejo después del nuevo pasa a ser el último
+        old.date_paid = timezone.now()
+        old.valid_until = today + timedelta(days=30)
+        old.save()
+        self.assertEqual(self.snapshot(), (old.id, self.plan.id, today + timedelta(days=30), True))
+
+        # Al borrar el último pago se toma el anterior
+        old.delete()
+        self.assertEqual(self.snapshot(), (new.id, self.other_plan.id, today - timedelta(days=1), False))
+        new.delete()
+        self.assertEqual(self.snapshot(), (None, None, None, False))
+
+
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        # Cache en archivos: compartido entre procesos, como Redis
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        shared = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp.name,
+        }})
+        shared.enable()
+        self.addCleanup(shared.disable)
+
+        self.api = APIClient()
+        class_type = ClassType.objects.create(name='Reformer')
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=5, class_type=class_type)
+        self.other = Schedule.objects.create(day='MON', time_slot='08:00', capacity=5, class_type=class_type)
+        self.monday = next_weekday(0)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Cache', email='ana@example.com', dpi='50000')
+
+    def slots(self):
+        return {s['schedule_id']: s for s in get_availability(self.monday, self.monday)[self.monday]}
+
+    def write(self, method, path, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.api, method)(path, data)
+        self.assertLess(response.status_code, 300, response.data)
+        return response
+
+    def test_payload_is_served_from_cache(self):
+        self.slots()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slots()[self.schedule.id]['booked'], 0)
+        self.assertEqual(availability_cache_stats()['hits'], 1)
+
+    def test_booking_writes_invalidate_the_date(self):
+        self.assertEqual(self.slots()[self.schedule.id]['booked'], 0)
+
+        self.write('post', '/api/studio/bookings/', {
+            'client_id': self.client_obj.id, 'schedule_id': self.schedule.id, 'class_date': self.monday.isoformat(),
+        })
+        self.assertEqual(self.slots()[self.schedule.id]['booked'], 1)
+
+        booking = Booking.objects.get()
+        self.write('put', f'/api/studio/bookings/{booking.id}/reschedule/',
+                   {'schedule_id': self.other.id, 'class_date': self.monday.isoformat()})
+        slots = self.slots()
+        self.assertEqual((slots[self.schedule.id]['booked'], slots[self.other.id]['booked']), (0, 1))
+
+        self.write('put', f'/api/studio/bookings/{booking.id}/cancel/', {'reason': 'viaje'})
+        self.assertEqual(self.slots()[self.other.id]['booked'], 0)
+
+    def test_schedule_edit_invalidates_every_date(self):
+        self.assertEqual(self.slots()[self.schedule.id]['capacity'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.schedule.capacity = 12
+            self.schedule.save()
+        self.assertEqual(self.slots()[self.schedule.id]['capacity'], 12)
+
+    def test_booking_writes_invalidate_summary_by_class_type(self):
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        summary = lambda: self.api.get('/api/studio/summary-by-class-type/').data
+        self.assertEqual(summary(), [])
+        with self.assertNumQueries(0):
+            summary()
+
+        self.write('post', '/api/studio/bookings/', {
+            'client_id': self.client_obj.id, 'schedule_id': self.schedule.id, 'class_date': self.monday.isoformat(),
+        })
+        self.assertEqual([item['count'] for item in summary()], [1])
+
+        booking = Booking.objects.get()
+        self.write('put', f'/api/studio/bookings/{booking.id}/cancel/', {'reason': 'viaje'})
+        self.assertEqual(summary()[0]['count'], 1)
+        self.assertEqual(self.api.get('/api/studio/summary-by-class-type/?status=active').data, [])
+
+    def test_process_local_cache_is_not_used(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.slots()
+            with self.assertNumQueries(2):
+                self.slots()
+            self.assertFalse(availability_cache_stats()['enabled'])
+
+
+def legacy_clases_por_mes(year, month):
+    """Copia del cálculo anterior de clases_por_mes (un grupo de consultas por cliente)."""
+    first_day = datetime(year, month, 1).date()
+    if month == 12:
+        last_day = datetime(year + 1, 1, 1).date() - timedelta(days=1)
+    else:
+        last_day = datetime(year, month + 1, 1).date() - timedelta(days=1)
+
+    full_data = []
+    for client in Client.objects.filter(status="A"):
+        active_payment = Payment.objects.filter(
+            client=client,
+            valid_until__gte=first_day
+        ).order_by('-date_paid').first()
+
+        if not active_payment:
+            continue
+
+        clases_validas = Booking.objects.filter(
+            client=client,
+            class_date__range=[first_day, last_day],
+            attendance_status__in=['attended', 'cancelled']
+        ).count()
+        unjustified = Q(cancellation_reason__isnull=True) | Q(cancellation_reason__exact='')
+        no_shows = Booking.objects.filter(
+            client=client,
+            class_date__range=[first_day, last_day],
+            attendance_status='no_show',
+        ).filter(unjustified)
+
+        full_data.append({
+            'client_id': client.id,
+            'client_name': f"{client.first_name} {client.last_name}",
+            'membership': active_payment.membership.name,
+            'expected_classes': active_payment.membership.classes_per_month or 0,
+            'valid_classes': clases_validas,
+            'no_show_classes': no_shows.count(),
+            'date_no_show': sorted(set(no_shows.values_list('class_date', flat=True))),
+            'penalty': no_shows.count() * 35,
+        })
+    return full_data
+
+
+class ClasesPorMesTests(TestCase):
+    def setUp(self):
+        admin = CustomUser.objects.create(username='admin', is_staff=True)
+        self.api = APIClient()
+        self.api.force_authenticate(admin)
+
+        plan_8 = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        plan_libre = Membership.objects.create(name='Ilimitado', price=600, classes_per_month=None)
+        schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=10,
+                                           class_type=ClassType.objects.create(name='Reformer'))
+
+        statuses = ['attended', 'cancelled', 'no_show', 'pending']
+        for i in range(12):
+            client = Client.objects.create(first_name=f'Cliente{i}', last_name='Prueba', dpi=str(20_000 + i),
+                                           status='I' if i == 11 else 'A')
+            if i == 10:
+                continue  # sin pago: no aparece en el reporte
+            # Un pago viejo y uno más reciente con otro plan; gana el más reciente.
+            Payment.objects.create(client=client, membership=plan_libre, amount=600,
+                                   date_paid=timezone.make_aware(datetime(2025, 2, 1)), valid_until=date(2025, 3, 3))
+            if i % 2:
+                Payment.objects.create(client=client, membership=plan_8, amount=300,
+                                       date_paid=timezone.make_aware(datetime(2025, 3, 1)), valid_until=date(2025, 3, 31))
+            for j in range(i):
+                Booking.objects.create(
+                    client=client, schedule=schedule,
+                    class_date=date(2025, 3, 1 + (j * 3) % 31) if j != 4 else date(2025, 4, 2),
+                    attendance_status=statuses[(i + j) % 4],
+                    cancellation_reason='enfermedad' if j == 5 else None,
+                )
+
+    def test_matches_legacy_implementation(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/api/studio/clases-por-mes/', {'year': 2025, 'month': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 2)
+
+        expected = legacy_clases_por_mes(2025, 3)
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(
+            sorted(response.data, key=lambda row: row['client_id']),
+            sorted(expected, key=lambda row: row['client_id']),
+        )
+
+    def test_filters_and_pagination(self):
+        expected = legacy_clases_por_mes(2025, 3)
+
+        response = self.api.get('/api/studio/clases-por-mes/', {'year': 2025, 'month': 3, 'min_penalty': 70})
+        self.assertEqual([r['client_id'] for r in response.data],
+                         [r['client_id'] for r in expected if r['penalty'] >= 70])
+
+        response = self.api.get('/api/studio/clases-por-mes/', {'year': 2025, 'month': 3, 'membership': '8 clases'})
+        self.assertEqual([r['client_id'] for r in response.data],
+                         [r['client_id'] for r in expected if r['membership'] == '8 clases'])
+
+        response = self.api.get('/api/studio/clases-por-mes/', {'year': 2025, 'month': 3, 'page_size': 4, 'page': 3})
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(response.data['results'], expected[8:])
+
+
+class OccupancyHeatmapTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+
+    def heatmap(self, start, end):
+        return self.api.get(f'/api/studio/occupancy-heatmap/?start={start.isoformat()}&end={end.isoformat()}')
+
+    def test_grid_is_complete_and_zero_filled(self):
+        schedule = Schedule.objects.create(day='WED', time_slot='07:00', capacity=4)
+        Schedule.objects.create(day='WED', time_slot='07:00', capacity=6)
+        clients = [Client.objects.create(first_name=f'C{i}', last_name='Mapa', dpi=f'92{i:03d}') for i in range(3)]
+        wednesday = date(2025, 3, 5)
+        Booking.objects.create(client=clients[0], schedule=schedule, class_date=wednesday, attendance_status='attended')
+        Booking.objects.create(client=clients[1], schedule=schedule, class_date=wednesday)
+        Booking.objects.create(client=clients[2], schedule=schedule, class_date=wednesday, status='cancelled')
+
+        # Miércoles a martes: se extiende a dos semanas completas
+        response = self.heatmap(wednesday, date(2025, 3, 11))
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual((data['start'], data['end']), ('2025-03-03', '2025-03-16'))
+        self.assertEqual(data['weeks'], ['2025-03-03', '2025-03-10'])
+        self.assertEqual(len(data['cells']), len(DAYS) * len(TIME_SLOTS) * 2)
+        self.assertEqual(len(data['totals']), len(DAYS) * len(TIME_SLOTS))
+
+        cells = {(c['day'], c['time_slot'], c['week']): c for c in data['cells']}
+        self.assertEqual(cells[('WED', '07:00', '2025-03-03')], {
+            'day': 'WED', 'time_slot': '07:00', 'week': '2025-03-03', 'booked': 2, 'attended': 1,
+            'capacity': 10, 'fill_ratio': 0.2, 'attendance_ratio': 0.1,
+        })
+        self.assertEqual(cells[('WED', '07:00', '2025-03-10')]['booked'], 0)
+        self.assertEqual(cells[('WED', '07:00', '2025-03-10')]['fill_ratio'], 0.0)
+        # Sin horarios no hay capacidad: el ratio es null, no 0
+        empty = cells[('MON', '05:00', '2025-03-10')]
+        self.assertEqual((empty['booked'], empty['attended'], empty['capacity'], empty['fill_ratio']), (0, 0, 0, None))
+        self.assertEqual(sum(c['booked'] for c in data['cells']), 2)
+
+        totals = {(t['day'], t['time_slot']): t for t in data['totals']}
+        self.assertEqual((totals[('WED', '07:00')]['capacity'], totals[('WED', '07:00')]['fill_ratio']), (20, 0.1))
+
+    def test_range_is_capped(self):
+        start = date(2025, 1, 6)
+        self.assertEqual(self.heatmap(start, start + timedelta(weeks=MAX_HEATMAP_WEEKS, days=-1)).status_code, 200)
+        response = self.heatmap(start, start + timedelta(weeks=MAX_HEATMAP_WEEKS))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(MAX_HEATMAP_WEEKS), response.data['detail'])
+        self.assertEqual(self.heatmap(start, start - timedelta(days=1)).status_code, 400)
+
+
+class ImpossibleDateTests(TestCase):
+    """Fechas con formato válido pero inexistentes (parse_date lanza ValueError)."""
+    bad = '2024-02-30'
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=5)
+        client = Client.objects.create(first_name='Ana', last_name='Fecha', dpi='98000')
+        self.booking = Booking.objects.create(client=client, schedule=self.schedule, class_date=next_weekday(0))
+
+    def test_views_answer_400(self):
+        requests = {
+            'availability': ('get', '/api/studio/availability/', {'date': self.bad}),
+            'availability-range': ('get', '/api/studio/availability/', {'start': '2024-02-26', 'end': self.bad}),
+            'heatmap': ('get', '/api/studio/occupancy-heatmap/', {'start': self.bad}),
+            'summary': ('get', '/api/studio/summary-by-class-type/', {'end': self.bad}),
+            'cierres': ('get', '/api/studio/cierres-semanales/', {'start': self.bad}),
+            'bulk-dates': ('post', '/api/studio/bookings/bulk/',
+                           {'client_id': self.booking.client_id, 'schedule_id': self.schedule.id, 'dates': [self.bad]}),
+            'bulk-range': ('post', '/api/studio/bookings/bulk/',
+                           {'client_id': self.booking.client_id, 'schedule_id': self.schedule.id,
+                            'start': '2024-02-26', 'end': self.bad}),
+            'reschedule': ('put', f'/api/studio/bookings/{self.booking.id}/reschedule/',
+                           {'schedule_id': self.schedule.id, 'class_date': self.bad}),
+        }
+        for name, (method, path, data) in requests.items():
+            with self.subTest(name):
+                kwargs = {'format': 'json'} if method != 'get' else {}
+                response = getattr(self.api, method)(path, data, **kwargs)
+                self.assertEqual(response.status_code, 400)
+
+
+class RevenueEventTests(TestCase):
+    def setUp(self):
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Ingresos', dpi='93000',
+                                                email='ana.ingresos@example.com')
+
+    def local(self, year, month, day, hour=10):
+        return timezone.make_aware(datetime(year, month, day, hour))
+
+    def pay(self, amount, when):
+        return Payment.objects.create(client=self.client_obj, membership=self.plan, amount=amount, date_paid=when)
+
+    def events(self):
+        return list(RevenueEvent.objects.order_by('id').values_list(
+            'source', 'year', 'month', 'total_delta', 'payment_count_delta', 'venta_count_delta'))
+
+    def month(self, year, month):
+        return MonthlyRevenue.objects.filter(year=year, month=month).values(
+            'total_amount', 'payment_count', 'venta_total', 'venta_count').first()
+
+    def test_create_edit_move_and_delete_record_events(self):
+        payment = self.pay(300, self.local(2025, 1, 31, 23))
+        self.assertEqual(self.events(), [('payment', 2025, 1, 300, 1, 0)])
+        self.assertEqual(self.month(2025, 1), {'total_amount': 300, 'payment_count': 1, 'venta_total': 0, 'venta_count': 0})
+
+        # Guardar sin cambios de mes ni monto no agrega eventos
+        payment.payment_method = 'Efectivo'
+        payment.save()
+        self.assertEqual(len(self.events()), 1)
+
+        payment.amount = 250
+        payment.save()
+        self.assertEqual(self.events()[1:], [('payment', 2025, 1, -300, -1, 0), ('payment', 2025, 1, 250, 1, 0)])
+        self.assertEqual(self.month(2025, 1)['total_amount'], 250)
+
+        payment.date_paid = self.local(2025, 2, 1, 8)
+        payment.save()
+        self.assertEqual(self.month(2025, 1), {'total_amount': 0, 'payment_count': 0, 'venta_total': 0, 'venta_count': 0})
+        self.assertEqual(self.month(2025, 2), {'total_amount': 250, 'payment_count': 1, 'venta_total': 0, 'venta_count': 0})
+
+        venta = Venta.objects.create(client=self.client_obj, product_name='Agua', quantity=3, price_per_unit=10,
+                                     date_sold=self.local(2025, 2, 3))
+        self.assertEqual(self.month(2025, 2), {'total_amount': 280, 'payment_count': 1, 'venta_total': 30, 'venta_count': 1})
+
+        payment.delete()
+        venta.delete()
+        self.assertEqual(self.events()[-2:], [('payment', 2025, 2, -250, -1, 0), ('venta', 2025, 2, -30, 0, -1)])
+        self.assertEqual(self.month(2025, 2), {'total_amount': 0, 'payment_count': 0, 'venta_total': 0, 'venta_count': 0})
+        self.assertEqual(monthly_revenue_drift(), [])
+
+    def test_cascade_and_queryset_deletes_record_events(self):
+        self.pay(300, self.local(2025, 3, 2))
+        self.pay(200, self.local(2025, 4, 2))
+        Venta.objects.create(client=self.client_obj, product_name='Agua', quantity=1, price_per_unit=15,
+                             date_sold=self.local(2025, 3, 5))
+        other = Client.objects.create(first_name='Eva', last_name='Ingresos', dpi='93001')
+        Payment.objects.create(client=other, membership=self.plan, amount=100, date_paid=self.local(2025, 3, 9))
+
+        Payment.objects.filter(date_paid__month=4).delete()
+        self.client_obj.delete()
+
+        self.assertEqual(monthly_revenue_drift(), [])
+        self.assertEqual(self.month(2025, 3), {'total_amount': 100, 'payment_count': 1, 'venta_total': 0, 'venta_count': 0})
+        self.assertEqual(self.month(2025, 4)['payment_count'], 0)
+
+    def test_bulk_import_records_events(self):
+        Schedule.objects.create(day='MON', time_slot='07:00')
+        csv = (
+            "first_name,last_name,email,phone,class_date,time_slot,day,membership,payment_date,amount\n"
+            "Ana,Excel,ana@example.com,,2025-01-27,07:00,MON,8 clases,2025-01-31,300\n"
+            "Luis,Excel,luis@example.com,,2025-02-03,07:00,MON,8 clases,2025-02-01,280\n"
+        )
+        api = APIClient()
+        api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        response = api.post('/api/studio/bookings/import/', {
+            'file': SimpleUploadedFile('reservas.csv', csv.encode(), content_type='text/csv'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['errors'], [])
+
+        ids = set(Payment.objects.values_list('id', flat=True))
+        self.assertEqual(set(RevenueEvent.objects.values_list('source_id', flat=True)), ids)
+        self.assertEqual(self.month(2025, 1)['total_amount'], 300)
+        self.assertEqual(self.month(2025, 2)['total_amount'], 280)
+        self.assertEqual(monthly_revenue_drift(), [])
+
+    def test_drift_is_detected_and_reconciled(self):
+        self.pay(300, self.local(2025, 5, 2))
+        # Escrituras que no pasan por save(): sin eventos
+        Payment.objects.bulk_create([
+            Payment(client=self.client_obj, membership=self.plan, amount=120, date_paid=self.local(2025, 5, 20),
+                    valid_until=date(2025, 6, 19)),
+        ])
+        MonthlyRevenue.objects.filter(year=2025, month=5).update(venta_count=4)
+
+        drift = monthly_revenue_drift()
+        self.assertEqual([(row['year'], row['month']) for row in drift], [(2025, 5)])
+        self.assertEqual(drift[0]['expected']['total_amount'], 420)
+        self.assertEqual(drift[0]['events']['total_amount'], 300)
+        self.assertEqual(drift[0]['projection']['venta_count'], 4)
+
+        self.assertEqual(len(reconcile_monthly_revenue()), 1)  # solo reporta
+        self.assertFalse(RevenueEvent.objects.filter(source='adjustment').exists())
+
+        reconcile_monthly_revenue(fix=True)
+        self.assertEqual(monthly_revenue_drift(), [])
+        self.assertEqual(list(RevenueEvent.objects.filter(source='adjustment').values_list('total_delta', 'payment_count_delta')),
+                         [(120, 1)])
+        self.assertEqual(self.month(2025, 5), {'total_amount': 420, 'payment_count': 2, 'venta_total': 0, 'venta_count': 0})
+
+    def test_missing_history_is_not_clamped(self):
+        Payment.objects.bulk_create([
+            Payment(client=self.client_obj, membership=self.plan, amount=120, date_paid=self.local(2025, 6, 2),
+                    valid_until=date(2025, 7, 2)),
+        ])
+        Payment.objects.get().delete()
+        self.assertEqual(self.month(2025, 6), {'total_amount': -120, 'payment_count': -1, 'venta_total': 0, 'venta_count': 0})
+        self.assertEqual(len(monthly_revenue_drift()), 1)
+        reconcile_monthly_revenue(fix=True)
+        self.assertEqual(self.month(2025, 6)['payment_count'], 0)
+        self.assertEqual(monthly_revenue_drift(), [])
+
+
+class RecalculateMonthlyRevenueTests(TestCase):
+    def setUp(self):
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Recalculo', dpi='94000')
+
+    def add_months(self, first, count):
+        # Pagos creados sin save(): ni eventos ni proyección
+        Payment.objects.bulk_create([
+            Payment(client=self.client_obj, membership=self.plan, amount=100 + i,
+                    date_paid=timezone.make_aware(datetime(2020 + (first + i) // 12, (first + i) % 12 + 1, 15)),
+                    valid_until=date(2030, 1, 1))
+            for i in range(count)
+        ])
+
+    def test_query_count_does_not_depend_on_months(self):
+        self.add_months(0, 3)
+        with CaptureQueriesContext(connection) as few:
+            recalculate_all_monthly_revenue()
+        self.add_months(3, 30)
+        with CaptureQueriesContext(connection) as many:
+            results = recalculate_all_monthly_revenue()
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(results), 33)
+        self.assertEqual(monthly_revenue_drift(), [])
+
+    def test_recalculate_all_zeroes_stale_months_with_events(self):
+        self.add_months(0, 2)
+        MonthlyRevenue.objects.create(year=2019, month=6, total_amount=500, payment_count=2)
+
+        results = recalculate_all_monthly_revenue()
+        self.assertEqual([(r['year'], r['month'], r['total_amount']) for r in results],
+                         [(2020, 2, 101), (2020, 1, 100), (2019, 6, 0)])
+        self.assertEqual(MonthlyRevenue.objects.filter(year=2019, month=6).values_list('total_amount', 'payment_count').get(),
+                         (0, 0))
+        # Los pagos sin eventos quedan cubiertos con eventos de ajuste; el mes
+        # viejo no tenía eventos, solo se reescribe su proyección.
+        self.assertEqual(sorted(RevenueEvent.objects.filter(source='adjustment').values_list('year', 'month')),
+                         [(2020, 1), (2020, 2)])
+        self.assertEqual(monthly_revenue_drift(), [])
+
+    def test_recalculate_one_month_only_touches_that_month(self):
+        self.add_months(0, 2)
+        result = recalculate_monthly_revenue(2020, 1)
+        self.assertEqual((result['total'], result['from_payments'], result['payments_count']), (100, 100, 1))
+        self.assertEqual(list(RevenueEvent.objects.values_list('year', 'month', 'total_delta')), [(2020, 1, 100)])
+        self.assertEqual([(row['year'], row['month']) for row in monthly_revenue_drift()], [(2020, 2)])
+
+        empty = recalculate_monthly_revenue(2021, 7)
+        self.assertEqual((empty['total'], empty['payments_count']), (0, 0))
+
+
+def legacy_clients_with_consecutive_no_shows(limit=3):
+    """Copia del cálculo anterior (un par de consultas por cliente)."""
+    today = timezone.now().date()
+    result = []
+    for client in Client.objects.all():
+        recent = Booking.objects.filter(client=client, class_date__lt=today, status='active').order_by('-class_date')[:limit]
+        if recent.count() < limit:
+            continue
+        if all(b.attendance_status == 'no_show' for b in recent):
+            result.append(client)
+    return result
+
+
+class NoShowStreakTests(TestCase):
+    def setUp(self):
+        self.schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=9)
+        self.today = timezone.now().date()
+
+    def history(self, name, *entries):
+        """
+        Reservas en días consecutivos terminando ayer, de la más antigua a la más
+        reciente. Cada una es attendance_status o (attendance_status, status, motivo).
+        """
+        client = Client.objects.create(first_name=name, last_name='Racha', dpi=f'95{Client.objects.count():03d}')
+        for offset, entry in enumerate(reversed(entries), start=1):
+            entry = (entry,) if isinstance(entry, str) else entry
+            attendance, status, reason = entry + (None,) * (3 - len(entry))
+            Booking.objects.create(client=client, schedule=self.schedule, class_date=self.today - timedelta(days=offset),
+                                   attendance_status=attendance, status=status or 'active', cancellation_reason=reason)
+        return client
+
+    def test_streaks_count_trailing_no_shows(self):
+        justified = self.history('Justificada', 'attended', ('no_show', None, 'Enfermedad'), 'no_show')
+        reset = self.history('Reinicia', 'no_show', 'no_show', 'attended')
+        skipped = self.history('Cancelada', 'no_show', ('pending', 'cancelled'), 'no_show')
+        pending = self.history('Pendiente', 'no_show', 'pending')
+        Booking.objects.create(client=reset, schedule=self.schedule, class_date=self.today, attendance_status='no_show')
+
+        streaks = compute_no_show_streaks()
+        # Las inasistencias justificadas también cuentan, igual que antes;
+        # las reservas canceladas y las de hoy en adelante no cortan ni suman.
+        self.assertEqual(streaks[justified.id], 2)
+        self.assertEqual(streaks[skipped.id], 2)
+        self.assertNotIn(reset.id, streaks)
+        self.assertNotIn(pending.id, streaks)
+        self.assertEqual(compute_no_show_streaks([justified.id]), {justified.id: 2})
+
+    def test_rebuild_updates_and_resets_streaks(self):
+        client = self.history('Ana', 'no_show', 'no_show', 'no_show')
+        other = self.history('Luis', 'attended', 'no_show')
+        self.assertEqual(rebuild_no_show_streaks(), 2)
+        self.assertEqual(dict(Client.objects.values_list('id', 'no_show_streak')), {client.id: 3, other.id: 1})
+
+        latest = Booking.objects.filter(client=client).latest('class_date')
+        latest.attendance_status = 'attended'
+        latest.save()
+        rebuild_no_show_streaks([client.id])
+        self.assertEqual(dict(Client.objects.values_list('id', 'no_show_streak')), {client.id: 0, other.id: 1})
+
+    def test_booking_endpoints_keep_streaks_current(self):
+        api = APIClient()
+        ana = self.history('Ana', 'no_show', 'no_show', 'no_show')
+        luis = Client.objects.create(first_name='Luis', last_name='Racha', dpi='95999')
+        rebuild_no_show_streaks()
+        bookings = list(Booking.objects.filter(client=ana).order_by('-class_date'))
+
+        def streaks():
+            return dict(Client.objects.values_list('id', 'no_show_streak'))
+
+        # La asistencia solo se cambia en /attendance/; el PATCH genérico la ignora
+        response = api.patch(f'/api/studio/bookings/{bookings[0].id}/', {'attendance_status': 'attended'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get(pk=bookings[0].pk).attendance_status, 'no_show')
+        self.assertEqual(streaks(), {ana.id: 3, luis.id: 0})
+
+        # Una inasistencia que pasa al futuro deja de contar
+        response = api.patch(f'/api/studio/bookings/{bookings[0].id}/',
+                             {'class_date': (self.today + timedelta(days=7)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(streaks(), {ana.id: 2, luis.id: 0})
+
+        response = api.put(f'/api/studio/bookings/{bookings[1].id}/reschedule/',
+                           {'schedule_id': self.schedule.id, 'class_date': (self.today + timedelta(days=14)).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(streaks(), {ana.id: 1, luis.id: 0})
+
+        response = api.patch(f'/api/studio/bookings/{bookings[2].id}/', {'client_id': luis.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(streaks(), {ana.id: 0, luis.id: 1})
+
+        self.assertEqual(api.delete(f'/api/studio/bookings/{bookings[2].id}/').status_code, 204)
+        self.assertEqual(streaks(), {ana.id: 0, luis.id: 0})
+
+    def test_matches_legacy_selection(self):
+        self.history('A', 'no_show', 'no_show', 'no_show')
+        self.history('B', 'attended', 'no_show', 'no_show')
+        self.history('C', 'no_show', ('no_show', None, 'Viaje'))
+        self.history('D', 'no_show', 'attended')
+        self.history('E')
+        rebuild_no_show_streaks()
+        for limit in (1, 2, 3, 4):
+            with self.subTest(limit=limit):
+                self.assertEqual({c.id for c in get_clients_with_consecutive_no_shows(limit)},
+                                 {c.id for c in legacy_clients_with_consecutive_no_shows(limit)})
+
+
+def legacy_clientes_potenciales():
+    """Copia del listado anterior (dos consultas por cliente), con orden explícito."""
+    from accounts.serializers import ClientSerializer
+    from studio.serializers import PlanIntentSerializer
+
+    data = []
+    for trial_used in (False, True):
+        for client in Client.objects.filter(trial_used=trial_used).order_by('id'):
+            intent = PlanIntent.objects.filter(client=client, is_confirmed=False).order_by('-selected_at').first()
+            if intent or not trial_used:
+                data.append({
+                    "client": ClientSerializer(client).data,
+                    "plan_intent": PlanIntentSerializer(intent).data if intent else None,
+                })
+    return data
+
+
+def legacy_clientes_en_gracia(days=7):
+    """Copia del cálculo anterior: pagos vencidos en la ventana, un pago por cliente."""
+    today = timezone.now().date()
+    vistos = {}
+    for pago in Payment.objects.filter(valid_until__lt=today, valid_until__gte=today - timedelta(days=days)):
+        vistos.setdefault(pago.client_id, pago.valid_until)
+    return vistos
+
+
+class RetentionListTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.other_plan = Membership.objects.create(name='12 clases', price=400, classes_per_month=12)
+        self.today = timezone.now().date()
+
+    def make_client(self, name, **kwargs):
+        return Client.objects.create(first_name=name, last_name='Lista', dpi=f'96{Client.objects.count():03d}', **kwargs)
+
+    def test_potenciales_matches_legacy(self):
+        selected = timezone.now() - timedelta(days=3)
+        # Prueba pendiente, sin pagos ni intentos: aparece sin plan
+        self.make_client('SinPago')
+        # Prueba pendiente con dos intentos: se toma el más reciente
+        both = self.make_client('DosPlanes')
+        PlanIntent.objects.create(client=both, membership=self.plan, selected_at=selected)
+        PlanIntent.objects.create(client=both, membership=self.other_plan, selected_at=selected + timedelta(seconds=1))
+        # Prueba usada con intento pendiente: aparece
+        PlanIntent.objects.create(client=self.make_client('Pendiente', trial_used=True), membership=self.plan)
+        # Prueba usada con intento ya confirmado, o sin intento: no aparece
+        PlanIntent.objects.create(client=self.make_client('Confirmado', trial_used=True), membership=self.plan,
+                                  is_confirmed=True)
+        paid = self.make_client('Pagado', trial_used=True)
+        Payment.objects.create(client=paid, membership=self.plan, amount=300)
+
+        response = self.api.get('/api/studio/planintents/potenciales/', {'page_size': 200})
+        self.assertEqual(response.status_code, 200)
+        expected = legacy_clientes_potenciales()
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['results'], expected)
+        self.assertEqual(expected[1]['plan_intent']['membership']['id'], self.other_plan.id)
+
+    def test_en_gracia_matches_legacy_at_window_edges(self):
+        def pay(client, valid_until, **kwargs):
+            Payment.objects.create(client=client, membership=self.plan, amount=300, valid_until=valid_until,
+                                   date_paid=timezone.make_aware(datetime.combine(valid_until - timedelta(days=30),
+                                                                                  datetime.min.time())), **kwargs)
+
+        edges = {
+            'Ayer': 1,      # recién vencido: dentro
+            'Limite': 7,    # primer día de la ventana: dentro
+            'Fuera': 8,     # un día antes de la ventana: fuera
+            'Hoy': 0,       # vence hoy, todavía vigente: fuera
+        }
+        clients = {name: self.make_client(name) for name in edges}
+        for name, days_ago in edges.items():
+            pay(clients[name], self.today - timedelta(days=days_ago))
+        # Dos pagos vencidos en la ventana: una sola fila, la del último pago
+        twice = self.make_client('DosPagos')
+        pay(twice, self.today - timedelta(days=6))
+        pay(twice, self.today - timedelta(days=2))
+
+        response = self.api.get('/api/studio/payments/en-gracia/')
+        self.assertEqual(response.status_code, 200)
+        rows = {row['client']['id']: row['valid_until'] for row in response.data}
+        legacy = legacy_clientes_en_gracia()
+        self.assertEqual(set(rows), set(legacy))
+        self.assertEqual(set(rows), {clients['Ayer'].id, clients['Limite'].id, twice.id})
+        self.assertEqual(rows[twice.id], self.today - timedelta(days=2))
+        self.assertEqual([row['valid_until'] for row in response.data], sorted(rows.values()))
+
+        limite = next(row for row in response.data if row['client']['id'] == clients['Limite'].id)
+        self.assertEqual(limite['grace_ends'], self.today)
+
+        # Diferencia intencional con el cálculo anterior: quien ya renovó no aparece
+        pay(clients['Ayer'], self.today + timedelta(days=29))
+        rows = {row['client']['id'] for row in self.api.get('/api/studio/payments/en-gracia/').data}
+        self.assertEqual(rows, {clients['Limite'].id, twice.id})
+        self.assertIn(clients['Ayer'].id, legacy_clientes_en_gracia())
+
+        # ?days= mueve el borde de la ventana
+        rows = {row['client']['id'] for row in self.api.get('/api/studio/payments/en-gracia/', {'days': 8}).data}
+        self.assertIn(clients['Fuera'].id, rows)
+
+
+def legacy_summary_by_class_type():
+    """Copia del resumen por tipo de clase anterior (recorría todas las reservas)."""
+    counter = Counter()
+    for b in Booking.objects.select_related("schedule__class_type").all():
+        if b.schedule and b.schedule.class_type:
+            counter[b.schedule.class_type.name] += 1
+    return [{"class_type": k, "count": v} for k, v in counter.items()]
+
+
+class SummaryByClassTypeTests(TestCase):
+    def test_matches_legacy_counts_and_monthly_breakdown(self):
+        reformer = ClassType.objects.create(name='Reformer')
+        mat = ClassType.objects.create(name='Mat')
+        schedules = [
+            Schedule.objects.create(day='MON', time_slot='07:00', class_type=reformer),
+            Schedule.objects.create(day='MON', time_slot='08:00', class_type=mat),
+            Schedule.objects.create(day='MON', time_slot='09:00'),  # sin tipo: no cuenta
+        ]
+        clients = [Client.objects.create(first_name=f'C{i}', last_name='Tipo', dpi=f'91{i:03d}') for i in range(4)]
+        start = date(2025, 1, 27)
+        for week in range(6):
+            for i, client in enumerate(clients):
+                Booking.objects.create(client=client, schedule=schedules[(week + i) % 3],
+                                       class_date=start + timedelta(weeks=week),
+                                       status='cancelled' if week == i else 'active')
+
+        api = APIClient()
+        api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        data = api.get('/api/studio/summary-by-class-type/').data
+        self.assertEqual(sorted((d['class_type'], d['count']) for d in data),
+                         sorted((d['class_type'], d['count']) for d in legacy_summary_by_class_type()))
+        self.assertEqual([d['count'] for d in data], sorted((d['count'] for d in data), reverse=True))
+
+        for item in data:
+            expected = Counter(
+                b.class_date.strftime('%Y-%m')
+                for b in Booking.objects.filter(schedule__class_type__name=item['class_type'])
+            )
+            self.assertEqual({m['month']: m['count'] for m in item['by_month']}, dict(expected))
+            self.assertEqual(sum(expected.values()), item['count'])
+
+
+def legacy_weekly_closing_summary():
+    """Copia del resumen semanal anterior (varias consultas por día con pagos)."""
+    data_por_dia = []
+    for day in Payment.objects.dates('date_paid', 'day'):
+        pagos = Payment.objects.filter(date_paid__date=day)
+        ventas = Venta.objects.filter(date_sold__date=day)
+        bookings = Booking.objects.filter(class_date=day)
+
+        total_pago = sum(p.amount for p in pagos)
+        total_venta = sum(v.total_amount for v in ventas)
+        tarjeta = pagos.filter(payment_method='Tarjeta').aggregate(Sum('amount'))['amount__sum'] or 0
+        efectivo = pagos.filter(payment_method='Efectivo').aggregate(Sum('amount'))['amount__sum'] or 0
+        visalink = pagos.filter(payment_method='Visalink').aggregate(Sum('amount'))['amount__sum'] or 0
+        paquetes = pagos.count()
+        asistencias = bookings.count()
+
+        data_por_dia.append({
+            "fecha": day.isoformat(),
+            "total": round(total_pago + total_venta, 2),
+            "asistencias": asistencias,
+            "paquetes_vendidos": paquetes,
+            "clases_individuales": bookings.filter(schedule__is_individual=True).count(),
+            "pruebas": bookings.filter(client__trial_used=True).count(),
+            "tarjeta": float(tarjeta),
+            "efectivo": float(efectivo),
+            "visalink": float(visalink),
+            "porcentaje_compra": round((paquetes / asistencias * 100), 2) if asistencias else 0,
+        })
+
+    semanas = {}
+    for dia in data_por_dia:
+        fecha = datetime.fromisoformat(dia["fecha"])
+        semanas.setdefault((fecha.isocalendar().year, fecha.isocalendar().week), []).append(dia)
+
+    response = []
+    for (año, semana), dias in semanas.items():
+        fecha_inicio = min(datetime.fromisoformat(d["fecha"]) for d in dias)
+        fecha_fin = max(datetime.fromisoformat(d["fecha"]) for d in dias)
+        response.append({
+            "semana": semana,
+            "año": año,
+            "rango": f"{fecha_inicio.strftime('%d/%m/%Y')} - {fecha_fin.strftime('%d/%m/%Y')}",
+            "total_semana": round(sum(d["total"] for d in dias), 2),
+            "total_asistencias": sum(d["asistencias"] for d in dias),
+            "total_paquetes": sum(d["paquetes_vendidos"] for d in dias),
+            "total_clases_ind": sum(d["clases_individuales"] for d in dias),
+            "total_pruebas": sum(d["pruebas"] for d in dias),
+            "total_tarjeta": round(sum(d["tarjeta"] for d in dias), 2),
+            "total_efectivo": round(sum(d["efectivo"] for d in dias), 2),
+            "total_visalink": round(sum(d["visalink"] for d in dias), 2),
+            "dias": dias,
+        })
+    return sorted(response, key=lambda s: (s["año"], s["semana"]))
+
+
+class DailyClosingTests(TestCase):
+    def setUp(self):
+        self.plan = Membership.objects.create(name='8 clases', price=300, classes_per_month=8)
+        self.client_obj = Client.objects.create(first_name='Ana', last_name='Cierre', dpi='90000', trial_used=True)
+
+    def local(self, day, hour=10, minute=0):
+        return timezone.make_aware(datetime.combine(day, datetime.min.time()).replace(hour=hour, minute=minute))
+
+    def closing(self, day):
+        return DailyClosing.objects.filter(date=day).values('payment_total', 'payment_count', 'venta_total').first()
+
+    def test_payment_and_venta_writes_refresh_their_days(self):
+        day1, day2, day3 = date(2025, 3, 3), date(2025, 3, 4), date(2025, 3, 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payment.objects.create(client=self.client_obj, membership=self.plan, amount=300,
+                                             date_paid=self.local(day1, 23, 30))
+        self.assertEqual(self.closing(day1), {'payment_total': 300, 'payment_count': 1, 'venta_total': 0})
+
+        # Mover el pago de día borra el cierre que se queda sin pagos
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.date_paid = self.local(day2)
+            payment.amount = 250
+            payment.save()
+        self.assertIsNone(self.closing(day1))
+        self.assertEqual(self.closing(day2), {'payment_total': 250, 'payment_count': 1, 'venta_total': 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            venta = Venta.objects.create(client=self.client_obj, product_name='Calcetas', quantity=2,
+                                         price_per_unit=40, date_sold=self.local(day2))
+        self.assertEqual(self.closing(day2)['venta_total'], 80)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            venta.date_sold = self.local(day3)
+            venta.save()
+        self.assertEqual(self.closing(day2)['venta_total'], 0)
+        self.assertIsNone(self.closing(day3))  # solo hay cierres de días con pagos
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.delete()
+        self.assertFalse(DailyClosing.objects.exists())
+
+    def test_booking_writes_refresh_attendance(self):
+        day, other_day = next_weekday(0), next_weekday(0, 2)
+        schedule = Schedule.objects.create(day='MON', time_slot='07:00', capacity=9)
+        Payment.objects.create(client=self.client_obj, membership=self.plan, amount=300, date_paid=self.local(day))
+        Payment.objects.create(client=self.client_obj, membership=self.plan, amount=300, date_paid=self.local(other_day))
+        rebuild_daily_closings()
+        api = APIClient()
+
+        def attendance():
+            return dict(DailyClosing.objects.values_list('date', 'attendance'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = api.post('/api/studio/bookings/', {
+                'client_id': self.client_obj.id, 'schedule_id': schedule.id, 'class_date': day.isoformat(),
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(attendance(), {day: 1, other_day: 0})
+
+        booking = Booking.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            api.patch(f'/api/studio/bookings/{booking.id}/', {'class_date': other_day.isoformat()})
+        self.assertEqual(attendance(), {day: 0, other_day: 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api.put(f'/api/studio/bookings/{booking.id}/reschedule/',
+                    {'schedule_id': schedule.id, 'class_date': day.isoformat()})
+        self.assertEqual(attendance(), {day: 1, other_day: 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api.delete(f'/api/studio/bookings/{booking.id}/')
+        self.assertEqual(attendance(), {day: 0, other_day: 0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            api.post('/api/studio/bookings/bulk/', {
+                'client_id': self.client_obj.id, 'schedule_id': schedule.id,
+                'dates': [day.isoformat(), other_day.isoformat()],
+            }, format='json')
+        self.assertEqual(attendance(), {day: 1, other_day: 1})
+
+    def test_weekly_summary_fills_an_empty_table(self):
+        Payment.objects.create(client=self.client_obj, membership=self.plan, amount=300,
+                               date_paid=self.local(date(2025, 3, 3)))
+        DailyClosing.objects.all().delete()
+
+        api = APIClient()
+        api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        response = api.get('/api/studio/cierres-semanales/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, legacy_weekly_closing_summary())
+        self.assertEqual(self.closing(date(2025, 3, 3))['payment_total'], 300)
+
+    def test_weekly_summary_matches_legacy_aggregation(self):
+        individual = Schedule.objects.create(day='MON', time_slot='07:00', is_individual=True)
+        group = Schedule.objects.create(day='MON', time_slot='08:00', capacity=9)
+        trial = Client.objects.create(first_name='Luis', last_name='Prueba', dpi='90001', trial_used=True)
+        new = Client.objects.create(first_name='Eva', last_name='Nueva', dpi='90002')
+        methods = ['Tarjeta', 'Efectivo', 'Visalink', None]
+        start = date(2025, 2, 24)
+        for i in range(24):
+            day = start + timedelta(days=(i * 3) // 2)
+            Payment.objects.create(client=self.client_obj, membership=self.plan, amount=100 + i,
+                                   payment_method=methods[i % 4], date_paid=self.local(day, 8 + i % 16, 45))
+            Venta.objects.create(client=trial, product_name='Agua', quantity=1 + i % 3, price_per_unit=10,
+                                 date_sold=self.local(day + timedelta(days=i % 2), 22, 30))
+            for client in (trial, new):
+                Booking.objects.get_or_create(client=client, schedule=individual if i % 3 == 0 else group,
+                                              class_date=day)
+        rebuild_daily_closings()
+
+        api = APIClient()
+        api.force_authenticate(CustomUser.objects.create(username='admin', is_staff=True))
+        response = api.get('/api/studio/cierres-semanales/')
+        self.assertEqual(response.status_code, 200)
+        expected = legacy_weekly_closing_summary()
+        self.assertEqual(len(expected), 5)
+        self.assertEqual(response.data, expected)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'EXPLAIN solo se interpreta en PostgreSQL y SQLite')
+class QueryPlanTests(TestCase):
+    """
+    Las consultas más usadas no deben recorrer completas sus tablas.
+
+    En PostgreSQL se desactiva ``enable_seqscan`` para que el planificador solo
+    elija un Seq Scan cuando no existe un índice aplicable, sin depender del
+    tamaño de los datos de prueba. En SQLite, ``SCAN <tabla>`` en el
+    EXPLAIN QUERY PLAN indica el mismo recorrido completo.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        memberships = Membership.objects.bulk_create([
+            Membership(name=f'Plan {n}', price=100 * n, classes_per_month=4 * n) for n in range(1, 4)
+        ])
+        class_type = ClassType.objects.create(name='Reformer')
+        schedules = Schedule.objects.bulk_create([
+            Schedule(day=day, time_slot=slot, capacity=10, class_type=class_type)
+            for day in ('MON', 'WED', 'FRI') for slot in ('07:00', '08:00', '18:00')
+        ])
+        clients = Client.objects.bulk_create([
+            Client(first_name=f'Cliente{i}', last_name='Plan', dpi=str(30_000 + i)) for i in range(150)
+        ])
+        start = date(2025, 1, 6)
+        statuses = ['active', 'active', 'active', 'cancelled']
+        Booking.objects.bulk_create([
+            Booking(client=client, schedule=schedules[(i + week) % len(schedules)],
+                    class_date=start + timedelta(weeks=week, days=2 * (i % 3)),
+                    status=statuses[(i + week) % 4])
+            for i, client in enumerate(clients) for week in range(20)
+        ])
+        Payment.objects.bulk_create([
+            Payment(client=client, membership=memberships[i % 3], amount=300,
+                    date_paid=timezone.make_aware(datetime(2025, 1, 1) + timedelta(days=30 * n + i % 28)),
+                    valid_until=date(2025, 1, 31) + timedelta(days=30 * n + i % 28))
+            for i, client in enumerate(clients) for n in range(6)
+        ])
+        Venta.objects.bulk_create([
+            Venta(client=client, product_name='Calcetas', price_per_unit=50, total_amount=50 * (n + 1),
+                  quantity=n + 1, date_sold=timezone.make_aware(datetime(2025, 1, 1) + timedelta(days=n * 11 + i % 7)))
+            for i, client in enumerate(clients) for n in range(10)
+        ])
+        PlanIntent.objects.bulk_create([
+            PlanIntent(client=client, membership=membership, is_confirmed=bool((i + n) % 2),
+                       selected_at=timezone.make_aware(datetime(2025, 1, 1) + timedelta(days=i + n)))
+            for i, client in enumerate(clients) for n, membership in enumerate(memberships)
+        ])
+        sync_search_tokens(clients)
+        cls.client_ids = [c.id for c in clients[:20]]
+        cls.schedule = schedules[0]
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            full_scan = re.search(rf'Seq Scan on {table}\b', plan)
+        else:
+            full_scan = re.search(rf'\bSCAN {table}\b', plan)
+        self.assertIsNone(full_scan, f'Recorrido completo de {table}:\n{plan}')
+
+    def test_booking_queries(self):
+        first, last = date(2025, 3, 1), date(2025, 3, 31)
+        # Disponibilidad de la semana
+        self.assertUsesIndex(
+            Booking.objects.filter(class_date__range=[first, first + timedelta(days=6)], status__in=SEAT_HOLDING_STATUSES)
+            .values('schedule_id', 'class_date').annotate(n=Count('id')),
+            'studio_booking',
+        )
+        # Cupo de un horario en una fecha
+        self.assertUsesIndex(
+            Booking.objects.filter(schedule=self.schedule, class_date=date(2025, 3, 3), status='active'),
+            'studio_booking',
+        )
+        # Clases del mes de un cliente
+        self.assertUsesIndex(
+            Booking.objects.filter(client_id=self.client_ids[0], class_date__range=[first, last]),
+            'studio_booking',
+        )
+        # Mapa de ocupación y cierre diario
+        self.assertUsesIndex(Booking.objects.filter(class_date__range=[first, last]), 'studio_booking')
+
+    def test_payment_queries(self):
+        # Último pago de un cliente
+        self.assertUsesIndex(
+            Payment.objects.filter(client_id=self.client_ids[0]).order_by('-date_paid')[:1], 'studio_payment',
+        )
+        # Recordatorios y periodo de gracia
+        self.assertUsesIndex(Payment.objects.filter(valid_until=date(2025, 3, 2)), 'studio_payment')
+        self.assertUsesIndex(
+            Payment.objects.filter(valid_until__lt=date(2025, 3, 2), valid_until__gte=date(2025, 2, 23)),
+            'studio_payment',
+        )
+        # Ingresos del mes
+        self.assertUsesIndex(Payment.objects.filter(date_paid__year=2025, date_paid__month=3), 'studio_payment')
+
+    def test_venta_queries(self):
+        self.assertUsesIndex(Venta.objects.filter(date_sold__year=2025, date_sold__month=3), 'studio_venta')
+        self.assertUsesIndex(
+            Venta.objects.filter(date_sold__gte=timezone.make_aware(datetime(2025, 3, 1)),
+                                 date_sold__lt=timezone.make_aware(datetime(2025, 3, 8))),
+            'studio_venta',
+        )
+
+    def test_client_search_queries(self):
+        # Cada palabra se busca por prefijo en ClientSearchToken, no con LIKE '%x%'.
+        # La subconsulta lleva alias (U0), así que se busca el nombre del índice.
+        for query in ('clien', 'cliente12 plan', '3000'):
+            with self.subTest(query=query):
+                self.assertIn('client_search_token_idx', search_clients(query).explain())
+                self.assertUsesIndex(search_clients(query), 'accounts_client')
+        self.assertEqual(search_clients('cliente12 plan').count(), 11)
+
+    def test_pending_plan_intent_queries(self):
+        self.assertUsesIndex(
+            PlanIntent.objects.filter(client_id__in=self.client_ids, is_confirmed=False)
+            .order_by('client_id', '-selected_at', '-id'),
+            'studio_planintent',
+        )
+        self.assertUsesIndex(
+            PlanIntent.objects.filter(client_id=self.client_ids[0], is_confirmed=False).order_by('-selected_at')[:1],
+            'studio_planintent',
+        )
+
+
+class EndpointQueryBudgetMixin:
+    """
+    Llama cada endpoint con un conjunto de datos generado (studio.datagen) y
+    luego con uno cuatro veces más grande: el número de consultas no puede
+    superar el presupuesto declarado ni cambiar al crecer los datos (cualquier
+    consulta por fila hace fallar la prueba).
+
+    Cada subclase declara ``endpoints``: (nombre, método, ruta, datos, máximo).
+    Las rutas y los parámetros pueden usar {client}, {client_ids}, {booking},
+    {payment}, {intent}, {schedule}, {coach}, {membership}, {instance}, {user} y {dpi}.
+    Para las escrituras hay además un cliente nuevo con plan ilimitado vigente
+    ({member}, {member_payment}, {unlimited}), un horario grupal ({group_schedule}) con fechas
+    futuras libres ({class_date}, {next_class_date}, {later_class_date}) y {now}.
+    Se llaman en orden: los borrados van al final de la lista.
+    """
+    endpoints = []
+    small_clients = 20
+    large_clients = 80
+
+    def setUp(self):
+        self.write_round = 0
+        self.admin = CustomUser.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def _write_targets(self):
+        # Cliente sin historial: el límite mensual y las reservas generadas no
+        # hacen fallar las escrituras, y el plan ilimitado evita el tope de clases.
+        unlimited = Membership.objects.filter(classes_per_month__isnull=True).order_by('id').first()
+        member = Client.objects.create(first_name='Presupuesto', last_name='Escrituras', trial_used=True)
+        payment = Payment.objects.create(client=member, membership=unlimited, amount=unlimited.price,
+                                         date_paid=timezone.now())
+        group = Schedule.objects.filter(is_individual=False).order_by('id').first()
+        weekday = [code for code, _ in Schedule.DAY_CHOICES].index(group.day)
+        # Fechas distintas en cada medición: todas siembran su fila del ledger
+        self.write_round += 1
+        first = next_weekday(weekday, weeks=3 * self.write_round)
+        return {
+            'member': member.id,
+            'member_payment': payment.id,
+            'unlimited': unlimited.id,
+            'group_schedule': group.id,
+            'class_date': first.isoformat(),
+            'next_class_date': (first + timedelta(weeks=1)).isoformat(),
+            'later_class_date': (first + timedelta(weeks=2)).isoformat(),
+            'now': timezone.now().isoformat(),
+        }
+
+    def _targets(self):
+        client = Client.objects.filter(payment__isnull=False, booking__isnull=False).order_by('id').first()
+        return {
+            **self._write_targets(),
+            'client': client.id,
+            'dpi': client.dpi,
+            'client_ids': ','.join(str(pk) for pk in Client.objects.values_list('id', flat=True)),
+            'booking': Booking.objects.filter(client=client).order_by('id').first().id,
+            'payment': Payment.objects.filter(client=client).order_by('id').first().id,
+            'intent': PlanIntent.objects.order_by('id').first().id,
+            'schedule': Schedule.objects.order_by('id').first().id,
+            'coach': Schedule.objects.filter(coach__isnull=False).order_by('id').first().coach_id,
+            'membership': Membership.objects.order_by('id').first().id,
+            'instance': PromotionInstance.objects.order_by('id').first().id,
+            'user': self.admin.id,
+        }
+
+    def _measure(self):
+        targets = self._targets()
+        counts = {}
+        def fill(value):
+            if isinstance(value, list):
+                return [fill(v) for v in value]
+            return value.format(**targets) if isinstance(value, str) else value
+
+        for name, method, path, data, _ in self.endpoints:
+            data = {k: fill(v) for k, v in data.items()}
+            kwargs = {'format': 'json'} if method != 'get' else {}
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.api, method)(path.format(**targets), data, **kwargs)
+            self.assertLess(response.status_code, 400, f'{name}: {response.status_code} {getattr(response, "data", "")}')
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_counts_do_not_grow_with_data(self):
+        generate_studio_data(clients=self.small_clients, months=3, seed=1)
+        small = self._measure()
+        generate_studio_data(clients=self.large_clients, months=3, seed=1)
+        large = self._measure()
+
+        for name, _, _, _, budget in self.endpoints:
+            with self.subTest(endpoint=name):
+                self.assertLessEqual(small[name], budget)
+                self.assertEqual(large[name], small[name], 'el número de consultas crece con los datos')
+
+
+class StudioEndpointQueryBudgetTests(EndpointQueryBudgetMixin, TestCase):
+    endpoints = [
+        ('bookings-list', 'get', '/api/studio/bookings/', {}, 1),
+        ('bookings-detail', 'get', '/api/studio/bookings/{booking}/', {}, 1),
+        ('bookings-by-client', 'get', '/api/studio/bookings/by-client/{client}/', {}, 1),
+        ('bookings-historial', 'get', '/api/studio/bookings/historial/', {}, 1),
+        # limit=1 para que la respuesta no quede vacía con los datos generados
+        ('bookings-clientes-en-riesgo', 'get', '/api/studio/bookings/clientes-en-riesgo/', {'limit': 1}, 1),
+        ('planintents-list', 'get', '/api/studio/planintents/', {}, 1),
+        ('planintents-detail', 'get', '/api/studio/planintents/{intent}/', {}, 1),
+        ('planintents-by-client', 'get', '/api/studio/planintents/by-client/{client}/', {}, 1),
+        ('planintents-potenciales', 'get', '/api/studio/planintents/potenciales/', {}, 3),
+        ('memberships-list', 'get', '/api/studio/memberships/', {}, 1),
+        ('memberships-detail', 'get', '/api/studio/memberships/{membership}/', {}, 1),
+        ('payments-list', 'get', '/api/studio/payments/', {}, 1),
+        ('payments-detail', 'get', '/api/studio/payments/{payment}/', {}, 1),
+        ('payments-en-gracia', 'get', '/api/studio/payments/en-gracia/', {}, 1),
+        ('schedules-list', 'get', '/api/studio/schedules/', {}, 1),
+        ('schedules-detail', 'get', '/api/studio/schedules/{schedule}/', {}, 1),
+        ('schedules-today', 'get', '/api/studio/schedules/today/', {'coach_id': '{coach}'}, 2),
+        ('monthly-revenue-list', 'get', '/api/studio/monthly-revenue/', {}, 1),
+        ('monthly-revenue-total', 'get', '/api/studio/monthly-revenue/total/', {}, 1),
+        ('promotions-list', 'get', '/api/studio/promotions/', {}, 1),
+        ('promotion-instances-list', 'get', '/api/studio/promotion-instances/', {}, 2),
+        ('promotion-instances-detail', 'get', '/api/studio/promotion-instances/{instance}/', {}, 2),
+        ('ventas-list', 'get', '/api/studio/ventas/', {}, 1),
+        ('availability-day', 'get', '/api/studio/availability/', {'date': '2025-03-03'}, 2),
+        ('availability-range', 'get', '/api/studio/availability/', {'start': '2025-03-03', 'end': '2025-03-16'}, 2),
+        ('availability-cache-stats', 'get', '/api/studio/availability/cache-stats/', {}, 0),
+        ('summary-by-class-type', 'get', '/api/studio/summary-by-class-type/', {}, 1),
+        ('attendance-summary', 'get', '/api/studio/attendance-summary/', {}, 1),
+        ('occupancy-heatmap', 'get', '/api/studio/occupancy-heatmap/', {}, 2),
+        ('clases-por-mes', 'get', '/api/studio/clases-por-mes/', {}, 2),
+        ('payments-today', 'get', '/api/studio/today/', {}, 1),
+        ('cierres-semanales', 'get', '/api/studio/cierres-semanales/', {}, 1),
+        ('performance-metrics', 'get', '/api/studio/metrics/', {}, 0),
+        # Escrituras. La reserva siembra su fila del ledger y del uso mensual
+        # (get_or_create con SAVEPOINT): es el camino más caro.
+        ('bookings-create', 'post', '/api/studio/bookings/',
+         {'client_id': '{member}', 'schedule_id': '{group_schedule}', 'class_date': '{class_date}'}, 31),
+        ('bookings-bulk', 'post', '/api/studio/bookings/bulk/',
+         {'client_id': '{member}', 'schedule_id': '{group_schedule}',
+          'dates': ['{next_class_date}', '{later_class_date}']}, 14),
+        ('payments-create', 'post', '/api/studio/payments/',
+         {'client_id': '{member}', 'membership_id': '{unlimited}', 'amount': '800', 'date_paid': '{now}',
+          'payment_method': 'Tarjeta'}, 12),
+        ('ventas-create', 'post', '/api/studio/ventas/',
+         {'client_id': '{member}', 'product_name': 'Agua', 'quantity': 2, 'price_per_unit': '10',
+          'total_amount': '20', 'payment_method': 'Efectivo', 'date_sold': '{now}'}, 6),
+        ('payments-delete', 'delete', '/api/studio/payments/{member_payment}/', {}, 7),
+    ]
+
+
+class GenerateStudioDataTests(TestCase):
+    def _snapshot(self):
+        return (
+            list(Booking.objects.order_by('client__dpi', 'class_date', 'schedule__time_slot')
+                 .values_list('client__dpi', 'class_date', 'schedule__time_slot', 'status', 'attendance_status')),
+            list(Payment.objects.order_by('client__dpi', 'date_paid')
+                 .values_list('client__dpi', 'date_paid', 'amount', 'payment_method', 'promotion__name')),
+        )
+
+    def test_same_seed_generates_same_data(self):
+        end = date(2025, 6, 30)
+        counts = generate_studio_data(clients=60, months=3, seed=7, end=end)
+        first = self._snapshot()
+        self.assertEqual(generate_studio_data(clients=60, months=3, seed=7, end=end), counts)
+        self.assertEqual(self._snapshot(), first)
+
+        generate_studio_data(clients=60, months=3, seed=8, end=end)
+        self.assertNotEqual(self._snapshot(), first)
+
+    def test_generated_data_is_consistent(self):
+        real = Client.objects.create(first_name='Cliente', last_name='Real', dpi='123')
+        counts = generate_studio_data(clients=80, months=3, seed=3, end=date(2025, 6, 30))
+
+        self.assertEqual(generated_clients().count(), 80)
+        self.assertEqual(Booking.objects.count(), counts['bookings'])
+        statuses = set(Booking.objects.values_list('status', 'attendance_status'))
+        self.assertTrue({('active', 'attended'), ('active', 'no_show'), ('cancelled', 'pending')} <= statuses)
+        self.assertTrue(Payment.objects.filter(promotion__isnull=False).exists())
+        self.assertTrue(PlanIntent.objects.filter(is_confirmed=False).exists())
+
+        # Tablas derivadas al día
+        self.assertFalse(ClassSeatLedger.objects.filter(booked__gt=F('schedule__capacity')).exists())
+        self.assertEqual(monthly_revenue_drift(), [])
+        self.assertFalse(generated_clients().filter(latest_payment__isnull=True, payment__isnull=False).exists())
+
+        self.assertTrue(set(generated_clients().values_list('source', flat=True)) <= set(SOURCES))
+
+        # Volver a generar reemplaza los datos generados, no los reales
+        generate_studio_data(clients=10, months=1, seed=3, end=date(2025, 6, 30))
+        self.assertEqual(generated_clients().count(), 10)
+        self.assertTrue(Client.objects.filter(pk=real.pk).exists())
+        self.assertEqual(monthly_revenue_drift(), [])
+
+    def test_delete_skips_per_row_signals_and_rebuilds_once(self):
+        real = Client.objects.create(first_name='Cliente', last_name='Real', dpi='123')
+        schedule = Schedule.objects.create(day='MON', time_slot='06:00', capacity=5)
+        Booking.objects.create(client=real, schedule=schedule, class_date=date(2025, 6, 2))
+        Payment.objects.create(client=real, membership=Membership.objects.create(name='Real', price=100),
+                               amount=100, date_paid=timezone.make_aware(datetime(2025, 6, 2, 10)))
+        generate_studio_data(clients=80, months=3, seed=3, end=date(2025, 6, 30))
+
+        with CaptureQueriesContext(connection) as queries:
+            deleted = delete_generated_data()
+        self.assertGreater(deleted, 80)
+        self.assertLess(len(queries), 80)
+
+        self.assertFalse(generated_clients().exists())
+        self.assertEqual(list(Booking.objects.values_list('client', flat=True)), [real.id])
+        self.assertEqual(list(ClassSeatLedger.objects.filter(booked__gt=0).values_list('booked', flat=True)), [1])
+        self.assertEqual(monthly_revenue_drift(), [])
+        self.assertEqual(list(DailyClosing.objects.values_list('date', flat=True)), [date(2025, 6, 2)])
+
+
+class BenchmarkEndpointsTests(TestCase):
+    def test_compare_reports_flags_regressions(self):
+        baseline = {"scenarios": {"clients-list": {
+            "p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "throughput_rps": 100, "queries_max": 2,
+        }}}
+        current = {"scenarios": {"clients-list": {
+            "p50_ms": 11, "p95_ms": 30, "p99_ms": 31, "throughput_rps": 70, "queries_max": 3,
+        }}}
+        found = {metric for _, metric, _ in regressions(compare_reports(current, baseline, threshold=20))}
+        self.assertEqual(found, {"p95_ms", "throughput_rps", "queries_max"})
+
+    def test_command_writes_report_and_undoes_bookings(self):
+        generate_studio_data(clients=40, months=2, seed=5)
+        bookings = Booking.objects.count()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output, baseline = Path(tmp, 'report.json'), Path(tmp, 'baseline.json')
+            call_command('benchmark_endpoints', requests=4, concurrency=1, warmup=1, output=str(output),
+                         baseline=str(baseline), update_baseline=True, stdout=StringIO())
+            report = json.loads(output.read_text())
+            self.assertEqual(json.loads(baseline.read_text())['scenarios'].keys(), report['scenarios'].keys())
+
+            call_command('benchmark_endpoints', requests=4, concurrency=1, warmup=1, output=str(output),
+                         baseline=str(baseline), scenarios='clases-por-mes', stdout=StringIO())
+            compared = json.loads(output.read_text())
+
+        self.assertIn('bookings-create', report['scenarios'])
+        for row in report['scenarios'].values():
+            self.assertEqual(row['requests'], 4)
+            self.assertEqual(row['errors'], 0)
+            self.assertIsNotNone(row['p99_ms'])
+            self.assertGreater(row['queries_max'], 0)
+        self.assertIn('201', report['scenarios']['bookings-create']['status_codes'])
+        self.assertEqual(list(compared['comparison']), ['clases-por-mes'])
+        # Las reservas de bookings-create y sus correos se borran al terminar
+        self.assertEqual(Booking.objects.count(), bookings)
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_benchmark_queues_no_emails_and_removes_its_user(self):
+        generate_studio_data(clients=20, months=1, seed=5)
+        users = set(CustomUser.objects.values_list('id', flat=True))
+        bookings = Booking.objects.count()
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command('benchmark_endpoints', requests=3, concurrency=1, warmup=0, scenarios='bookings-create',
+                         keep_writes=True, output=str(Path(tmp, 'report.json')), stdout=StringIO())
+
+        self.assertEqual(Booking.objects.count(), bookings + 3)
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertEqual(set(CustomUser.objects.values_list('id', flat=True)), users)
+        # Fuera del benchmark las reservas vuelven a encolar su correo
+        self.assertIs(mails.queue_email, queue_email)
+
+    def test_refuses_non_local_database(self):
+        with mock.patch('studio.benchmark.is_local_database', return_value=False):
+            with self.assertRaises(RuntimeError):
+                run_benchmark(requests=1, warmup=0)
+        with mock.patch('studio.management.commands.benchmark_endpoints.is_local_database', return_value=False):
+            with self.assertRaisesMessage(CommandError, '--force'):
+                call_command('benchmark_endpoints', requests=1, stdout=StringIO())
+
+        stderr = StringIO()
+        with mock.patch('studio.management.commands.generate_studio_data.is_local_database', return_value=False):
+            call_command('generate_studio_data', clients=5, months=1, stdout=StringIO(), stderr=stderr)
+        self.assertIn('--force', stderr.getvalue())
+        self.assertFalse(Client.objects.exists())
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_is_local_database(self):
+        def local(host, name='vile', vendor='postgresql'):
+            fake = mock.Mock(vendor=vendor, settings_dict={'HOST': host, 'NAME': name, 'TEST': {}})
+            with mock.patch('studio.datagen.connections', {'default': fake}):
+                return is_local_database()
+
+        self.assertTrue(local('localhost'))
+        self.assertTrue(local('127.0.0.1'))
+        self.assertTrue(local(''))
+        self.assertTrue(local('/var/run/postgresql'))
+        self.assertTrue(local('db.example.com', name='test_vile'))
+        self.assertTrue(local('db.example.com', vendor='sqlite'))
+        self.assertFalse(local('us-east-1.sql.xata.sh'))
+
+    def test_url_runs_skip_write_scenarios(self):
+        generate_studio_data(clients=10, months=1, seed=5)
+        bookings = Booking.objects.count()
+        messages = []
+        # Nadie escucha en el puerto: las lecturas fallan, pero no se intenta escribir
+        report = run_benchmark(requests=1, concurrency=1, warmup=0, base_url='http://127.0.0.1:9',
+                               log=messages.append)
+        self.assertNotIn('bookings-create', report['scenarios'])
+        self.assertIn('availability-day', report['scenarios'])
+        self.assertTrue(any('bookings-create' in message for message in messages))
+        self.assertEqual(Booking.objects.count(), bookings)
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics_registry.reset()
+        self.admin = CustomUser.objects.create(username='admin', is_staff=True)
+        self.user = CustomUser.objects.create(username='recepcion')
+        self.api = APIClient()
+
+    def test_server_timing_only_for_staff(self):
+        self.api.force_authenticate(self.admin)
+        timing = self.api.get('/api/studio/memberships/')['Server-Timing']
+        for segment in ('db;dur=', 'view;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(segment, timing)
+        self.assertRegex(timing, r'desc="\d+ consultas"')
+
+        self.api.force_authenticate(self.user)
+        self.assertFalse(self.api.get('/api/studio/memberships/').has_header('Server-Timing'))
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.api.force_authenticate(self.user)
+        self.api.get('/api/studio/memberships/')
+        self.assertEqual(self.api.get('/api/studio/metrics/').status_code, 403)
+
+        self.api.force_authenticate(self.admin)
+        response = self.api.get('/api/studio/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        labels = 'url_name="memberships-list",method="GET",handler="MembershipViewSet.list"'
+        self.assertIn(f'vile_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', body)
+        self.assertIn(f'vile_request_queries_count{{{labels}}} 1', body)
+        self.assertIn(f'vile_responses_total{{{labels},status="200"}} 1', body)
+        self.assertIn('handler="performance_metrics",status="403"', body)
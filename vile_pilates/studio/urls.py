@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AvailabilityView, BookingViewSet, MembershipViewSet, PlanIntentViewSet, PaymentViewSet, PromotionInstanceViewSet, PromotionViewSet, ScheduleViewSet, MonthlyRevenueViewSet, VentaViewSet, summary_by_class_type, attendance_summary, clases_por_mes, get_today_payments_total, get_weekly_closing_summary
+from .views import AvailabilityView, BookingViewSet, MembershipViewSet, PlanIntentViewSet, PaymentViewSet, PromotionInstanceViewSet, PromotionViewSet, ScheduleViewSet, MonthlyRevenueViewSet, VentaViewSet, availability_cache_status, performance_metrics, summary_by_class_type, attendance_summary, occupancy_heatmap, clases_por_mes, get_today_payments_total, get_weekly_closing_summary
 
 # Crear un router para manejar las rutas
 router = DefaultRouter()
@@ -19,10 +19,14 @@ urlpatterns = [
     path('', include(router.urls)),
     # Endpoint para consultar la disponibilidad
     path('availability/', AvailabilityView.as_view(), name='availability'),
+    path('availability/cache-stats/', availability_cache_status, name='availability-cache-stats'),
     path('summary-by-class-type/', summary_by_class_type),
     path('attendance-summary/', attendance_summary),
+    path('occupancy-heatmap/', occupancy_heatmap, name='occupancy-heatmap'),
     path('clases-por-mes/', clases_por_mes, name='clases-por-mes'),
     path('today/', get_today_payments_total, name='payments-today'),
     path('cierres-semanales/', get_weekly_closing_summary, name='cierres-semanales'),
+    # Métricas de rendimiento por endpoint (Prometheus), solo administradores
+    path('metrics/', performance_metrics, name='performance-metrics'),
 
 ]   
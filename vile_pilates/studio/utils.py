@@ -5,150 +5,793 @@ import pandas as pd
 import unicodedata
 
 from django.db import models, transaction
-from django.db.models import Count, Sum
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Sum
 
 from django.db.models import Sum
 from .models import Payment, MonthlyRevenue
 from django.utils import timezone
 from datetime import timedelta
 
-from django.db.models.functions import TruncMonth
+from django.db.models.functions import ExtractMonth, ExtractYear, TruncMonth
 from django.utils import timezone
 
-from .models import Membership, Payment, MonthlyRevenue
+from .models import Membership, Payment, MonthlyRevenue, SEAT_HOLDING_STATUSES
 from accounts.models import Client
 
 # -----------------------------------------------------------------------------
 # Helper utilities
 
+def _month_bounds(year, month):
+    start = datetime(year, month, 1).date()
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def _count_monthly_bookings(client_id, year, month):
+    """Count from Booking the client's valid classes (active, not no-show) in the month."""
+    from studio.models import Booking
+
+    return (
+        Booking.objects.filter(
+            client_id=client_id,
+            class_date__range=_month_bounds(year, month),
+            status="active",
+        )
+        .exclude(attendance_status="no_show")
+        .count()
+    )
+
+
 def count_valid_monthly_bookings(client, reference_date=None):
     """Return number of bookings for the client in the month excluding no-shows."""
-    from studio.models import Booking
+    from studio.models import MonthlyClassUsage
 
     ref = reference_date or timezone.now().date()
-    start = ref.replace(day=1)
-    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    usage = (
+        MonthlyClassUsage.objects.filter(client_id=client.id, year=ref.year, month=ref.month)
+        .values_list("used", flat=True)
+        .first()
+    )
+    if usage is not None:
+        return usage
 
-    return (
+    used = _count_monthly_bookings(client.id, ref.year, ref.month)
+    MonthlyClassUsage.objects.get_or_create(
+        client_id=client.id, year=ref.year, month=ref.month, defaults={"used": used}
+    )
+    return used
+
+
+def usage_key(booking):
+    """(client_id, year, month) the booking counts towards, or None if it does not count."""
+    if booking.status != "active" or booking.attendance_status == "no_show":
+        return None
+    return (booking.client_id, booking.class_date.year, booking.class_date.month)
+
+
+def _apply_usage_delta(key, delta):
+    from studio.models import MonthlyClassUsage
+
+    client_id, year, month = key
+    usage = MonthlyClassUsage.objects.filter(client_id=client_id, year=year, month=month)
+    if delta < 0:
+        usage = usage.filter(used__gt=0)
+    if usage.update(used=F("used") + delta):
+        return
+    if delta < 0:
+        # Sin fila no hay nada que descontar: count_valid_monthly_bookings la
+        # siembra al leerla. Tampoco se crea una durante el borrado en cascada
+        # de un cliente, cuyos contadores ya se están eliminando.
+        return
+
+    # Sin fila todavía: se siembra contando las reservas, que ya incluyen el cambio.
+    # Si otra transacción la creó antes (p. ej. rebuild_monthly_usage), su
+    # conteo no veía este cambio y el delta se aplica encima.
+    _, created = MonthlyClassUsage.objects.get_or_create(
+        client_id=client_id,
+        year=year,
+        month=month,
+        defaults={"used": _count_monthly_bookings(client_id, year, month)},
+    )
+    if not created:
+        usage.update(used=F("used") + delta)
+
+
+def track_usage_change(before, after):
+    """
+    Move a booking's contribution between monthly usage counters.
+
+    ``before`` and ``after`` are ``usage_key`` values taken before and after the
+    booking was written; call this in the same transaction, after the write.
+    """
+    if before == after:
+        return
+    if before:
+        _apply_usage_delta(before, -1)
+    if after:
+        _apply_usage_delta(after, 1)
+
+
+def sync_monthly_usage(keys):
+    """Recount from Booking the given (client_id, year, month) counters."""
+    from studio.models import Booking, MonthlyClassUsage
+
+    keys = set(keys)
+    if not keys:
+        return
+
+    starts, ends = zip(*(_month_bounds(year, month) for _, year, month in keys))
+    rows = (
         Booking.objects.filter(
-            client=client,
-            class_date__range=[start, end],
+            client_id__in={c for c, _, _ in keys},
+            class_date__range=[min(starts), max(ends)],
             status="active",
         )
         .exclude(attendance_status="no_show")
-        .count()
+        .annotate(year=ExtractYear("class_date"), month=ExtractMonth("class_date"))
+        .values("client_id", "year", "month")
+        .annotate(n=Count("id"))
+    )
+    used = {(r["client_id"], r["year"], r["month"]): r["n"] for r in rows}
+
+    MonthlyClassUsage.objects.bulk_create(
+        [
+            MonthlyClassUsage(client_id=c, year=y, month=m, used=used.get((c, y, m), 0))
+            for c, y, m in keys
+        ],
+        update_conflicts=True,
+        unique_fields=["client", "year", "month"],
+        update_fields=["used", "updated_at"],
+        batch_size=500,
     )
 
-def recalculate_monthly_revenue(year, month):
-    from .models import Payment, MonthlyRevenue, Venta
 
-    # Pagos
-    payments = Payment.objects.filter(date_paid__year=year, date_paid__month=month)
-    total_payments = payments.aggregate(Sum('amount'))['amount__sum'] or 0
-    count_payments = payments.count()
+def rebuild_monthly_usage():
+    """
+    Rebuild every monthly usage counter with one grouped query.
+
+    Same locking as rebuild_seat_ledger: the existing counters are locked
+    before counting, so a concurrent track_usage_change either commits before
+    the count or waits and applies its delta on top of the rebuilt value.
+    Counters left without bookings are set to 0 instead of deleted.
+    """
+    from studio.models import Booking, MonthlyClassUsage
+
+    rows = (
+        Booking.objects.filter(status="active")
+        .exclude(attendance_status="no_show")
+        .annotate(year=ExtractYear("class_date"), month=ExtractMonth("class_date"))
+        .values("client_id", "year", "month")
+        .annotate(n=Count("id"))
+    )
+
+    with transaction.atomic():
+        keys = set(
+            MonthlyClassUsage.objects.select_for_update().values_list("client_id", "year", "month")
+        )
+        used = {(r["client_id"], r["year"], r["month"]): r["n"] for r in rows}
+        MonthlyClassUsage.objects.bulk_create(
+            [
+                MonthlyClassUsage(client_id=c, year=y, month=m, used=used.get((c, y, m), 0))
+                for c, y, m in keys | set(used)
+            ],
+            update_conflicts=True,
+            unique_fields=["client", "year", "month"],
+            update_fields=["used", "updated_at"],
+            batch_size=1000,
+        )
+    return len(used)
+
+# -----------------------------------------------------------------------------
+# Snapshot del último pago en Client
 
-    # Ventas
-    ventas = Venta.objects.filter(date_sold__year=year, date_sold__month=month)
-    total_ventas = ventas.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    count_ventas = ventas.count()
+def refresh_payment_snapshots(client_ids=None):
+    """
+    Copy each client's latest payment (id, membership, valid_until) onto Client.
 
-    total = total_payments + total_ventas
+    One UPDATE with correlated subqueries, whatever the number of clients.
+    ``None`` refreshes every client (backfill).
+    """
+    latest = Payment.objects.filter(client_id=OuterRef("pk")).order_by("-date_paid", "-id")
 
-    obj, created = MonthlyRevenue.objects.update_or_create(
+    clients = Client.objects.all()
+    if client_ids is not None:
+        clients = clients.filter(pk__in=set(client_ids))
+
+    return clients.update(
+        latest_payment_id=Subquery(latest.values("id")[:1]),
+        latest_payment_membership_id=Subquery(latest.values("membership_id")[:1]),
+        latest_valid_until=Subquery(latest.values("valid_until")[:1]),
+    )
+
+
+def payments_not_renewed(valid_until):
+    """Pagos que vencen en valid_until y cuyo cliente no ha renovado después."""
+    renewed = Payment.objects.filter(
+        client=OuterRef("client"),
+        date_paid__gt=OuterRef("date_paid"),
+        valid_until__gt=OuterRef("valid_until"),
+    )
+    return (
+        Payment.objects.filter(valid_until=valid_until)
+        .exclude(Exists(renewed))
+        .select_related("client", "membership")
+    )
+
+# -----------------------------------------------------------------------------
+# Seat ledger: cupos ocupados por (schedule, class_date)
+#
+# Una reserva ocupa cupo si su estado está en SEAT_HOLDING_STATUSES (ver
+# studio.models); la disponibilidad cuenta con el mismo criterio.
+
+
+def _seed_seat_ledger(schedule_id, class_date):
+    """Create the ledger row for a slot, counting the bookings that already exist."""
+    from studio.models import Booking, ClassSeatLedger
+
+    booked = Booking.objects.filter(
+        schedule_id=schedule_id,
+        class_date=class_date,
+        status__in=SEAT_HOLDING_STATUSES,
+    ).count()
+    ClassSeatLedger.objects.get_or_create(
+        schedule_id=schedule_id, class_date=class_date, defaults={"booked": booked}
+    )
+
+
+def reserve_seat(schedule, class_date):
+    """
+    Occupy one seat of the slot with a conditional UPDATE.
+
+    Returns False when the class is full. Must run inside the same transaction
+    that saves the booking so a failed insert also gives the seat back.
+    """
+    from studio.models import ClassSeatLedger
+
+    ledger = ClassSeatLedger.objects.filter(schedule_id=schedule.id, class_date=class_date)
+    if ledger.filter(booked__lt=schedule.capacity).update(booked=F("booked") + 1):
+        return True
+    if ledger.exists():
+        return False
+
+    _seed_seat_ledger(schedule.id, class_date)
+    return bool(ledger.filter(booked__lt=schedule.capacity).update(booked=F("booked") + 1))
+
+
+def reserve_seats(schedule, class_dates):
+    """
+    Occupy one seat of the schedule on every date that still has room.
+
+    Locks the ledger rows of all dates in one SELECT ... FOR UPDATE and
+    increments them with a single UPDATE. Returns the set of reserved dates.
+    """
+    from studio.models import Booking, ClassSeatLedger
+
+    class_dates = set(class_dates)
+    if not class_dates:
+        return set()
+
+    ledger = ClassSeatLedger.objects.filter(schedule_id=schedule.id, class_date__in=class_dates)
+    missing = class_dates - set(ledger.values_list("class_date", flat=True))
+    if missing:
+        counts = dict(
+            Booking.objects.filter(
+                schedule_id=schedule.id,
+                class_date__in=missing,
+                status__in=SEAT_HOLDING_STATUSES,
+            )
+            .values("class_date")
+            .annotate(n=Count("id"))
+            .values_list("class_date", "n")
+        )
+        ClassSeatLedger.objects.bulk_create(
+            [
+                ClassSeatLedger(schedule_id=schedule.id, class_date=d, booked=counts.get(d, 0))
+                for d in missing
+            ],
+            ignore_conflicts=True,
+        )
+
+    free = list(
+        ledger.select_for_update()
+        .filter(booked__lt=schedule.capacity)
+        .values_list("id", "class_date")
+    )
+    ClassSeatLedger.objects.filter(id__in=[pk for pk, _ in free]).update(booked=F("booked") + 1)
+    return {d for _, d in free}
+
+
+def release_seat(schedule_id, class_date):
+    """Give back one seat of the slot (no-op if the slot was never booked)."""
+    from studio.models import ClassSeatLedger
+
+    ClassSeatLedger.objects.filter(
+        schedule_id=schedule_id, class_date=class_date, booked__gt=0
+    ).update(booked=F("booked") - 1)
+
+
+def sync_seat_ledger(slots):
+    """Recount from Booking the seats of the given (schedule_id, class_date) pairs."""
+    from studio.models import Booking, ClassSeatLedger
+
+    slots = set(slots)
+    if not slots:
+        return
+
+    counts = (
+        Booking.objects.filter(
+            schedule_id__in={s for s, _ in slots},
+            class_date__in={d for _, d in slots},
+            status__in=SEAT_HOLDING_STATUSES,
+        )
+        .values("schedule_id", "class_date")
+        .annotate(n=Count("id"))
+    )
+    booked = {(r["schedule_id"], r["class_date"]): r["n"] for r in counts}
+
+    ClassSeatLedger.objects.bulk_create(
+        [
+            ClassSeatLedger(schedule_id=s, class_date=d, booked=booked.get((s, d), 0))
+            for s, d in slots
+        ],
+        update_conflicts=True,
+        unique_fields=["schedule", "class_date"],
+        update_fields=["booked", "updated_at"],
+        batch_size=500,
+    )
+
+
+def rebuild_seat_ledger(since=None):
+    """
+    Rebuild the whole ledger (or from ``since`` on) with one grouped query.
+
+    The existing rows are locked before counting. Every booking write touches
+    its slot's row in the same transaction (reserve_seat, release_seat,
+    sync_seat_ledger), so a concurrent reservation either commits before the
+    count sees it or waits and applies its change on top of the new value.
+    Slots left without bookings are set to 0 instead of deleted.
+    """
+    from studio.models import Booking, ClassSeatLedger
+
+    bookings = Booking.objects.filter(status__in=SEAT_HOLDING_STATUSES)
+    ledger = ClassSeatLedger.objects.all()
+    if since:
+        bookings = bookings.filter(class_date__gte=since)
+        ledger = ledger.filter(class_date__gte=since)
+
+    with transaction.atomic():
+        slots = set(ledger.select_for_update().values_list("schedule_id", "class_date"))
+        booked = {
+            (r["schedule_id"], r["class_date"]): r["n"]
+            for r in bookings.values("schedule_id", "class_date").annotate(n=Count("id"))
+        }
+        ClassSeatLedger.objects.bulk_create(
+            [
+                ClassSeatLedger(schedule_id=s, class_date=d, booked=booked.get((s, d), 0))
+                for s, d in slots | set(booked)
+            ],
+            update_conflicts=True,
+            unique_fields=["schedule", "class_date"],
+            update_fields=["booked", "updated_at"],
+            batch_size=1000,
+        )
+    return len(booked)
+
+# -----------------------------------------------------------------------------
+# Cierre diario (DailyClosing)
+
+# Días hacia atrás que el job programado vuelve a calcular en cada corrida
+# (asistencias y clases de prueba cambian después del día del pago).
+DAILY_CLOSING_REFRESH_DAYS = 7
+
+
+def _local_date(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _local_day_range(field, first, last):
+    """
+    Filtro [first 00:00, last + 1 día 00:00) en hora local sobre un DateTimeField.
+
+    ``field__date`` aplica una función a la columna y no usa su índice; este
+    rango sí, y se combina con el filtro por fecha para acotar la búsqueda.
+    """
+    from django.db.models import Q
+
+    def midnight(day):
+        return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+    q = Q()
+    if first:
+        q &= Q(**{f"{field}__gte": midnight(first)})
+    if last:
+        q &= Q(**{f"{field}__lt": midnight(last + timedelta(days=1))})
+    return q
+
+
+def _scope_bounds(dates, start, end):
+    if dates:
+        return max(filter(None, [min(dates), start])), min(filter(None, [max(dates), end]))
+    return start, end
+
+
+def rebuild_daily_closings(dates=None, start=None, end=None):
+    """
+    Recalcula los cierres de las fechas dadas (o del rango start..end; sin
+    argumentos, todo el historial) con una consulta agrupada por tabla.
+    """
+    from django.db.models import Q
+    from django.db.models.functions import TruncDate
+    from .models import Booking, DailyClosing, Venta
+
+    def in_scope(field):
+        q = Q()
+        if dates is not None:
+            q &= Q(**{f"{field}__in": dates})
+        if start:
+            q &= Q(**{f"{field}__gte": start})
+        if end:
+            q &= Q(**{f"{field}__lte": end})
+        return q
+
+    payments = (
+        Payment.objects.filter(in_scope("date_paid__date"))
+        .filter(_local_day_range("date_paid", *_scope_bounds(dates, start, end)))
+        .annotate(day=TruncDate("date_paid"))
+        .values("day")
+        .annotate(
+            total=Sum("amount"),
+            count=Count("id"),
+            card=Sum("amount", filter=Q(payment_method="Tarjeta")),
+            cash=Sum("amount", filter=Q(payment_method="Efectivo")),
+            visalink=Sum("amount", filter=Q(payment_method="Visalink")),
+        )
+    )
+    closings = {
+        row["day"]: DailyClosing(
+            date=row["day"],
+            payment_total=row["total"] or 0,
+            payment_count=row["count"],
+            card_total=row["card"] or 0,
+            cash_total=row["cash"] or 0,
+            visalink_total=row["visalink"] or 0,
+        )
+        for row in payments
+    }
+
+    if closings:
+        days = list(closings)
+        ventas = (
+            Venta.objects.filter(date_sold__date__in=days)
+            .filter(_local_day_range("date_sold", min(days), max(days)))
+            .annotate(day=TruncDate("date_sold"))
+            .values("day")
+            .annotate(total=Sum("total_amount"))
+        )
+        for row in ventas:
+            closings[row["day"]].venta_total = row["total"] or 0
+
+        bookings = (
+            Booking.objects.filter(class_date__in=days)
+            .values("class_date")
+            .annotate(
+                n=Count("id"),
+                individual=Count("id", filter=Q(schedule__is_individual=True)),
+                trials=Count("id", filter=Q(client__trial_used=True)),
+            )
+        )
+        for row in bookings:
+            closing = closings[row["class_date"]]
+            closing.attendance = row["n"]
+            closing.individual_classes = row["individual"]
+            closing.trials = row["trials"]
+
+    with transaction.atomic():
+        # Días que ya no tienen pagos dejan de aparecer en el cierre
+        DailyClosing.objects.filter(in_scope("date")).exclude(date__in=list(closings)).delete()
+        DailyClosing.objects.bulk_create(
+            closings.values(),
+            update_conflicts=True,
+            unique_fields=["date"],
+            update_fields=[
+                "payment_total", "venta_total", "payment_count", "card_total",
+                "cash_total", "visalink_total", "attendance", "individual_classes",
+                "trials", "updated_at",
+            ],
+            batch_size=500,
+        )
+    return len(closings)
+
+
+def schedule_daily_closing_refresh(*values):
+    """Recalcula, al confirmar la transacción, los cierres de las fechas/fechas-hora dadas."""
+    dates = {_local_date(v) for v in values if v}
+    if dates:
+        transaction.on_commit(lambda: rebuild_daily_closings(dates=dates))
+
+
+def refresh_recent_daily_closings(days=DAILY_CLOSING_REFRESH_DAYS):
+    """
+    Llenado incremental: desde unos días antes del último cierre guardado hasta
+    hoy. Si la tabla está vacía recalcula todo el historial.
+    """
+    from .models import DailyClosing
+
+    today = timezone.localdate()
+    last = DailyClosing.objects.order_by("-date").values_list("date", flat=True).first()
+    if last is None:
+        return rebuild_daily_closings()
+    return rebuild_daily_closings(start=min(last, today) - timedelta(days=days), end=today)
+
+# -----------------------------------------------------------------------------
+# Ingresos mensuales: eventos (RevenueEvent) + proyección (MonthlyRevenue)
+#
+# Cada alta, cambio o baja de un Payment/Venta agrega un evento con los deltas
+# y suma esos deltas a MonthlyRevenue con un solo INSERT ... ON CONFLICT, en la
+# misma transacción. El mes se toma en la hora local, igual que los recálculos.
+
+REVENUE_FIELDS = ("total_amount", "payment_count", "venta_total", "venta_count")
+
+
+def _revenue_month(value):
+    day = _local_date(value)
+    return day.year, day.month
+
+
+def _apply_revenue_delta(year, month, deltas):
+    """Suma ``deltas`` (dict por campo de REVENUE_FIELDS) a la fila del mes."""
+    from django.db import connection
+
+    table = connection.ops.quote_name(MonthlyRevenue._meta.db_table)
+    # Nada se recorta: la fila es siempre la suma exacta de los eventos del mes.
+    # Un valor negativo significa historial sin eventos y lo reporta
+    # monthly_revenue_drift (se corrige con reconcile_monthly_revenue).
+    values = [deltas.get(field, 0) for field in REVENUE_FIELDS]
+    updates = ", ".join(f"{field} = {table}.{field} + %s" for field in REVENUE_FIELDS)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (year, month, {', '.join(REVENUE_FIELDS)}, last_updated) "
+            f"VALUES (%s, %s, %s, %s, %s, %s, %s) "
+            f"ON CONFLICT (year, month) DO UPDATE SET {updates}, last_updated = %s",
+            [year, month, *values, timezone.now(), *values, timezone.now()],
+        )
+
+
+def record_revenue_event(source, source_id, year, month, deltas):
+    from .models import RevenueEvent
+
+    RevenueEvent.objects.create(
+        source=source,
+        source_id=source_id,
         year=year,
         month=month,
-        defaults={
-            'total_amount': total,
-            'payment_count': count_payments,
-            'venta_total': total_ventas,
-            'venta_count': count_ventas
-        }
+        total_delta=deltas.get("total_amount", 0),
+        payment_count_delta=deltas.get("payment_count", 0),
+        venta_total_delta=deltas.get("venta_total", 0),
+        venta_count_delta=deltas.get("venta_count", 0),
     )
+    _apply_revenue_delta(year, month, deltas)
 
-    return {
-        "year": year,
-        "month": month,
-        "total": total,
-        "from_payments": total_payments,
-        "from_sales": total_ventas,
-        "payments_count": count_payments,
-        "ventas_count": count_ventas
-    }
 
-def recalculate_all_monthly_revenue():
-    from .models import Payment, Venta, MonthlyRevenue
+def _source_deltas(source, amount, sign):
+    if source == "payment":
+        return {"total_amount": sign * amount, "payment_count": sign}
+    return {"total_amount": sign * amount, "venta_total": sign * amount, "venta_count": sign}
+
+
+def track_revenue_change(source, source_id, before, after):
+    """
+    Registra el cambio de un Payment o Venta. ``before``/``after`` son
+    (fecha_hora, monto) o None (alta / baja). Debe llamarse dentro de la
+    transacción que guarda o elimina el registro.
+    """
+    if before and after and _revenue_month(before[0]) == _revenue_month(after[0]) \
+            and Decimal(before[1]) == Decimal(after[1]):
+        return
+    if before:
+        record_revenue_event(source, source_id, *_revenue_month(before[0]),
+                             _source_deltas(source, Decimal(before[1]), -1))
+    if after:
+        record_revenue_event(source, source_id, *_revenue_month(after[0]),
+                             _source_deltas(source, Decimal(after[1]), 1))
+
+
+def record_bulk_revenue(source, rows):
+    """
+    Eventos de alta para filas creadas con bulk_create (que no pasa por
+    save()). ``rows`` son tuplas (id, fecha_hora, monto). Un evento por fila y
+    un solo upsert por mes afectado; debe llamarse en la misma transacción.
+    """
+    from .models import RevenueEvent
+
+    events = []
+    months = {}
+    for source_id, when, amount in rows:
+        year, month = _revenue_month(when)
+        deltas = _source_deltas(source, Decimal(amount), 1)
+        events.append(RevenueEvent(
+            source=source,
+            source_id=source_id,
+            year=year,
+            month=month,
+            total_delta=deltas.get("total_amount", 0),
+            payment_count_delta=deltas.get("payment_count", 0),
+            venta_total_delta=deltas.get("venta_total", 0),
+            venta_count_delta=deltas.get("venta_count", 0),
+        ))
+        totals = months.setdefault((year, month), dict.fromkeys(REVENUE_FIELDS, 0))
+        for field, value in deltas.items():
+            totals[field] += value
+
+    RevenueEvent.objects.bulk_create(events, batch_size=500)
+    for (year, month), deltas in months.items():
+        _apply_revenue_delta(year, month, deltas)
+
+
+def _months_q(months):
+    """Q que selecciona los pares (year, month) dados; sin pares no filtra nada."""
+    q = models.Q()
+    for year, month in months or ():
+        q |= models.Q(year=year, month=month)
+    return q
 
-    from django.db.models.functions import ExtractYear, ExtractMonth
 
-    # Agrupar pagos
+def _monthly_revenue_from_sources(months=None):
+    """{(year, month): {campo: valor}} calculado directamente de Payment y Venta."""
+    from .models import Venta
+
     payment_data = (
         Payment.objects
-        .annotate(year=ExtractYear('date_paid'), month=ExtractMonth('date_paid'))
-        .values('year', 'month')
-        .annotate(total=Sum('amount'), count=Count('id'))
+        .annotate(year=ExtractYear("date_paid"), month=ExtractMonth("date_paid"))
+        .filter(_months_q(months))
+        .values("year", "month")
+        .annotate(total=Sum("amount"), count=Count("id"))
     )
-
-    # Agrupar ventas
     venta_data = (
         Venta.objects
-        .annotate(year=ExtractYear('date_sold'), month=ExtractMonth('date_sold'))
-        .values('year', 'month')
-        .annotate(total=Sum('total_amount'), count=Count('id'))
+        .annotate(year=ExtractYear("date_sold"), month=ExtractMonth("date_sold"))
+        .filter(_months_q(months))
+        .values("year", "month")
+        .annotate(total=Sum("total_amount"), count=Count("id"))
     )
 
-    # Convertir a diccionarios accesibles
-    pagos_map = {(d['year'], d['month']): d for d in payment_data}
-    ventas_map = {(d['year'], d['month']): d for d in venta_data}
-
-    # Combinar claves
-    all_keys = set(pagos_map.keys()).union(set(ventas_map.keys()))
+    months = {}
+    empty = {"total_amount": Decimal("0"), "payment_count": 0, "venta_total": Decimal("0"), "venta_count": 0}
+    for row in payment_data:
+        month = months.setdefault((row["year"], row["month"]), dict(empty))
+        month["payment_count"] = row["count"]
+        month["total_amount"] += row["total"] or 0
+    for row in venta_data:
+        month = months.setdefault((row["year"], row["month"]), dict(empty))
+        month["venta_count"] = row["count"]
+        month["venta_total"] = row["total"] or 0
+        month["total_amount"] += row["total"] or 0
+    return months
+
+
+def monthly_revenue_drift(months=None):
+    """
+    Compara por mes lo que dicen Payment/Venta, la suma de eventos y
+    MonthlyRevenue. Devuelve solo los meses que no coinciden; ``months``
+    limita la comparación a esos pares (year, month).
+    """
+    from .models import RevenueEvent
+
+    expected = _monthly_revenue_from_sources(months)
+    events = {
+        (row["year"], row["month"]): {
+            "total_amount": row["total"] or 0,
+            "payment_count": row["payments"] or 0,
+            "venta_total": row["venta_total"] or 0,
+            "venta_count": row["ventas"] or 0,
+        }
+        for row in RevenueEvent.objects.filter(_months_q(months)).values("year", "month").annotate(
+            total=Sum("total_delta"),
+            payments=Sum("payment_count_delta"),
+            venta_total=Sum("venta_total_delta"),
+            ventas=Sum("venta_count_delta"),
+        )
+    }
+    projection = {
+        (row["year"], row["month"]): {field: row[field] for field in REVENUE_FIELDS}
+        for row in MonthlyRevenue.objects.filter(_months_q(months)).values("year", "month", *REVENUE_FIELDS)
+    }
 
-    results = []
+    zero = dict.fromkeys(REVENUE_FIELDS, 0)
+    drift = []
+    for key in sorted(set(expected) | set(events) | set(projection)):
+        row = {
+            "year": key[0],
+            "month": key[1],
+            "expected": expected.get(key, zero),
+            "events": events.get(key, zero),
+            "projection": projection.get(key, zero),
+        }
+        if row["expected"] != row["events"] or row["expected"] != row["projection"]:
+            drift.append(row)
+    return drift
 
-    for (year, month) in sorted(all_keys, reverse=True):
-        pagos = pagos_map.get((year, month), {'total': 0, 'count': 0})
-        ventas = ventas_map.get((year, month), {'total': 0, 'count': 0})
 
-        total = (pagos['total'] or 0) + (ventas['total'] or 0)
+def reconcile_monthly_revenue(fix=False, months=None):
+    """
+    Reporta los meses con diferencias. Con ``fix`` agrega eventos de ajuste
+    para que la suma de eventos cuadre con Payment/Venta y reescribe esos
+    meses de MonthlyRevenue, todo en una transacción. ``months`` limita la
+    revisión a esos pares (year, month).
+    """
+    from .models import RevenueEvent
 
-        MonthlyRevenue.objects.update_or_create(
-            year=year,
-            month=month,
-            defaults={
-                'total_amount': total,
-                'payment_count': pagos['count'],
-                'venta_total': ventas['total'] or 0,
-                'venta_count': ventas['count']
-            }
+    with transaction.atomic():
+        drift = monthly_revenue_drift(months)
+        if not fix or not drift:
+            return drift
+
+        adjustments = []
+        for row in drift:
+            delta = {field: row["expected"][field] - row["events"][field] for field in REVENUE_FIELDS}
+            if any(delta.values()):
+                adjustments.append(RevenueEvent(
+                    source="adjustment",
+                    year=row["year"],
+                    month=row["month"],
+                    total_delta=delta["total_amount"],
+                    payment_count_delta=delta["payment_count"],
+                    venta_total_delta=delta["venta_total"],
+                    venta_count_delta=delta["venta_count"],
+                ))
+        RevenueEvent.objects.bulk_create(adjustments)
+
+        MonthlyRevenue.objects.bulk_create(
+            [MonthlyRevenue(year=row["year"], month=row["month"], **row["expected"]) for row in drift],
+            update_conflicts=True,
+            unique_fields=["year", "month"],
+            update_fields=[*REVENUE_FIELDS, "last_updated"],
         )
+    return drift
 
-        results.append({
-            "year": year,
-            "month": month,
-            "total_amount": total,
-            "payment_count": pagos['count'],
-            "venta_total": ventas['total'] or 0,
-            "venta_count": ventas['count']
-        })
-
-    # Resetear meses antiguos sin datos
-    existing = MonthlyRevenue.objects.all()
-    for entry in existing:
-        if (entry.year, entry.month) not in all_keys:
-            entry.total_amount = 0
-            entry.payment_count = 0
-            entry.venta_total = 0
-            entry.venta_count = 0
-            entry.save()
-            results.append({
-                "year": entry.year,
-                "month": entry.month,
-                "total_amount": 0,
-                "payment_count": 0,
-                "venta_total": 0,
-                "venta_count": 0
-            })
+def recalculate_monthly_revenue(year, month):
+    """
+    Recalcula un mes desde Payment/Venta. Pasa por reconcile_monthly_revenue,
+    así cualquier corrección queda registrada como evento de ajuste.
+    """
+    with transaction.atomic():
+        reconcile_monthly_revenue(fix=True, months=[(year, month)])
+        values = _monthly_revenue_from_sources([(year, month)]).get((year, month))
+
+    values = values or {"total_amount": 0, "payment_count": 0, "venta_total": 0, "venta_count": 0}
+    return {
+        "year": year,
+        "month": month,
+        "total": values["total_amount"],
+        "from_payments": values["total_amount"] - values["venta_total"],
+        "from_sales": values["venta_total"],
+        "payments_count": values["payment_count"],
+        "ventas_count": values["venta_count"],
+    }
 
+def recalculate_all_monthly_revenue():
+    """
+    Recalcula todos los meses con un número fijo de consultas. Las
+    diferencias se corrigen con reconcile_monthly_revenue (eventos de ajuste
+    y upsert de los meses afectados); los meses que ya no tienen pagos ni
+    ventas quedan en cero.
+    """
+    with transaction.atomic():
+        reconcile_monthly_revenue(fix=True)
+        months = _monthly_revenue_from_sources()
+        zeroed = list(MonthlyRevenue.objects.exclude(_months_q(months)).values_list("year", "month"))
+
+    results = [
+        {"year": year, "month": month, **months[(year, month)]}
+        for year, month in sorted(months, reverse=True)
+    ]
+    results.extend(
+        {"year": year, "month": month, "total_amount": 0, "payment_count": 0, "venta_total": 0, "venta_count": 0}
+        for year, month in zeroed
+    )
     return results
 
 def import_payments_from_excel(file_obj) -> dict:
@@ -2,6 +2,7 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from django.utils import timezone
 from .models import Promotion, PromotionInstance, Schedule, Membership, Payment, Booking, PlanIntent, MonthlyRevenue, Venta
 from .serializers import BookingSerializer, MembershipSerializer, PlanIntentSerializer, PaymentSerializer, PromotionInstanceSerializer, PromotionSerializer, ScheduleSerializer, ScheduleWithBookingsSerializer, BookingAttendanceUpdateSerializer, MonthlyRevenueSerializer, BookingHistorialSerializer, VentaSerializer
@@ -15,21 +16,32 @@ from django.utils.timezone import now, localtime
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import F
-from .utils import recalculate_monthly_revenue, recalculate_all_monthly_revenue
-from .management.mails.mails import send_booking_confirmation_email, send_subscription_confirmation_email, send_individual_booking_pending_email
-from rest_framework.decorators import api_view
+from .utils import recalculate_monthly_revenue, recalculate_all_monthly_revenue, reserve_seat, reserve_seats, release_seat, sync_seat_ledger, SEAT_HOLDING_STATUSES, usage_key, track_usage_change, sync_monthly_usage, refresh_payment_snapshots, schedule_daily_closing_refresh, refresh_recent_daily_closings, record_bulk_revenue
+from .management.mails.mails import (
+    queue_email, booking_confirmation_message, bulk_booking_confirmation_message,
+    subscription_confirmation_message, individual_booking_pending_message,
+)
+from rest_framework.decorators import api_view, permission_classes
 from collections import Counter
 from rest_framework.permissions import IsAdminUser
+from django.http import HttpResponse
+from .metrics import PROMETHEUS_CONTENT_TYPE, registry as metrics_registry
 from accounts.models import Client
+from accounts.search import sync_search_tokens
 from decimal import Decimal, InvalidOperation
 import pandas as pd
-from studio.alerts import get_clients_with_consecutive_no_shows
+from studio.alerts import get_clients_with_consecutive_no_shows, rebuild_no_show_streaks
+from .availability import (
+    get_availability, invalidate_availability, availability_cache_stats, bookings_cache_version,
+    shared_cache_enabled, MAX_RANGE_DAYS, DAY_CODE_MAP,
+)
+from .occupancy import build_occupancy_heatmap, week_bounds, MAX_HEATMAP_WEEKS
 import random, time, unicodedata
 from studio.models import Client, Booking, Schedule, Membership, Payment
 import time as pytime
 from datetime import date as date_cls
 import pytz 
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils.dateparse import parse_date
 from math import ceil
 from collections import defaultdict
@@ -38,22 +50,61 @@ import unicodedata
 
 # Función que verifica si el cliente tiene una membresía activa
 def has_active_membership(client):
-    # Verificamos si el cliente tiene un pago reciente con una membresía activa
-    latest_payment = Payment.objects.filter(client=client).order_by('-date_paid').first()
-    return latest_payment and latest_payment.valid_until >= timezone.now().date()
+    # Se lee el snapshot del último pago guardado en Client (sin consultas extra)
+    return client.has_active_membership
+
+
+def _parse_date(value):
+    """
+    parse_date que también devuelve None para fechas imposibles como
+    2024-02-30 (parse_date lanza ValueError), así la vista responde 400.
+    """
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+# Máximo de fechas por solicitud en la reserva recurrente.
+MAX_BULK_BOOKINGS = 31
+
+# Días de gracia después del vencimiento de un pago.
+GRACE_DAYS = 7
+
+
+class NoSeatAvailable(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "No hay cupo disponible para este horario."
+    default_code = "no_seat_available"
 
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from datetime import datetime, timedelta
 from django.utils.timezone import now
-from django.db.models import Q
+from django.db.models import Q, Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework.pagination import PageNumberPagination
+
+# Monto de penalización por cada no-show sin justificación.
+NO_SHOW_PENALTY = 35
+
+
+class ClasesPorMesPagination(PageNumberPagination):
+    # Sin page_size por defecto: solo se pagina si se envía ?page_size=
+    page_size = None
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
 
 @api_view(['GET'])
 def clases_por_mes(request):
     """
     Devuelve resumen de clases válidas, no-shows y penalización sugerida por cliente en el mes.
     Solo penaliza los no-show sin causa justificada (sin cancellation_reason).
+
+    Filtros opcionales: ?membership=<id o nombre>, ?min_penalty=<monto>.
+    Paginación opcional: ?page_size=&page=
     """
     year = int(request.query_params.get('year', now().year))
     month = int(request.query_params.get('month', now().month))
@@ -64,98 +115,124 @@ def clases_por_mes(request):
     else:
         last_day = datetime(year, month + 1, 1).date() - timedelta(days=1)
 
-    clients = Client.objects.filter(status="A")
-    full_data = []
-
-    for client in clients:
-        active_payment = Payment.objects.filter(
-            client=client,
-            valid_until__gte=first_day
-        ).order_by('-date_paid').first()
-
-        if not active_payment:
-            continue
+    # Último pago vigente en el mes (el mismo que tomaba el cálculo por cliente)
+    active_payment = Payment.objects.filter(
+        client=OuterRef('pk'),
+        valid_until__gte=first_day
+    ).order_by('-date_paid', '-id')
+
+    in_month = Q(booking__class_date__range=[first_day, last_day])
+    unjustified = Q(booking__cancellation_reason__isnull=True) | Q(booking__cancellation_reason__exact='')
+
+    # Una sola consulta: subconsultas para el pago y conteos condicionales por cliente
+    rows = Client.objects.filter(status="A").annotate(
+        membership_id=Subquery(active_payment.values('membership_id')[:1]),
+    ).filter(membership_id__isnull=False).annotate(
+        membership_name=Subquery(active_payment.values('membership__name')[:1]),
+        expected_classes=Coalesce(Subquery(active_payment.values('membership__classes_per_month')[:1]), 0),
+        valid_classes=Count('booking', filter=in_month & Q(booking__attendance_status__in=['attended', 'cancelled'])),
+        no_show_classes=Count('booking', filter=in_month & Q(booking__attendance_status='no_show') & unjustified),
+    ).annotate(
+        penalty=F('no_show_classes') * NO_SHOW_PENALTY,
+    ).order_by('id')
+
+    membership = request.query_params.get('membership')
+    if membership:
+        if membership.isdigit():
+            rows = rows.filter(membership_id=int(membership))
+        else:
+            rows = rows.filter(membership_name__iexact=membership)
 
-        clases_esperadas = active_payment.membership.classes_per_month or 0
+    min_penalty = request.query_params.get('min_penalty')
+    if min_penalty:
+        try:
+            rows = rows.filter(penalty__gte=Decimal(min_penalty))
+        except InvalidOperation:
+            return Response({"detail": "min_penalty debe ser numérico."}, status=400)
 
-        clases_validas = Booking.objects.filter(
-            client=client,
-            class_date__range=[first_day, last_day],
-            attendance_status__in=['attended', 'cancelled']
-        ).count()
+    rows = rows.values(
+        'id', 'first_name', 'last_name', 'membership_name',
+        'expected_classes', 'valid_classes', 'no_show_classes', 'penalty',
+    )
 
-        # No-shows sin justificación
-        clases_no_show = Booking.objects.filter(
-            client=client,
-            class_date__range=[first_day, last_day],
-            attendance_status='no_show',
-        ).filter(
-            Q(cancellation_reason__isnull=True) | Q(cancellation_reason__exact='')
-        ).count()
+    paginator = ClasesPorMesPagination()
+    page = paginator.paginate_queryset(rows, request)
+    rows = list(page if page is not None else rows)
 
-        # Fechas de no-show sin justificación
-        date_no_show = Booking.objects.filter(
-            client=client,
+    # Fechas de no-show sin justificación, solo para los clientes con no-shows
+    dates_by_client = defaultdict(list)
+    with_no_shows = [row['id'] for row in rows if row['no_show_classes']]
+    if with_no_shows:
+        no_show_dates = Booking.objects.filter(
+            client_id__in=with_no_shows,
             class_date__range=[first_day, last_day],
             attendance_status='no_show',
         ).filter(
             Q(cancellation_reason__isnull=True) | Q(cancellation_reason__exact='')
-        ).values_list('class_date', flat=True).distinct()
-
-        penalizacion = clases_no_show * 35
-
-        full_data.append({
-            'client_id': client.id,
-            'client_name': f"{client.first_name} {client.last_name}",
-            'membership': active_payment.membership.name,
-            'expected_classes': clases_esperadas,
-            'valid_classes': clases_validas,
-            'no_show_classes': clases_no_show,
-            'date_no_show': date_no_show,
-            'penalty': penalizacion,
-        })
+        ).values_list('client_id', 'class_date').distinct().order_by('client_id', 'class_date')
+        for client_id, class_date in no_show_dates:
+            dates_by_client[client_id].append(class_date)
+
+    full_data = [
+        {
+            'client_id': row['id'],
+            'client_name': f"{row['first_name']} {row['last_name']}",
+            'membership': row['membership_name'],
+            'expected_classes': row['expected_classes'],
+            'valid_classes': row['valid_classes'],
+            'no_show_classes': row['no_show_classes'],
+            'date_no_show': dates_by_client[row['id']],
+            'penalty': row['penalty'],
+        }
+        for row in rows
+    ]
 
+    if page is not None:
+        return paginator.get_paginated_response(full_data)
     return Response(full_data)
 
 
 @api_view(['GET'])
 def get_weekly_closing_summary(request):
+    """
+    Resumen de cierres por semana leído de la tabla DailyClosing.
+    Acepta ?start=YYYY-MM-DD y ?end=YYYY-MM-DD (ambos opcionales).
+    """
     from collections import defaultdict
-    from django.db.models import Sum
     from datetime import datetime
-    from django.utils.timezone import localtime
-
-    all_dates = Payment.objects.dates('date_paid', 'day')
+    from .models import DailyClosing
+
+    closings = DailyClosing.objects.order_by('date')
+    for param, lookup in (('start', 'date__gte'), ('end', 'date__lte')):
+        value = request.query_params.get(param)
+        if value:
+            parsed = _parse_date(value)
+            if not parsed:
+                return Response({"detail": f"Fecha inválida para '{param}'. Usa YYYY-MM-DD."}, status=400)
+            closings = closings.filter(**{lookup: parsed})
+
+    if not closings and not DailyClosing.objects.exists():
+        # Tabla recién desplegada (o vaciada): se llena con todo el historial.
+        # El comando rebuild_daily_closings hace lo mismo de forma manual.
+        refresh_recent_daily_closings()
+        closings = closings.all()
 
     data_por_dia = []
-    for date in all_dates:
-        pagos = Payment.objects.filter(date_paid__date=date)
-        ventas = Venta.objects.filter(date_sold__date=date)
-        bookings = Booking.objects.filter(class_date=date)
-
-        total_pago = sum(p.amount for p in pagos)
-        total_venta = sum(v.total_amount for v in ventas)
-
-        tarjeta = pagos.filter(payment_method='Tarjeta').aggregate(Sum('amount'))['amount__sum'] or 0
-        efectivo = pagos.filter(payment_method='Efectivo').aggregate(Sum('amount'))['amount__sum'] or 0
-        visalink = pagos.filter(payment_method='Visalink').aggregate(Sum('amount'))['amount__sum'] or 0
-
-        pruebas = bookings.filter(client__trial_used=True).count()
-        clases_ind = bookings.filter(schedule__is_individual=True).count()
-        paquetes = pagos.count()
-        asistencias = bookings.count()
+    for closing in closings:
+        asistencias = closing.attendance
+        paquetes = closing.payment_count
         porcentaje = round((paquetes / asistencias * 100), 2) if asistencias else 0
 
         data_por_dia.append({
-            "fecha": date.isoformat(),
-            "total": round(total_pago + total_venta, 2),
+            "fecha": closing.date.isoformat(),
+            "total": round(closing.payment_total + closing.venta_total, 2),
             "asistencias": asistencias,
             "paquetes_vendidos": paquetes,
-            "clases_individuales": clases_ind,
-            "pruebas": pruebas,
-            "tarjeta": float(tarjeta),
-            "efectivo": float(efectivo),
-            "visalink": float(visalink),
+            "clases_individuales": closing.individual_classes,
+            "pruebas": closing.trials,
+            "tarjeta": float(closing.card_total),
+            "efectivo": float(closing.cash_total),
+            "visalink": float(closing.visalink_total),
             "porcentaje_compra": porcentaje
         })
 
@@ -194,9 +271,11 @@ def get_weekly_closing_summary(request):
 
 class BookingViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
-    queryset = Booking.objects.all()
+    queryset = Booking.objects.select_related('client', 'schedule', 'membership')
     serializer_class = BookingSerializer
 
+    # Atómico para que la reserva y su correo encolado se confirmen juntos.
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -218,21 +297,17 @@ class BookingViewSet(viewsets.ModelViewSet):
         if is_manual_checkin and request.data.get('attendance_status') == 'attended':
             attendance_status = 'attended'
 
-        # 1) Validar cupo en el horario
-        current_bookings = Booking.objects.filter(schedule=schedule, class_date=request.data.get("class_date")).count()
-        if current_bookings >= schedule.capacity:
-            return Response(
-                {"detail": "No hay cupo disponible para este horario."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # 1) El cupo se valida al guardar (ver _save_with_seat), en la misma
+        #    transacción que inserta la reserva.
 
         # 2) Si seleccionó clase individual
         if selected_membership == 1:
-            booking = serializer.save(
+            booking = self._save_with_seat(
+                serializer,
                 membership=Membership.objects.get(pk=1),
                 status='pending'
             )
-            send_individual_booking_pending_email(booking)
+            queue_email('individual_booking_pending', individual_booking_pending_message(booking))
             return Response({
                 "detail": "Tu reserva para la clase individual está pendiente de confirmación. Realiza el depósito del 40% (aprox. Q36) para confirmar tu clase.",
                 "booking_id": booking.id
@@ -240,11 +315,11 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         # 3) Si aún tiene clase de prueba gratuita
         if not client.trial_used:
-            booking = serializer.save(attendance_status=attendance_status)
+            booking = self._save_with_seat(serializer, attendance_status=attendance_status)
             if attendance_status == 'attended':
                 client.trial_used = True
                 client.save(update_fields=['trial_used'])
-            send_booking_confirmation_email(booking)
+            queue_email('booking_confirmation', booking_confirmation_message(booking))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         # # 4) Si no tiene membresía activa
@@ -255,9 +330,9 @@ class BookingViewSet(viewsets.ModelViewSet):
         #     )
 
         # 5) Validar límite de clases según membresía o promoción
-        latest_payment = Payment.objects.filter(client=client).order_by('-date_paid').first()
+        latest_payment = client.latest_payment
         if latest_payment:
-            membership_plan = latest_payment.membership
+            membership_plan = client.latest_payment_membership
             from .utils import count_valid_monthly_bookings
 
             monthly_bookings = count_valid_monthly_bookings(client)
@@ -294,21 +369,208 @@ class BookingViewSet(viewsets.ModelViewSet):
 
 
         # 6) Crear reserva normal con membresía activa
-        booking = serializer.save(
+        booking = self._save_with_seat(
+            serializer,
             membership=client.active_membership,
             attendance_status=attendance_status
         )
         if attendance_status == 'attended' and not client.trial_used:
             client.trial_used = True
             client.save(update_fields=['trial_used'])
-        send_booking_confirmation_email(booking)
+        queue_email('booking_confirmation', booking_confirmation_message(booking))
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def _save_with_seat(self, serializer, **kwargs):
+        """Ocupa un cupo del ledger y guarda la reserva de forma atómica."""
+        schedule = serializer.validated_data['schedule']
+        class_date = serializer.validated_data.get('class_date') or timezone.now().date()
+        with transaction.atomic():
+            if not reserve_seat(schedule, class_date):
+                raise NoSeatAvailable()
+            invalidate_availability(class_date)
+            booking = serializer.save(**kwargs)
+            track_usage_change(None, usage_key(booking))
+            schedule_daily_closing_refresh(booking.class_date)
+            return booking
+
+    def perform_update(self, serializer):
+        booking = serializer.instance
+        previous_slot = (booking.schedule_id, booking.class_date)
+        previous_holds = booking.status in SEAT_HOLDING_STATUSES
+        previous_usage = usage_key(booking)
+        previous_client = booking.client_id
+
+        data = serializer.validated_data
+        schedule = data.get('schedule', booking.schedule)
+        new_slot = (schedule.id, data.get('class_date', booking.class_date))
+        new_holds = data.get('status', booking.status) in SEAT_HOLDING_STATUSES
+
+        with transaction.atomic():
+            # Solo cambia el cupo si la reserva pasa a ocupar otro lugar.
+            if new_holds and (not previous_holds or new_slot != previous_slot):
+                if not reserve_seat(schedule, new_slot[1]):
+                    raise NoSeatAvailable()
+            if previous_holds and (not new_holds or new_slot != previous_slot):
+                release_seat(*previous_slot)
+            booking = serializer.save()
+            track_usage_change(previous_usage, usage_key(booking))
+            rebuild_no_show_streaks({previous_client, booking.client_id})
+            invalidate_availability(previous_slot[1], booking.class_date)
+            schedule_daily_closing_refresh(previous_slot[1], booking.class_date)
+
+    def perform_destroy(self, instance):
+        # El cupo, el uso mensual, la disponibilidad y el cierre del día se
+        # actualizan en signals.booking_deleted, también en los borrados en cascada.
+        with transaction.atomic():
+            instance.delete()
+            rebuild_no_show_streaks([instance.client_id])
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create_bookings(self, request):
+        """
+        Reserva el mismo horario en varias fechas (clientes recurrentes).
+
+        Recibe 'client_id', 'schedule_id' y 'dates' (lista YYYY-MM-DD) o un rango
+        'start'/'end', del que se toman los días que coinciden con el horario.
+        Valida cupo y límite mensual de todo el lote con consultas agrupadas,
+        inserta con bulk_create y envía un solo correo de resumen.
+
+        Si otra solicitud reserva alguna de las mismas fechas al mismo tiempo,
+        no se crea nada y se responde 409 con las fechas en conflicto.
+        """
+        client = Client.objects.select_related(
+            'latest_payment__promotion', 'latest_payment_membership'
+        ).filter(pk=request.data.get('client_id')).first()
+        if not client:
+            return Response({"detail": "Cliente no encontrado."}, status=400)
+
+        schedule = Schedule.objects.select_related('class_type').filter(pk=request.data.get('schedule_id')).first()
+        if not schedule:
+            return Response({"detail": "Horario no válido."}, status=400)
+        if schedule.is_individual:
+            return Response({"detail": "Las clases individuales se reservan una por una."}, status=400)
+
+        if request.data.get('dates'):
+            class_dates = {_parse_date(str(d)) for d in request.data.get('dates')}
+            if None in class_dates:
+                return Response({"detail": "Formato de fecha inválido. Usa YYYY-MM-DD."}, status=400)
+        else:
+            start = _parse_date(str(request.data.get('start', '')))
+            end = _parse_date(str(request.data.get('end', '')))
+            if not start or not end or end < start:
+                return Response({"detail": "Envía 'dates' o un rango 'start'/'end' válido."}, status=400)
+            class_dates = {
+                start + timedelta(days=i) for i in range((end - start).days + 1)
+                if DAY_CODE_MAP[(start + timedelta(days=i)).weekday()] == schedule.day
+            }
+
+        if not class_dates:
+            return Response({"detail": "No hay fechas para reservar."}, status=400)
+        if len(class_dates) > MAX_BULK_BOOKINGS:
+            return Response({"detail": f"Máximo {MAX_BULK_BOOKINGS} fechas por solicitud."}, status=400)
+
+        if not client.trial_used and not client.latest_payment_id:
+            return Response({"detail": "La clase de prueba se reserva de forma individual."}, status=400)
+
+        results = {}
+        today = timezone.now().date()
+        for class_date in class_dates:
+            if class_date < today:
+                results[class_date] = "La fecha ya pasó."
+            elif DAY_CODE_MAP[class_date.weekday()] != schedule.day:
+                results[class_date] = "El horario no corresponde a ese día."
+
+        already_booked = set(
+            Booking.objects.filter(
+                client=client, schedule=schedule, class_date__in=class_dates
+            ).values_list('class_date', flat=True)
+        )
+        for class_date in already_booked:
+            results.setdefault(class_date, "Ya tienes una reserva para esa clase.")
+
+        # Límite mensual: se aplica por mes de la clase, leyendo los contadores mensuales.
+        latest_payment = client.latest_payment
+        if latest_payment:
+            limit = None
+            if latest_payment.promotion_id:
+                promotion = latest_payment.promotion
+                promo_instance = PromotionInstance.objects.filter(
+                    promotion=promotion,
+                    clients=client
+                ).select_related('promotion').order_by('-created_at').first()
+                if not promo_instance:
+                    return Response({"detail": "Esta promoción no está asociada correctamente a tu cuenta."}, status=400)
+                if not promo_instance.is_active():
+                    return Response({"detail": "La promoción que adquiriste ya no está activa."}, status=400)
+                limit = promotion.clases_por_cliente
+            elif client.latest_payment_membership.classes_per_month:
+                limit = client.latest_payment_membership.classes_per_month
+
+            if limit:
+                from .utils import count_valid_monthly_bookings
+
+                remaining = {}
+                for class_date in sorted(class_dates):
+                    if class_date in results:
+                        continue
+                    month = (class_date.year, class_date.month)
+                    if month not in remaining:
+                        remaining[month] = limit - count_valid_monthly_bookings(client, class_date)
+                    if remaining[month] <= 0:
+                        results[class_date] = "Has alcanzado tu límite de clases para ese mes."
+                    else:
+                        remaining[month] -= 1
+
+        candidates = class_dates - set(results)
+        try:
+            with transaction.atomic():
+                reserved = reserve_seats(schedule, candidates)
+                for class_date in candidates - reserved:
+                    results[class_date] = NoSeatAvailable.default_detail
+
+                created = Booking.objects.bulk_create([
+                    Booking(
+                        client=client,
+                        schedule=schedule,
+                        class_date=class_date,
+                        membership=client.active_membership,
+                    )
+                    for class_date in sorted(reserved)
+                ])
+                invalidate_availability(*reserved)
+                sync_monthly_usage({(client.id, d.year, d.month) for d in reserved})
+                schedule_daily_closing_refresh(*reserved)
+
+                if created:
+                    queue_email('bulk_booking_confirmation', bulk_booking_confirmation_message(client, schedule, created))
+        except IntegrityError:
+            # unique (client, schedule, class_date): la transacción se revirtió completa,
+            # incluidos los cupos ocupados en el ledger.
+            conflicts = Booking.objects.filter(
+                client=client, schedule=schedule, class_date__in=candidates
+            ).values_list('class_date', flat=True).order_by('class_date')
+            return Response({
+                "detail": "Otra solicitud reservó algunas de estas fechas al mismo tiempo. No se creó ninguna reserva.",
+                "conflicts": [d.isoformat() for d in conflicts],
+            }, status=status.HTTP_409_CONFLICT)
+
+        booking_ids = {b.class_date: b.id for b in created}
+        return Response({
+            "created": len(created),
+            "failed": len(results),
+            "results": [
+                {"date": d.isoformat(), "status": "created", "booking_id": booking_ids[d]}
+                if d in booking_ids else
+                {"date": d.isoformat(), "status": "failed", "detail": results[d]}
+                for d in sorted(class_dates)
+            ]
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
 
     @action(detail=False, methods=['get'], url_path='by-client/(?P<client_id>[^/.]+)')
     def bookings_by_client(self, request, client_id=None):
-        bookings = Booking.objects.filter(client_id=client_id).order_by('-class_date')
+        bookings = self.get_queryset().filter(client_id=client_id).order_by('-class_date')
         serializer = BookingHistorialSerializer(bookings, many=True)
         return Response(serializer.data)
 
@@ -322,7 +584,11 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         serializer = BookingAttendanceUpdateSerializer(booking, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            previous_usage = usage_key(booking)
+            with transaction.atomic():
+                serializer.save()
+                track_usage_change(previous_usage, usage_key(booking))
+                rebuild_no_show_streaks([booking.client_id])
             client = booking.client
             if not client.trial_used:
                 client.trial_used = True
@@ -333,7 +599,7 @@ class BookingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='historial')
     def historial_asistencia(self, request):
         date_filter = request.query_params.get("date")
-        queryset = Booking.objects.filter(status='active').select_related('client', 'schedule', 'schedule__class_type')
+        queryset = Booking.objects.filter(status='active').select_related('client', 'schedule', 'membership')
 
 
         if date_filter:
@@ -353,10 +619,17 @@ class BookingViewSet(viewsets.ModelViewSet):
         reason = request.data.get('reason', '')
         cancelled_by = request.data.get('by', 'client')  # client, instructor, admin
 
-        booking.status = 'cancelled'
-        booking.cancellation_type = cancelled_by
-        booking.cancellation_reason = reason
-        booking.save()
+        with transaction.atomic():
+            if booking.status in SEAT_HOLDING_STATUSES:
+                release_seat(booking.schedule_id, booking.class_date)
+                invalidate_availability(booking.class_date)
+            previous_usage = usage_key(booking)
+            booking.status = 'cancelled'
+            booking.cancellation_type = cancelled_by
+            booking.cancellation_reason = reason
+            booking.save()
+            track_usage_change(previous_usage, None)
+            rebuild_no_show_streaks([booking.client_id])
 
         return Response({"message": "Reserva cancelada correctamente."})
 
@@ -364,7 +637,9 @@ class BookingViewSet(viewsets.ModelViewSet):
     def reschedule_booking(self, request, pk=None):
         booking = self.get_object()
         new_schedule_id = request.data.get('schedule_id')
-        new_date = request.data.get('class_date')
+        new_date = _parse_date(str(request.data.get('class_date', '')))
+        if not new_date:
+            return Response({"error": "Fecha inválida. Usa YYYY-MM-DD."}, status=400)
 
         try:
             new_schedule = Schedule.objects.get(id=new_schedule_id)
@@ -379,19 +654,22 @@ class BookingViewSet(viewsets.ModelViewSet):
         ).exists():
             return Response({"error": "Ya tienes una reserva para esa clase."}, status=400)
 
-        # Validar capacidad
-        count = Booking.objects.filter(
-            schedule=new_schedule,
-            class_date=new_date,
-            status='active'
-        ).count()
-        if count >= new_schedule.capacity:
-            return Response({"error": "No hay cupo disponible."}, status=400)
-
-        # Actualizar
-        booking.schedule = new_schedule
-        booking.class_date = new_date
-        booking.save()
+        # Validar capacidad y mover el cupo en la misma transacción
+        with transaction.atomic():
+            if booking.status in SEAT_HOLDING_STATUSES:
+                if not reserve_seat(new_schedule, new_date):
+                    return Response({"error": "No hay cupo disponible."}, status=400)
+                release_seat(booking.schedule_id, booking.class_date)
+                invalidate_availability(booking.class_date, new_date)
+
+            previous_usage = usage_key(booking)
+            previous_date = booking.class_date
+            booking.schedule = new_schedule
+            booking.class_date = new_date
+            booking.save()
+            track_usage_change(previous_usage, usage_key(booking))
+            rebuild_no_show_streaks([booking.client_id])
+            schedule_daily_closing_refresh(previous_date, new_date)
 
         return Response({"message": "Clase reagendada correctamente."})
     
@@ -768,18 +1046,33 @@ class BookingViewSet(viewsets.ModelViewSet):
         # ───────── bulk DB ops ──────────────────────────────────────
         with transaction.atomic():
             if bulk_updates:
+                for cli in bulk_updates:
+                    cli.search_text = cli.build_search_text()
                 Client.objects.bulk_update(
                     bulk_updates,
-                    ["phone", "dpi", "notes", "status", "trial_used"],
+                    ["phone", "dpi", "notes", "status", "trial_used", "search_text"],
                 )
+                sync_search_tokens(bulk_updates)
             if bulk_payments:
-                Payment.objects.bulk_create(
-                    bulk_payments, ignore_conflicts=True, batch_size=500
+                # Sin ignore_conflicts: se necesitan los ids para los eventos de ingresos.
+                Payment.objects.bulk_create(bulk_payments, batch_size=500)
+                record_bulk_revenue(
+                    'payment', [(p.pk, p.date_paid, p.amount) for p in bulk_payments]
                 )
+                refresh_payment_snapshots({p.client_id for p in bulk_payments})
+                schedule_daily_closing_refresh(*{p.date_paid for p in bulk_payments})
             if bulk_bookings:
                 Booking.objects.bulk_create(
                     bulk_bookings, ignore_conflicts=True, batch_size=500
                 )
+                sync_seat_ledger({(b.schedule_id, b.class_date) for b in bulk_bookings})
+                invalidate_availability(*{b.class_date for b in bulk_bookings})
+                sync_monthly_usage({
+                    (b.client_id, b.class_date.year, b.class_date.month)
+                    for b in bulk_bookings
+                })
+                schedule_daily_closing_refresh(*{b.class_date for b in bulk_bookings})
+                rebuild_no_show_streaks({b.client_id for b in bulk_bookings})
 
         return Response(
             {"message": f"Se importaron {success} filas.", "errors": failed},
@@ -793,7 +1086,15 @@ class BookingViewSet(viewsets.ModelViewSet):
     def clientes_en_riesgo(self, request):
         from accounts.serializers import ClientSerializer
 
-        clientes = get_clients_with_consecutive_no_shows(limit=3)
+        # ?limit= mínimo de inasistencias seguidas (por defecto 3)
+        try:
+            limit = max(1, int(request.query_params.get('limit', 3)))
+        except ValueError:
+            return Response({"detail": "'limit' debe ser un número entero."}, status=400)
+
+        clientes = get_clients_with_consecutive_no_shows(limit=limit).select_related(
+            'current_membership', 'latest_payment_membership'
+        )
         data = ClientSerializer(clientes, many=True).data
         return Response(data)
 
@@ -805,66 +1106,83 @@ class AvailabilityView(APIView):
     """
     Endpoint que, dado un parámetro 'date' (YYYY-MM-DD), devuelve los slots disponibles
     para ese día, calculando el número de reservas activas y comparándolo con la capacidad.
+
+    Con 'start' y 'end' (YYYY-MM-DD, máximo MAX_RANGE_DAYS días) devuelve la grilla
+    completa del rango en una sola respuesta.
     """
     def get(self, request, format=None):
+        start_str = request.query_params.get('start')
+        end_str = request.query_params.get('end')
+        if start_str or end_str:
+            return self._get_range(start_str, end_str)
+
         date_str = request.query_params.get('date')
         if not date_str:
             return Response({"detail": "Se requiere el parámetro 'date' en formato YYYY-MM-DD."}, status=400)
         
-        requested_date = parse_date(date_str)
+        requested_date = _parse_date(date_str)
         if not requested_date:
             return Response({"detail": "Formato de fecha inválido."}, status=400)
-        
-        # Mapear weekday (0=Monday) a código de día definido en Schedule.DAY_CHOICES
-        day_code_map = {0: 'MON', 1: 'TUE', 2: 'WED', 3: 'THU', 4: 'FRI', 5: 'SAT', 6: 'SUN'}
-        day_code = day_code_map[requested_date.weekday()]
-        
-        # Obtener todas las plantillas de horario (Schedule) para ese día
-        schedules = Schedule.objects.filter(day=day_code)
-        
-        slots = []
-        for schedule in schedules:
-            # Contar reservas activas para este schedule en la fecha solicitada
-            booking_count = Booking.objects.filter(
-                schedule=schedule, 
-                class_date=requested_date,
-                status='active'
-            ).exclude(attendance_status='cancelled').count()
-
-            available = booking_count < schedule.capacity
-            
-            # Convertir el campo time_slot (e.g. '05:00') en un datetime combinando con requested_date
-            start_time = datetime.combine(requested_date, datetime.strptime(schedule.time_slot, "%H:%M").time())
-            end_time = start_time + timedelta(hours=1)  # Cada slot dura 1 hora
-            
-            slot = {
-                "schedule_id": schedule.id,
-                "class_type": schedule.class_type.name if schedule.class_type else None,
-                "is_individual": schedule.is_individual,
-                "capacity": schedule.capacity,
-                "booked": booking_count,
-                "coach":schedule.coach.first_name + " " + schedule.coach.last_name,
-                "available": available,
-                "start": start_time.isoformat(),
-                "end": end_time.isoformat()
-            }
-            slots.append(slot)
-        
+
+        slots = get_availability(requested_date, requested_date)[requested_date]
         response_data = {
             "date": requested_date.isoformat(),
-            "slots": sorted(slots, key=lambda x: x["start"])  # ⬅️ ORDENA POR start
+            "slots": slots
         }
         return Response(response_data)
 
+    def _get_range(self, start_str, end_str):
+        if not start_str or not end_str:
+            return Response({"detail": "Se requieren 'start' y 'end' en formato YYYY-MM-DD."}, status=400)
+
+        start = _parse_date(start_str)
+        end = _parse_date(end_str)
+        if not start or not end:
+            return Response({"detail": "Formato de fecha inválido."}, status=400)
+        if end < start:
+            return Response({"detail": "'end' debe ser posterior o igual a 'start'."}, status=400)
+        if (end - start).days >= MAX_RANGE_DAYS:
+            return Response({"detail": f"El rango máximo es de {MAX_RANGE_DAYS} días."}, status=400)
+
+        availability = get_availability(start, end)
+        return Response({
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "days": [
+                {"date": day.isoformat(), "slots": slots}
+                for day, slots in availability.items()
+            ]
+        })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def availability_cache_status(request):
+    return Response(availability_cache_stats())
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def performance_metrics(request):
+    """Histogramas de PerformanceMiddleware en formato de texto de Prometheus."""
+    return HttpResponse(metrics_registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
 class MembershipViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny]
     queryset = Membership.objects.all()
     serializer_class = MembershipSerializer
 
 
+class ClientesPotencialesPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
 class PlanIntentViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]  # Puedes cambiar esto si solo admin puede ver todo
-    queryset = PlanIntent.objects.all()
+    queryset = PlanIntent.objects.select_related(
+        'membership', 'client__current_membership', 'client__latest_payment_membership'
+    )
     serializer_class = PlanIntentSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['is_confirmed', 'client']  # <- aquí
@@ -872,46 +1190,59 @@ class PlanIntentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Si se quiere filtrar solo por cliente actual (por token, por ejemplo)
-        return PlanIntent.objects.all()
+        return self.queryset.all()
 
     @action(detail=False, methods=['get'], url_path='by-client/(?P<client_id>[^/.]+)')
     def by_client(self, request, client_id=None):
-        intents = PlanIntent.objects.filter(client_id=client_id).order_by('-selected_at')
+        intents = self.get_queryset().filter(client_id=client_id).order_by('-selected_at')
         serializer = self.get_serializer(intents, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'], url_path='potenciales')
     def clientes_potenciales(self, request):
+        """
+        Clientes con clase de prueba pendiente y clientes que ya la usaron pero
+        tienen un plan sin confirmar, con su último PlanIntent pendiente.
+        Paginado (?page=, ?page_size=); el número de consultas no depende de
+        la cantidad de clientes.
+        """
         from accounts.models import Client
         from accounts.serializers import ClientSerializer
 
-        response_data = []
+        latest_pending = PlanIntent.objects.filter(
+            client=OuterRef('pk'), is_confirmed=False
+        ).order_by('-selected_at', '-id')
+
+        # 1) trial_used=False primero, 2) luego los que ya la usaron y tienen plan pendiente
+        clients = Client.objects.annotate(
+            pending_intent_id=Subquery(latest_pending.values('id')[:1])
+        ).filter(
+            Q(trial_used=False) | Q(pending_intent_id__isnull=False)
+        ).select_related(
+            'current_membership', 'latest_payment_membership'
+        ).order_by('trial_used', 'id')
 
-        # 1) Clientes con clase de prueba pendiente (trial_used=False)
-        trial_clients = Client.objects.filter(trial_used=False)
+        paginator = ClientesPotencialesPagination()
+        page = paginator.paginate_queryset(clients, request)
 
-        for client in trial_clients:
-            plan_intent = PlanIntent.objects.filter(client=client, is_confirmed=False).order_by('-selected_at').first()
+        intents = PlanIntent.objects.select_related('membership').in_bulk(
+            [c.pending_intent_id for c in page if c.pending_intent_id]
+        )
+
+        response_data = []
+        for client in page:
+            plan_intent = intents.get(client.pending_intent_id)
+            if plan_intent:
+                plan_intent.client = client  # ya cargado, evita otra consulta al serializar
             response_data.append({
                 "client": ClientSerializer(client).data,
                 "plan_intent": PlanIntentSerializer(plan_intent).data if plan_intent else None
             })
 
-        # 2) Clientes que ya usaron su clase de prueba pero tienen plan no confirmado
-        with_trial_used = Client.objects.filter(trial_used=True)
-        for client in with_trial_used:
-            plan_intent = PlanIntent.objects.filter(client=client, is_confirmed=False).order_by('-selected_at').first()
-            if plan_intent:
-                response_data.append({
-                    "client": ClientSerializer(client).data,
-                    "plan_intent": PlanIntentSerializer(plan_intent).data
-                })
-
-
-        return Response(response_data)
+        return paginator.get_paginated_response(response_data)
     
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all().order_by('-date_paid')
+    queryset = Payment.objects.select_related('client', 'membership', 'promotion').order_by('-date_paid')
     serializer_class = PaymentSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['client']
@@ -974,35 +1305,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
         except PlanIntent.DoesNotExist:
             pass
 
-        year = payment.date_paid.year
-        month = payment.date_paid.month
-        monthly, _ = MonthlyRevenue.objects.get_or_create(year=year, month=month)
-        monthly.total_amount = F('total_amount') + payment.amount
-        monthly.payment_count = F('payment_count') + 1
-        monthly.save()
-
+        # MonthlyRevenue se actualiza al guardar el pago (ver Payment.save / RevenueEvent)
         return Response(PaymentSerializer(payment).data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-
-        amount = instance.amount
-        date_paid = instance.date_paid
         client = instance.client
 
+        # signals.payment_deleted registra el evento de ingresos y actualiza MonthlyRevenue
         self.perform_destroy(instance)
 
-        year = date_paid.year
-        month = date_paid.month
-
-        try:
-            monthly = MonthlyRevenue.objects.get(year=year, month=month)
-            monthly.total_amount = F('total_amount') - amount
-            monthly.payment_count = F('payment_count') - 1
-            monthly.save()
-        except MonthlyRevenue.DoesNotExist:
-            pass
-
         if not Payment.objects.filter(client=client, valid_until__gte=timezone.now().date()).exists():
             client.status = 'I'
             client.save(update_fields=['status'])
@@ -1011,30 +1323,46 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'], url_path='en-gracia')
     def clientes_en_gracia(self, request):
+        """
+        Clientes cuyo último pago venció dentro de los últimos ?days= días
+        (por defecto GRACE_DAYS), ordenados por fecha de vencimiento.
+        """
+        from accounts.serializers import ClientCompactSerializer
+        from django.db.models import Window
+        from django.db.models.functions import FirstValue, RowNumber
+
+        try:
+            days = max(1, int(request.query_params.get('days', GRACE_DAYS)))
+        except ValueError:
+            return Response({"detail": "'days' debe ser un número entero."}, status=400)
+
         today = timezone.now().date()
-        response = []
+        window_start = today - timedelta(days=days)
+        latest_first = [F('valid_until').desc(), F('date_paid').desc(), F('id').desc()]
 
+        # Último pago de cada cliente (ventana por cliente); solo clientes con
+        # algún pago vencido dentro del periodo de gracia.
         pagos_en_gracia = Payment.objects.filter(
-            valid_until__lt=today,
-            valid_until__gte=today - timedelta(days=7)
-        ).select_related('client', 'membership')
-
-        vistos = set()
+            client_id__in=Payment.objects.filter(
+                valid_until__lt=today, valid_until__gte=window_start
+            ).values('client_id')
+        ).annotate(
+            row_number=Window(RowNumber(), partition_by=F('client_id'), order_by=latest_first),
+            latest_valid_until=Window(FirstValue('valid_until'), partition_by=F('client_id'), order_by=latest_first),
+        ).filter(
+            row_number=1,
+            latest_valid_until__lt=today,
+            latest_valid_until__gte=window_start,
+        ).select_related('client', 'membership').order_by('valid_until', 'client_id')
 
+        response = []
         for pago in pagos_en_gracia:
-            client_id = pago.client.id
-            if client_id in vistos:
-                continue
-            vistos.add(client_id)
-
-            grace_ends = pago.valid_until + timedelta(days=7)
-
             response.append({
-                "client": ClientSerializer(pago.client).data,
+                "client": ClientCompactSerializer(pago.client).data,
                 "membership": pago.membership.name,
                 "last_payment_date": pago.date_paid.date(),
                 "valid_until": pago.valid_until,
-                "grace_ends": grace_ends,
+                "grace_ends": pago.valid_until + timedelta(days=days),
                 "can_renew_at_previous_price": True
             })
 
@@ -1069,31 +1397,8 @@ class VentaViewSet(viewsets.ModelViewSet):
     ordering_fields = ['date_sold', 'total_amount']
     ordering = ['-date_sold']
 
-    def perform_create(self, serializer):
-        venta = serializer.save()
-        date = venta.date_sold.date()
-        year, month = date.year, date.month
-
-        monthly, _ = MonthlyRevenue.objects.get_or_create(year=year, month=month)
-        monthly.total_amount = F('total_amount') + venta.total_amount
-        monthly.venta_total = F('venta_total') + venta.total_amount
-        monthly.venta_count = F('venta_count') + 1
-        monthly.save()
-
-    def perform_destroy(self, instance):
-        date = instance.date_sold.date()
-        amount = instance.total_amount
-        year, month = date.year, date.month
-        super().perform_destroy(instance)
-
-        try:
-            monthly = MonthlyRevenue.objects.get(year=year, month=month)
-            monthly.total_amount = F('total_amount') - amount
-            monthly.venta_total = F('venta_total') - amount
-            monthly.venta_count = F('venta_count') - 1
-            monthly.save()
-        except MonthlyRevenue.DoesNotExist:
-            pass
+    # Alta y edición actualizan MonthlyRevenue desde Venta.save; la baja, desde signals.venta_deleted
+    # (eventos RevenueEvent en la misma transacción).
 
 class ScheduleViewSet(viewsets.ModelViewSet):
     queryset = Schedule.objects.select_related('coach', 'class_type').all()
@@ -1112,11 +1417,17 @@ class ScheduleViewSet(viewsets.ModelViewSet):
         day_code = today.strftime('%a').upper()[:3]
 
         if coach_id:
-            schedules = Schedule.objects.filter(day=day_code, coach_id=coach_id).order_by('time_slot')
-            print("if")
+            schedules = Schedule.objects.filter(day=day_code, coach_id=coach_id)
         else:
-            schedules = Schedule.objects.filter(day=day_code, coach=request.user).order_by('time_slot')
-            print("else")
+            schedules = Schedule.objects.filter(day=day_code, coach=request.user)
+        # Las reservas del día se traen en una sola consulta para todos los horarios
+        schedules = schedules.select_related('class_type').prefetch_related(
+            Prefetch(
+                'booking_set',
+                queryset=Booking.objects.filter(class_date=today, status='active').select_related('client'),
+                to_attr='today_bookings',
+            )
+        ).order_by('time_slot')
 
         serializer = ScheduleWithBookingsSerializer(
             schedules,
@@ -1179,19 +1490,68 @@ def get_today_payments_total(request):
         "count": payments.count()
         })
 
+# Segundos que se guarda en cache cada combinación de filtros del resumen por tipo de
+# clase. Se invalida con las reservas; el TTL es solo una red de seguridad.
+SUMMARY_BY_CLASS_TYPE_TTL = 60
+
+
 @api_view(['GET'])
 def summary_by_class_type(request):
+    """
+    Reservas por tipo de clase, calculado en la base de datos con una sola
+    consulta agrupada por (tipo de clase, mes).
+
+    Filtros opcionales: ?start=YYYY-MM-DD, ?end=YYYY-MM-DD, ?status=active,pending
+    y ?attendance=attended,no_show (listas separadas por coma).
+    Cada elemento incluye el desglose mensual en "by_month".
+    """
+    from django.core.cache import cache
+    from django.db.models.functions import TruncMonth
     from .models import Booking
 
-    bookings = Booking.objects.select_related("schedule__class_type").all()
-    counter = Counter()
+    bookings = Booking.objects.filter(schedule__class_type__isnull=False)
+
+    for param, lookup in (('start', 'class_date__gte'), ('end', 'class_date__lte')):
+        value = request.query_params.get(param)
+        if value:
+            parsed = _parse_date(value)
+            if not parsed:
+                return Response({"detail": f"Fecha inválida para '{param}'. Usa YYYY-MM-DD."}, status=400)
+            bookings = bookings.filter(**{lookup: parsed})
+
+    for param, lookup in (('status', 'status__in'), ('attendance', 'attendance_status__in')):
+        value = request.query_params.get(param)
+        if value:
+            bookings = bookings.filter(**{lookup: [v.strip() for v in value.split(',') if v.strip()]})
+
+    # La llave incluye la versión de reservas, así que cualquier reserva o
+    # cambio de horario que invalide la disponibilidad invalida también esto.
+    cache_key = None
+    if shared_cache_enabled():
+        cache_key = f"summary_by_class_type:{bookings_cache_version()}:" + "&".join(
+            f"{k}={request.query_params.get(k)}" for k in ('start', 'end', 'status', 'attendance')
+        )
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+    rows = (
+        bookings.annotate(month=TruncMonth('class_date'))
+        .values('schedule__class_type__name', 'month')
+        .annotate(count=Count('id'))
+        .order_by('schedule__class_type__name', 'month')
+    )
 
-    for b in bookings:
-        if b.schedule and b.schedule.class_type:
-            name = b.schedule.class_type.name
-            counter[name] += 1
+    summary = {}
+    for row in rows:
+        name = row['schedule__class_type__name']
+        item = summary.setdefault(name, {"class_type": name, "count": 0, "by_month": []})
+        item["count"] += row['count']
+        item["by_month"].append({"month": row['month'].strftime('%Y-%m'), "count": row['count']})
 
-    data = [{"class_type": k, "count": v} for k, v in counter.items()]
+    data = sorted(summary.values(), key=lambda item: -item["count"])
+    if cache_key:
+        cache.set(cache_key, data, SUMMARY_BY_CLASS_TYPE_TTL)
     return Response(data)
 
 @api_view(['GET'])
@@ -1212,14 +1572,37 @@ def     attendance_summary(request):
     summary = Counter(b.class_date.strftime('%A') for b in bookings)
     return Response(summary)
 
+@api_view(['GET'])
+def occupancy_heatmap(request):
+    """
+    Mapa de ocupación día × bloque horario × semana.
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (se extienden a semanas completas).
+    Por defecto, las últimas 4 semanas incluyendo la actual.
+    """
+    today = now().date()
+    start = _parse_date(request.query_params.get('start', '')) if request.query_params.get('start') else today - timedelta(weeks=3)
+    end = _parse_date(request.query_params.get('end', '')) if request.query_params.get('end') else today
+    if not start or not end:
+        return Response({"detail": "Fechas inválidas. Usa YYYY-MM-DD."}, status=400)
+    if start > end:
+        return Response({"detail": "'start' debe ser anterior o igual a 'end'."}, status=400)
+
+    week_start, week_end = week_bounds(start, end)
+    if (week_end - week_start).days // 7 + 1 > MAX_HEATMAP_WEEKS:
+        return Response({"detail": f"El rango no puede superar {MAX_HEATMAP_WEEKS} semanas."}, status=400)
+
+    return Response(build_occupancy_heatmap(start, end))
+
 class PromotionViewSet(viewsets.ModelViewSet):
-    queryset = Promotion.objects.all().order_by('-start_date')
+    queryset = Promotion.objects.select_related('membership').order_by('-start_date')
     serializer_class = PromotionSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['membership', 'start_date', 'end_date']
 
 class PromotionInstanceViewSet(viewsets.ModelViewSet):
-    queryset = PromotionInstance.objects.all().order_by('-created_at')
+    queryset = PromotionInstance.objects.select_related('promotion__membership').prefetch_related(
+        Prefetch('clients', queryset=Client.objects.select_related('current_membership', 'latest_payment_membership'))
+    ).order_by('-created_at')
     serializer_class = PromotionInstanceSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['promotion', 'created_at']
@@ -1271,17 +1654,9 @@ class PromotionInstanceViewSet(viewsets.ModelViewSet):
         except PlanIntent.DoesNotExist:
             pass
 
-        # Recalcular ingresos mensuales
-        year = payment.date_paid.year
-        month = payment.date_paid.month
-        revenue, _ = MonthlyRevenue.objects.get_or_create(year=year, month=month)
-        revenue.total_amount = F('total_amount') + payment.amount
-        revenue.payment_count = F('payment_count') + 1
-        revenue.save()
-
         # Correo opcional
         try:
-            send_subscription_confirmation_email(payment)
+            queue_email('subscription_confirmation', subscription_confirmation_message(payment))
         except Exception as e:
             print(f"Error al enviar correo: {e}")
 
@@ -85,6 +85,8 @@ SIMPLE_JWT = {
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # Tiempos por request (Server-Timing para staff y /api/studio/metrics/)
+    'studio.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -134,6 +136,21 @@ DATABASES = {
 }
 
 
+# Cache
+# El cache de disponibilidad necesita un backend compartido por todos los
+# workers (si no, una invalidación en un worker no llega a los demás). Con
+# REDIS_URL se usa Redis; sin él queda el LocMemCache por proceso de Django y
+# studio.availability.shared_cache_enabled() desactiva esos caches.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 